@@ -0,0 +1,1549 @@
+from WebCrawler import WebCrawler, stemmer, parse_page
+from concurrent.futures import ProcessPoolExecutor
+from SearchEngine import SearchEngine, load_search_engine
+from QueryServer import QueryServer
+from Instrumentation import stats
+from NearDuplicates import SimHashIndex, simhash, hamming_distance
+from CompressedPostings import CompressedIndex
+from InvertedIndex import search_sorted
+from Fetcher import CONDITIONAL_HEADERS
+from Tokenizer import decode_page, tokenize
+from UrlFilter import VALID_URL, parse_robots_txt, canonicalize_url
+from bs4 import BeautifulSoup
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from contextlib import redirect_stdout
+import argparse
+import tracemalloc
+import platform
+import sys
+import threading
+import random
+import time
+import io
+import os
+import pickle
+import tempfile
+import hashlib
+import gzip
+import json
+import codecs
+import string
+import re
+import urllib.parse
+import urllib.request
+import numpy as np
+
+
+'''
+generates a synthetic site: {path: (content type, body)}
+every page links to links_per_page pages of the site and a few pages are broken links
+
+structure is "random" (links to random pages) or "tree" (links to the child pages and back
+to the parent page). The other parts of the site are linked from random pages: duplicates
+copies of pages under another name, near_duplicates copies with a session token and a
+timestamp added, images GIF files, private pages in the /private/ directory that
+robots.txt disallows and external links to other hosts
+'''
+def generate_site(num_pages, links_per_page=5, words_per_page=200, prefix="/site", seed=0, structure="random",
+                  duplicates=0, images=0, private=0, external=0, near_duplicates=0):
+    rng = random.Random(seed)
+    vocabulary = ["word" + str(i) for i in range(2000)]
+    site = {prefix + "/robots.txt": ("text/plain", b"User-agent: *\nDisallow: /private/\n")}
+
+    # the other parts are drawn from their own generator, so the pages of a site without them stay the same
+    extras = random.Random(seed + 1)
+    extra_links = {}  # page number : links to the other parts
+    for path in ["copy" + str(j) + ".html" for j in range(duplicates)] \
+            + ["images/image" + str(j) + ".gif" for j in range(images)] \
+            + ["private/page" + str(j) + ".html" for j in range(private)] \
+            + ["http://external" + str(j) + ".example.com/" for j in range(external)] \
+            + ["session" + str(j) + ".html" for j in range(near_duplicates)]:
+        extra_links.setdefault(extras.randrange(num_pages), []).append(path)
+
+    for i in range(num_pages):
+        if structure == "tree":
+            links = ["page" + str(c) + ".html" for c in range(i * links_per_page + 1, min((i + 1) * links_per_page + 1, num_pages))]
+            if i > 0:
+                links.append("page" + str((i - 1) // links_per_page) + ".html")
+        else:
+            links = ["page" + str(rng.randrange(num_pages)) + ".html" for _ in range(links_per_page)]
+        if i % 10 == 0:
+            links.append("missing" + str(i) + ".html")
+        links += extra_links.get(i, [])
+
+        body = "<html><head><title>Page " + str(i) + "</title></head><body><p>" \
+               + " ".join(rng.choice(vocabulary) for _ in range(words_per_page)) + "</p>" \
+               + "".join('<a href="' + link + '">link</a>' for link in links) + "</body></html>"
+
+        site[prefix + "/page" + str(i) + ".html"] = ("text/html", body.encode("utf-8"))
+
+    site[prefix + "/"] = site[prefix + "/page0.html"]
+
+    for j in range(duplicates):
+        site[prefix + "/copy" + str(j) + ".html"] = site[prefix + "/page" + str(extras.randrange(num_pages)) + ".html"]
+    for j in range(images):
+        site[prefix + "/images/image" + str(j) + ".gif"] = ("image/gif", b"GIF89a" + bytes(extras.randrange(256) for _ in range(64)))
+    for j in range(near_duplicates):
+        body = site[prefix + "/page" + str(extras.randrange(num_pages)) + ".html"][1].decode("utf-8")
+        stamp = "<p>session " + hashlib.sha1(str(j).encode("utf-8")).hexdigest() + " generated " \
+                + time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(extras.randrange(2 ** 31))) + "</p>"
+        site[prefix + "/session" + str(j) + ".html"] = ("text/html", body.replace("</body>", stamp + "</body>").encode("utf-8"))
+    for j in range(private):
+        body = "<html><head><title>Private " + str(j) + "</title></head><body><p>" \
+               + " ".join(extras.choice(vocabulary) for _ in range(words_per_page)) + "</p></body></html>"
+        site[prefix + "/private/page" + str(j) + ".html"] = ("text/html", body.encode("utf-8"))
+
+    return site
+
+
+class SiteServer:
+    '''
+    Serves a synthetic site from a local http.server on a background thread
+
+    latency is the number of seconds every response is delayed by, to stand in for a remote host
+    responses carry an ETag and answer conditional requests with 304 Not Modified
+    with keep_alive connections stay open between requests (HTTP/1.1), and with compress
+    text pages are sent gzip compressed to the clients that accept it. connect_latency is
+    the number of seconds every new connection is delayed by, to stand in for the handshakes
+    '''
+    def __init__(self, site, latency=0, keep_alive=True, compress=False, connect_latency=0):
+        self.site = site
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.keep_alive = keep_alive
+        self.compress = compress
+        self.requests = 0  # number of requests answered
+        self.full_responses = 0  # number of requests answered with a body
+        self.connections = 0  # number of connections accepted
+        self.bytes_sent = 0  # bytes of the bodies sent
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    # returns the base url of the server
+    def url(self, prefix="/site"):
+        return "http://127.0.0.1:" + str(self.server.server_address[1]) + prefix
+
+    def make_handler(self):
+        site_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" if site_server.keep_alive else "HTTP/1.0"
+            disable_nagle_algorithm = True  # headers and body are written separately, see TCP_NODELAY
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                site_server.connections += 1
+                if site_server.connect_latency > 0:
+                    time.sleep(site_server.connect_latency)
+
+            def do_GET(self, send_body=True):
+                if site_server.latency > 0:
+                    time.sleep(site_server.latency)
+
+                if self.path not in site_server.site:
+                    self.send_error(404)
+                    return
+
+                content_type, body = site_server.site[self.path]
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                site_server.requests += 1
+
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Type", content_type)
+                if site_server.compress and content_type.startswith("text/") \
+                        and "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body)
+                    self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+
+                if send_body:
+                    site_server.full_responses += 1
+                    site_server.bytes_sent += len(body)
+                    self.wfile.write(body)
+
+            def do_HEAD(self):
+                self.do_GET(send_body=False)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+# returns {DocumentID: [words]} of num_docs synthetic documents with a zipf-like word distribution
+def generate_doc_words(num_docs, words_per_doc=200, vocabulary_size=20000, seed=0):
+    rng = random.Random(seed)
+    vocabulary = generate_vocabulary(rng, vocabulary_size)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+    return {"doc" + str(i): rng.choices(vocabulary, weights, k=words_per_doc) for i in range(num_docs)}
+
+
+# returns vocabulary_size made up words, in groups of a root and its inflections
+def generate_vocabulary(rng, vocabulary_size):
+    roots = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 9)))
+             for _ in range(vocabulary_size // 4)]
+    return [root + suffix for root in roots for suffix in ["", "s", "ing", "ed"]]
+
+
+# yields (DocumentID, [words]) one document at a time, drawn like generate_doc_words but with numpy
+def iter_doc_words(num_docs, words_per_doc=200, vocabulary_size=20000, seed=0):
+    vocabulary = generate_vocabulary(random.Random(seed), vocabulary_size)
+    cumulative_weights = np.cumsum(1 / np.arange(1, len(vocabulary) + 1))
+    rng = np.random.default_rng(seed)
+
+    for i in range(num_docs):
+        draws = np.searchsorted(cumulative_weights, rng.random(words_per_doc) * cumulative_weights[-1])
+        yield "doc" + str(i), [vocabulary[w] for w in draws.tolist()]
+
+
+# the original build_frequency_matrix: every word is re-stemmed once per term
+def legacy_build_frequency_matrix(doc_words):
+    all_terms = sorted(set([stemmer.stem(word) for word_list in doc_words.values() for word in word_list]))
+    frequency_matrix = []
+
+    for term in all_terms:
+        frequency_count = []
+        for word_list in doc_words.values():
+            stemmed_word_list = [stemmer.stem(word) for word in word_list]
+            frequency_count.append(stemmed_word_list.count(term))
+        frequency_matrix.append(frequency_count)
+
+    return all_terms, frequency_matrix
+
+
+# times build_frequency_matrix on synthetic documents
+def bench_index(args):
+    for num_docs in args.docs:
+        doc_words = generate_doc_words(num_docs)
+
+        crawler = WebCrawler("http://127.0.0.1")
+        crawler.doc_words = doc_words
+        start = time.perf_counter()
+        crawler.build_frequency_matrix()
+        seconds = time.perf_counter() - start
+        print("{: <25} {: >10.3f} s   {} terms, {} postings".format(
+            str(num_docs) + " docs", seconds, len(crawler.all_terms), crawler.index.num_postings))
+
+        # with a warm stem cache, as when stemming at crawl time
+        start = time.perf_counter()
+        crawler.build_frequency_matrix()
+        print("{: <25} {: >10.3f} s".format("  warm stem cache", time.perf_counter() - start))
+
+        if num_docs <= args.legacy_max:
+            start = time.perf_counter()
+            all_terms, frequency_matrix = legacy_build_frequency_matrix(doc_words)
+            seconds = time.perf_counter() - start
+            same = all_terms == crawler.all_terms and \
+                frequency_matrix == [crawler.index.dense_row(t) for t in range(len(all_terms))]
+            print("{: <25} {: >10.3f} s   identical output: {}".format("  per-term loop", seconds, same))
+
+
+# returns a search engine indexed over synthetic documents
+def build_engine(num_docs, seed=0):
+    engine = SearchEngine("http://127.0.0.1")
+    engine.thesaurus = {}
+    engine.doc_words = generate_doc_words(num_docs, seed=seed)
+
+    for i, doc_id in enumerate(engine.doc_words):
+        engine.doc_titles[doc_id] = "Document " + str(i) + " " + " ".join(engine.doc_words[doc_id][:3])
+        engine.doc_urls[doc_id] = "http://127.0.0.1/doc" + str(i) + ".html"
+
+    engine.build_frequency_matrix()
+    return engine
+
+
+# returns num_queries random queries of 1 to 3 words taken from the documents
+def generate_queries(engine, num_queries, seed=0):
+    rng = random.Random(seed)
+    doc_words = list(engine.doc_words.values())
+    return [" ".join(rng.choice(rng.choice(doc_words)) for _ in range(rng.randint(1, 3))) for _ in range(num_queries)]
+
+
+# the original process_query ranking: every document is scored against the dense query vector
+def legacy_ranking(engine, user_query, k=6):
+    scores = {doc_id: 0 for doc_id in engine.doc_titles.keys()}
+
+    for t in engine.doc_titles.keys():
+        if len(set(user_query.split()).intersection(engine.doc_titles[t].lower().split())) > 0:
+            scores[t] = 0.25
+
+    query = [engine.stem(q) for q in user_query.split() if q not in engine.stop_words]
+    query = [q for q in query if engine.index.term_id(q) is not None]
+    query = [query.count(term) for term in engine.all_terms]
+    docs = engine.index.to_csr(dtype=np.int64)
+
+    for i, doc_id in enumerate(scores):
+        scores[doc_id] += engine.cosine_similarity(query, docs.getrow(i).toarray()[0].tolist())
+
+    sorted_scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    return [('%06.4f' % score, engine.doc_titles[doc_id]) for doc_id, score in sorted_scores if score > 0][:k]
+
+
+# returns the p50 and p99 of a list of latencies in milliseconds
+def percentiles(latencies):
+    return np.percentile(latencies, 50) * 1000, np.percentile(latencies, 99) * 1000
+
+
+# query latency of process_query across corpus sizes
+def bench_query(args):
+    for num_docs in args.docs:
+        engine = build_engine(num_docs)
+        queries = generate_queries(engine, args.queries)
+        latencies = []
+
+        with redirect_stdout(io.StringIO()):
+            for query in queries:
+                start = time.perf_counter()
+                engine.process_query(query, args.k, True)
+                latencies.append(time.perf_counter() - start)
+
+        print("{: <25} p50 {: >8.3f} ms   p99 {: >8.3f} ms".format(str(num_docs) + " docs", *percentiles(latencies)))
+
+        if num_docs <= args.legacy_max:
+            latencies = []
+            same = True
+
+            with redirect_stdout(io.StringIO()):
+                for query in queries[:args.legacy_queries]:
+                    start = time.perf_counter()
+                    ranking = legacy_ranking(engine, query, args.k)
+                    latencies.append(time.perf_counter() - start)
+                    same = same and ranking == [tuple(r[:2]) for r in engine.process_query(query, args.k, True)]
+
+            print("{: <25} p50 {: >8.3f} ms   p99 {: >8.3f} ms   identical ranking: {}".format(
+                "  exhaustive scoring", *percentiles(latencies), same))
+
+
+# returns (latencies, [result urls of each query]) of process_query over a list of queries
+def timed_queries(engine, queries, k):
+    latencies, results = [], []
+
+    with redirect_stdout(io.StringIO()):
+        for query in queries:
+            start = time.perf_counter()
+            ranking = engine.process_query(query, k, True)
+            latencies.append(time.perf_counter() - start)
+            results.append([r[2] for r in ranking])
+
+    return latencies, results
+
+
+# returns the mean recall@k of rankings against the exhaustive rankings of the same queries
+def recall_at_k(results, exhaustive):
+    recalls = [len(set(r).intersection(e)) / len(e) for r, e in zip(results, exhaustive) if len(e) > 0]
+    return sum(recalls) / len(recalls) if recalls else 1.0
+
+
+# query latency and recall@k of cluster pruned scoring against scoring every document
+def bench_pruned(args):
+    for num_docs in args.docs:
+        engine = build_engine(num_docs)
+        engine.set_clustering(0, "kmeans++", args.iterations)
+        engine.cluster_docs(args.clusters)
+        queries = generate_queries(engine, args.queries)
+
+        latencies, exhaustive = timed_queries(engine, queries, args.k)
+        print("{: <25} p50 {: >8.3f} ms   p99 {: >8.3f} ms".format(str(num_docs) + " docs", *percentiles(latencies)))
+
+        for probes in args.probes:
+            engine.set_cluster_probes(probes)
+            engine.get_cluster_vectors()
+            latencies, results = timed_queries(engine, queries, args.k)
+            recall = recall_at_k(results, exhaustive)
+            print("{: <25} p50 {: >8.3f} ms   p99 {: >8.3f} ms   recall@{} {:.3f}".format(
+                "  " + str(probes) + " of " + str(args.clusters) + " clusters", *percentiles(latencies), args.k, recall))
+
+            # probing every cluster scores every document, so it has to rank like exhaustive scoring
+            if probes >= len(engine.clusters):
+                assert recall == 1.0, "recall@" + str(args.k) + " of probing every cluster is " + str(recall)
+                assert results == exhaustive, "probing every cluster ranks differently from exhaustive scoring"
+
+        engine.set_cluster_probes(None)
+
+
+# latency of repeated queries with and without the query cache
+def bench_cache(args):
+    engine = build_engine(args.docs)
+    rng = random.Random(1)
+    distinct = generate_queries(engine, args.distinct)
+    queries = [rng.choice(distinct) for _ in range(args.queries)]
+
+    engine.set_query_cache(0)
+    latencies, uncached = timed_queries(engine, queries, args.k)
+    print("{: <25} p50 {: >8.3f} ms   p99 {: >8.3f} ms".format("no cache", *percentiles(latencies)))
+
+    engine.set_query_cache(args.size)
+    latencies, cached = timed_queries(engine, queries, args.k)
+    print("{: <25} p50 {: >8.3f} ms   p99 {: >8.3f} ms   hit rate {:.3f}   identical results: {}".format(
+        "cache of " + str(args.size), *percentiles(latencies), engine.query_cache.hit_rate(), cached == uncached))
+
+
+# overhead of the stage stats on query latency and index builds, then the report of the stats
+def bench_stats(args):
+    engine = build_engine(args.docs)
+    engine.set_query_cache(0)
+    queries = generate_queries(engine, args.queries)
+
+    for enabled in (False, True):
+        stats.enable(enabled)
+        stats.reset()
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            engine.build_frequency_matrix()
+        build = time.perf_counter() - start
+
+        latencies, _ = timed_queries(engine, queries, args.k)
+        print("{: <25} build {: >8.1f} ms   p50 {: >8.3f} ms   p99 {: >8.3f} ms".format(
+            "stats " + ("enabled" if enabled else "disabled"), build * 1000, *percentiles(latencies)))
+
+    print("\n" + stats.table())
+    stats.enable(False)
+
+
+# the original thesaurus expansion: the query is scored again after appending the synonyms
+def legacy_expansion(engine, user_query, k):
+    results = engine.process_query(user_query, k, True)
+
+    if len(results) < k / 2:
+        query = user_query.split()
+        for term in query:
+            if term in engine.thesaurus:
+                query += [syn for syn in engine.thesaurus[term] if syn not in query]
+        results = engine.process_query(" ".join(query), k, True)
+
+    return results
+
+
+# latency of sparse queries that need thesaurus expansion, against re-querying with the synonyms
+def bench_thesaurus(args):
+    engine = build_engine(args.docs)
+    engine.set_query_cache(0)
+    engine.set_synonym_weight(1)
+
+    # rare words with a few synonyms each, so most queries are expanded
+    rng = random.Random(2)
+    term_totals = engine.index.term_totals()
+    vocabulary = sorted({w for words in engine.doc_words.values() for w in words})
+    rare = [w for w in vocabulary if term_totals[engine.index.term_id(engine.stem(w))] <= 2]
+    engine.thesaurus = {w: rng.sample(vocabulary, 3) for w in rng.sample(rare, min(len(rare), args.queries))}
+    queries = list(engine.thesaurus)
+    engine.get_synonyms()
+
+    for name, rank in [("single pass", lambda q: engine.process_query(q, args.k)),
+                       ("re-query", lambda q: legacy_expansion(engine, q, args.k))]:
+        latencies, results = [], []
+        with redirect_stdout(io.StringIO()):
+            for query in queries:
+                start = time.perf_counter()
+                results.append(rank(query))
+                latencies.append(time.perf_counter() - start)
+
+        if name == "single pass":
+            single_pass = results
+        print("{: <25} p50 {: >8.3f} ms   p99 {: >8.3f} ms   identical results: {}".format(
+            name, *percentiles(latencies), results == single_pass))
+
+
+# the original title boost: every title is lower cased and split for every query
+def legacy_title_matches(engine, user_query):
+    query_words = set(user_query.split())
+    return [d for d, doc_id in enumerate(engine.index.docs)
+            if len(query_words.intersection(engine.doc_titles[doc_id].lower().split())) > 0]
+
+
+# title matches from the title index against scanning every title, and query latency of each title scoring
+def bench_titles(args):
+    for num_docs in args.docs:
+        engine = build_engine(num_docs)
+        engine.set_query_cache(0)
+        queries = generate_queries(engine, args.queries)
+        print(str(num_docs) + " docs")
+
+        for name, matches in [("title index", lambda q: engine.title_matches(set(q.split()))),
+                              ("title scan", lambda q: legacy_title_matches(engine, q))]:
+            latencies, results = [], []
+            for query in queries:
+                start = time.perf_counter()
+                results.append(matches(query))
+                latencies.append(time.perf_counter() - start)
+
+            if name == "title index":
+                indexed = results
+            print("{: <25} p50 {: >8.3f} ms   p99 {: >8.3f} ms   identical matches: {}".format(
+                "  " + name, *percentiles(latencies), results == indexed))
+
+        for mode in ("boost", "bm25f"):
+            engine.set_title_scoring(mode)
+            latencies, _ = timed_queries(engine, queries, args.k)
+            print("{: <25} p50 {: >8.3f} ms   p99 {: >8.3f} ms".format("  process_query, " + mode, *percentiles(latencies)))
+
+
+# batch_search throughput on a saved index with threads and processes, the regression benchmark of the search side
+def bench_batch(args):
+    with tempfile.TemporaryDirectory() as directory:
+        for num_docs in args.docs:
+            engine = build_engine(num_docs)
+            engine.set_query_cache(0)
+            queries = generate_queries(engine, args.queries)
+
+            index_file = os.path.join(directory, "index.idx")
+            engine.save_index(index_file)
+            with redirect_stdout(io.StringIO()):
+                engine.load_index(index_file)
+            print(str(num_docs) + " docs")
+
+            reference = None
+            for workers, processes in [(1, False)] + [(w, p) for w in args.workers for p in (False, True)]:
+                output = io.StringIO()
+                summary = engine.batch_search(queries, output, args.k, workers, processes, index_file)
+                results = [json.loads(line)["results"] for line in output.getvalue().splitlines()]
+                reference = results if reference is None else reference
+
+                name = "serial" if workers == 1 else str(workers) + (" processes" if processes else " threads")
+                print("{: <25} {: >8.1f} queries/sec   p50 {: >8.3f} ms   p99 {: >8.3f} ms   identical results: {}".format(
+                    "  " + name, summary["qps"], summary["p50_ms"], summary["p99_ms"], results == reference))
+
+
+'''
+latency of /search on a QueryServer with concurrent clients, the index file is rebuilt and
+reloaded halfway through to check a hot swap drops no requests
+'''
+def bench_server(args):
+    with tempfile.TemporaryDirectory() as directory:
+        for num_docs in args.docs:
+            engine = build_engine(num_docs)
+            queries = generate_queries(engine, args.queries)
+            index_file = os.path.join(directory, "index.idx")
+            engine.save_index(index_file)
+            settings = engine.query_settings()
+
+            with QueryServer(lambda filename: load_search_engine(filename, settings, 0), index_file, port=0) as server:
+                for clients in args.clients:
+                    latencies = []
+                    errors = []
+                    lock = threading.Lock()
+
+                    def client(part):
+                        for query in part:
+                            url = server.url() + "/search?" + urllib.parse.urlencode({"q": query, "k": args.k})
+                            start = time.perf_counter()
+                            try:
+                                with urllib.request.urlopen(url) as response:
+                                    response.read()
+                            except OSError as e:
+                                with lock:
+                                    errors.append(e)
+                                continue
+                            with lock:
+                                latencies.append(time.perf_counter() - start)
+
+                    threads = [threading.Thread(target=client, args=(queries[c::clients],)) for c in range(clients)]
+                    with redirect_stdout(io.StringIO()):
+                        start = time.perf_counter()
+                        for thread in threads:
+                            thread.start()
+
+                        # swap in a new index file while the clients are running
+                        time.sleep(args.swap_after)
+                        build_engine(num_docs, seed=1).save_index(index_file + ".new")
+                        os.replace(index_file + ".new", index_file)
+                        swap_start = time.perf_counter()
+                        server.reload()
+                        swap = time.perf_counter() - swap_start
+
+                        for thread in threads:
+                            thread.join()
+                        elapsed = time.perf_counter() - start
+
+                    print("{: <25} {: >8.1f} requests/sec   p50 {: >8.3f} ms   p99 {: >8.3f} ms   reload {: >8.1f} ms   errors {}".format(
+                        "  " + str(num_docs) + " docs, " + str(clients) + " clients", len(latencies) / elapsed,
+                        *percentiles(latencies), swap * 1000, len(errors)))
+
+
+# save/load time and time to first query of the index file against pickling the engine
+def bench_index_file(args):
+    for num_docs in args.docs:
+        engine = build_engine(num_docs)
+        query = generate_queries(engine, 1)[0]
+
+        with tempfile.TemporaryDirectory() as directory:
+            pickle_file = os.path.join(directory, "index.obj")
+            index_file = os.path.join(directory, "index.idx")
+
+            start = time.perf_counter()
+            with open(pickle_file, "wb") as f:
+                pickle.dump(engine.__dict__, f)
+            pickle_save = time.perf_counter() - start
+
+            start = time.perf_counter()
+            engine.save_index(index_file)
+            file_save = time.perf_counter() - start
+
+            with redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                pickled = SearchEngine("http://127.0.0.1")
+                with open(pickle_file, "rb") as f:
+                    pickled.__dict__.update(pickle.load(f))
+                pickle_load = time.perf_counter() - start
+                pickled.process_query(query, 6, True)
+                pickle_first = time.perf_counter() - start
+
+                start = time.perf_counter()
+                mapped = SearchEngine("http://127.0.0.1")
+                mapped.load_index(index_file)
+                file_load = time.perf_counter() - start
+                mapped.process_query(query, 6, True)
+                file_first = time.perf_counter() - start
+
+            print(str(num_docs) + " docs")
+            print("{: <25} {: >10.1f} MB   save {: >8.1f} ms   load {: >8.1f} ms   first query {: >8.1f} ms".format(
+                "  pickled __dict__", os.path.getsize(pickle_file) / 1e6, pickle_save * 1000, pickle_load * 1000,
+                pickle_first * 1000))
+            print("{: <25} {: >10.1f} MB   save {: >8.1f} ms   load {: >8.1f} ms   first query {: >8.1f} ms".format(
+                "  index file", os.path.getsize(index_file) / 1e6, file_save * 1000, file_load * 1000,
+                file_first * 1000))
+
+
+# changes the text of a fraction of the pages of a synthetic site and removes a few, returns the paths touched
+def mutate_site(site, fraction, seed=1):
+    rng = random.Random(seed)
+    pages = sorted(path for path in site if path.endswith(".html") and not path.endswith("/page0.html"))
+    touched = rng.sample(pages, int(len(pages) * fraction))
+
+    for i, path in enumerate(touched):
+        if i % 5 == 4:
+            del site[path]
+        else:
+            content_type, body = site[path]
+            site[path] = (content_type, body.replace(b"<p>", b"<p>updated" + str(i).encode("utf-8") + b" "))
+
+    return touched
+
+
+# incremental refresh of a crawled site against crawling and indexing it again
+def bench_refresh(args):
+    site = generate_site(args.pages)
+
+    with SiteServer(site, args.latency) as server:
+        engine = SearchEngine(server.url())
+        engine.thesaurus = {}
+        engine.set_concurrency(args.workers)
+        with redirect_stdout(io.StringIO()):
+            engine.crawl()
+            engine.build_frequency_matrix()
+            engine.cluster_docs()
+
+        touched = mutate_site(site, args.changed)
+        server.requests = server.full_responses = 0
+
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            engine.refresh_index()
+        refresh_time = time.perf_counter() - start
+        print("{: <25} {: >10.3f} s   {} requests, {} full responses ({} pages touched)".format(
+            "incremental refresh", refresh_time, server.requests, server.full_responses, len(touched)))
+
+        rebuilt = SearchEngine(server.url())
+        rebuilt.thesaurus = {}
+        rebuilt.set_concurrency(args.workers)
+        server.requests = server.full_responses = 0
+
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            rebuilt.crawl()
+            rebuilt.build_frequency_matrix()
+            rebuilt.cluster_docs()
+        print("{: <25} {: >10.3f} s   {} requests, {} full responses".format(
+            "full rebuild", time.perf_counter() - start, server.requests, server.full_responses))
+
+        same = sorted(engine.index.docs) == sorted(rebuilt.index.docs) and engine.all_terms == rebuilt.all_terms \
+            and sorted(engine.doc_titles.items()) == sorted(rebuilt.doc_titles.items())
+        print("same documents and terms as the rebuild: " + str(same))
+
+
+# returns {url: [links]} of a synthetic link graph with some outgoing and broken links on every page
+def generate_link_graph(num_urls, links_per_page=10, base="http://127.0.0.1/site", seed=0):
+    rng = random.Random(seed)
+    graph = {}
+
+    for i in range(num_urls):
+        links = ["page" + str(rng.randrange(num_urls)) + ".html" for _ in range(links_per_page)]
+        links.append("http://example" + str(rng.randrange(1000)) + ".com/")
+        links.append("broken link " + str(rng.randrange(1000)))
+        graph[base + "/page" + str(i) + ".html"] = links
+
+    return graph
+
+
+# the original list based bookkeeping of crawl: linear scans of the frontier and the url lists
+def legacy_walk(crawler, graph, start_url):
+    url_frontier, outgoing_urls, broken_urls = [start_url], [], []
+
+    while url_frontier:
+        current_page = url_frontier.pop(0)
+        pwd = crawler.get_pwd(current_page)
+        crawler.visited_urls[current_page] = ("", "")
+
+        for current_url in graph[current_page]:
+            if current_url is not None and pwd not in current_url:
+                current_url = urllib.parse.urljoin(pwd, current_url)
+
+            if current_url is not None and crawler.url_is_valid(current_url):
+                if crawler.url_is_within_scope(current_url) and current_url not in url_frontier:
+                    if current_url not in crawler.visited_urls.keys():
+                        url_frontier.append(current_url)
+                elif not crawler.url_is_within_scope(current_url) and current_url not in outgoing_urls:
+                    outgoing_urls.append(current_url)
+            elif current_url not in broken_urls and current_url is not None:
+                broken_urls.append(current_url)
+
+    return outgoing_urls, broken_urls
+
+
+# visits every page of a link graph with the crawler's frontier bookkeeping, without fetching
+def walk(crawler, graph, start_url):
+    crawler.url_frontier.append(start_url)
+
+    while crawler.url_frontier:
+        current_page = crawler.url_frontier.popleft()
+        crawler.visited_urls[current_page] = ("", "")
+        crawler.add_links(crawler.get_pwd(current_page), graph[current_page])
+
+    return crawler.outgoing_urls, crawler.broken_urls
+
+
+# links processed per second by the crawler bookkeeping on synthetic link graphs
+def bench_frontier(args):
+    base = "http://127.0.0.1/site"
+
+    for num_urls in args.urls:
+        graph = generate_link_graph(num_urls, base=base)
+        num_links = sum(len(links) for links in graph.values())
+
+        crawler = WebCrawler(base)
+        start = time.perf_counter()
+        outgoing_urls, broken_urls = walk(crawler, graph, base + "/page0.html")
+        seconds = time.perf_counter() - start
+        print("{: <25} {: >10.3f} s   {: >10.0f} links/sec   {} urls visited".format(
+            str(num_urls) + " urls", seconds, num_links / seconds, len(crawler.visited_urls)))
+
+        if num_urls <= args.legacy_max:
+            legacy = WebCrawler(base)
+            start = time.perf_counter()
+            legacy_outgoing, legacy_broken = legacy_walk(legacy, graph, base + "/page0.html")
+            seconds = time.perf_counter() - start
+            same = list(legacy.visited_urls) == list(crawler.visited_urls) and outgoing_urls == legacy_outgoing \
+                and broken_urls == legacy_broken
+            print("{: <25} {: >10.3f} s   {: >10.0f} links/sec   same visiting order: {}".format(
+                "  list bookkeeping", seconds, num_links / seconds, same))
+
+
+# the original tokenization: the repr of the page bytes is parsed and escape decoded as one string
+def legacy_tokenize(content, stop_words):
+    soup = BeautifulSoup(str(content), "lxml")
+    [s.extract() for s in soup('title')]
+
+    formatted_content = codecs.escape_decode(bytes(soup.get_text().lower(), "utf-8"))[0].decode("utf-8", errors='replace')
+    content_words = list(re.sub('[' + string.punctuation + ']', '', formatted_content).split())
+    content_words[0] = content_words[0][1:]
+
+    pattern = re.compile(r'^[a-zA-z](\S*)[a-zA-z0-9]$')
+    return [w for w in content_words if w not in stop_words and pattern.match(w)]
+
+
+def streaming_tokenize(content, stop_words):
+    soup = BeautifulSoup(decode_page(content), "lxml")
+    [s.extract() for s in soup('title')]
+
+    return list(tokenize(soup.strings, stop_words))
+
+
+# compares the original page tokenization with the streaming one in MB/s on one core
+def bench_tokenize(args):
+    with open(os.path.join("Input", "stopwords.txt")) as stop_words_file:
+        stop_words = [x.strip() for x in stop_words_file.readlines()]
+
+    for words_per_page in args.words:
+        pages = [body for content_type, body in generate_site(args.pages, words_per_page=words_per_page).values()
+                 if content_type == "text/html"]
+        megabytes = sum(len(page) for page in pages) / 1e6
+
+        start = time.perf_counter()
+        tokens = [streaming_tokenize(page, frozenset(stop_words)) for page in pages]
+        seconds = time.perf_counter() - start
+        print("{: <25} {: >10.2f} MB/s".format(str(words_per_page) + " words/page", megabytes / seconds))
+
+        start = time.perf_counter()
+        legacy_tokens = [legacy_tokenize(page, stop_words) for page in pages]
+        seconds = time.perf_counter() - start
+        print("{: <25} {: >10.2f} MB/s   identical output: {}".format(
+            "  repr and escape_decode", megabytes / seconds, legacy_tokens == tokens))
+
+
+# parses and counts the pages of a synthetic site on a pool of processes, returns (results, seconds)
+def timed_parse(pages, processes):
+    start = time.perf_counter()
+    with ProcessPoolExecutor(processes) as pool:
+        results = list(pool.map(parse_page, *zip(*pages), chunksize=max(1, len(pages) // (processes * 4))))
+    return results, time.perf_counter() - start
+
+
+# compares parsing pages and counting terms in process with a pool of worker processes
+def bench_parse(args):
+    with open(os.path.join("Input", "stopwords.txt")) as stop_words_file:
+        stop_words = frozenset(x.strip() for x in stop_words_file.readlines())
+
+    site = generate_site(args.pages, words_per_page=args.words)
+    pages = [(url, "/site/", body, "utf-8", stop_words, True)
+             for url, (content_type, body) in site.items() if content_type == "text/html"]
+
+    start = time.perf_counter()
+    serial = [parse_page(*page) for page in pages]
+    print("{: <25} {: >10.1f} pages/sec".format("in process", len(pages) / (time.perf_counter() - start)))
+
+    for processes in args.processes:
+        results, seconds = timed_parse(pages, processes)
+        print("{: <25} {: >10.1f} pages/sec   identical output: {}".format(
+            str(processes) + " processes", len(pages) / seconds, results == serial))
+
+    # counting the terms of crawled documents in build_frequency_matrix
+    doc_words = generate_doc_words(args.docs)
+    crawler = WebCrawler("http://127.0.0.1")
+    crawler.doc_words = doc_words
+    start = time.perf_counter()
+    crawler.build_frequency_matrix()
+    print("{: <25} {: >10.3f} s".format("build, in process", time.perf_counter() - start))
+
+    for processes in args.processes:
+        parallel = WebCrawler("http://127.0.0.1")
+        parallel.doc_words = doc_words
+        parallel.set_processes(processes)
+        start = time.perf_counter()
+        parallel.build_frequency_matrix()
+        seconds = time.perf_counter() - start
+        same = parallel.all_terms == crawler.all_terms and np.array_equal(parallel.index.tfs, crawler.index.tfs) \
+            and np.array_equal(parallel.index.doc_ids, crawler.index.doc_ids)
+        print("{: <25} {: >10.3f} s   identical output: {}".format(
+            "build, " + str(processes) + " processes", seconds, same))
+
+
+# the original clustering: one euclidean_distances call per (follower, leader) pair on min/max scaled tfs
+def legacy_cluster_docs(engine, k):
+    from sklearn.metrics.pairwise import euclidean_distances
+
+    X = engine.index.to_csr()
+    X = X / X.max()
+    leader_indices = random.sample(range(0, X.shape[0]), k)
+    clusters = {l: [] for l in leader_indices}
+
+    for f in range(X.shape[0]):
+        if f not in clusters:
+            distances = [euclidean_distances(X[f:f + 1], X[l:l + 1])[0][0] for l in clusters]
+            clusters[leader_indices[int(np.argmin(distances))]].append((f, min(distances)))
+
+    return clusters
+
+
+# times cluster_docs with each way of picking leaders
+def bench_cluster(args):
+    for num_docs in args.docs:
+        engine = build_engine(num_docs)
+        print(str(num_docs) + " docs")
+
+        for init, iterations in [("random", 0), ("kmeans++", 0), ("kmeans++", args.iterations)]:
+            engine.set_clustering(0, init, iterations)
+            start = time.perf_counter()
+            engine.cluster_docs(args.k)
+            seconds = time.perf_counter() - start
+
+            # mean distance of the followers to their leader
+            distances = [d for followers in engine.clusters.values() for _, d in followers]
+            print("{: <25} {: >10.3f} s   mean distance {:.4f}".format(
+                "  " + init + ", " + str(iterations) + " iterations", seconds, sum(distances) / len(distances)))
+
+        if num_docs <= args.legacy_max:
+            start = time.perf_counter()
+            legacy_cluster_docs(engine, args.k)
+            print("{: <25} {: >10.3f} s".format("  pairwise loop", time.perf_counter() - start))
+
+
+# crawls the server with the given number of workers, returns (crawler, seconds)
+def timed_crawl(seed_url, page_limit, workers=1, per_host_limit=None, delay=0):
+    crawler = WebCrawler(seed_url)
+    crawler.set_page_limit(page_limit)
+    crawler.set_concurrency(workers, per_host_limit, delay)
+
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        crawler.crawl()
+    return crawler, time.perf_counter() - start
+
+
+# stages of the benchmark suite, all in seconds
+SUITE_STAGES = ["crawl", "build_frequency_matrix", "cluster_docs", "save_index", "load_index", "queries", "query_p50",
+                "query_p99"]
+
+
+# returns the seconds a call takes
+def timed_call(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+'''
+runs the whole pipeline on a synthetic site served locally: crawl, build_frequency_matrix,
+cluster_docs, save_index, load_index and a query workload on the loaded index
+returns ({stage: seconds of every run}, {check: value}), the checks describe what was crawled
+'''
+def run_suite(args, site):
+    timings = {stage: [] for stage in SUITE_STAGES}
+
+    with SiteServer(site) as server, tempfile.TemporaryDirectory() as directory:
+        index_file = os.path.join(directory, "index.idx")
+
+        for _ in range(args.repeat):
+            engine = SearchEngine(server.url())
+            engine.set_concurrency(args.workers)
+            engine.set_clustering(args.seed)
+            loaded = SearchEngine(server.url())
+
+            with redirect_stdout(io.StringIO()):
+                timings["crawl"].append(timed_call(engine.crawl))
+                timings["build_frequency_matrix"].append(timed_call(engine.build_frequency_matrix))
+                timings["cluster_docs"].append(timed_call(engine.cluster_docs, args.clusters))
+                timings["save_index"].append(timed_call(engine.save_index, index_file))
+                timings["load_index"].append(timed_call(loaded.load_index, index_file))
+
+            loaded.set_query_cache(0)
+            latencies, _ = timed_queries(loaded, generate_queries(engine, args.queries, args.seed), args.k)
+            timings["queries"].append(sum(latencies))
+            timings["query_p50"].append(float(np.percentile(latencies, 50)))
+            timings["query_p99"].append(float(np.percentile(latencies, 99)))
+
+    engine.produce_duplicates()
+    checks = {"pages_crawled": engine.num_pages_crawled, "pages_indexed": engine.num_pages_indexed,
+              "broken_urls": len(engine.broken_urls), "graphic_urls": len(engine.graphic_urls),
+              "outgoing_urls": len(engine.outgoing_urls), "duplicate_docs": len(engine.duplicate_urls),
+              "disallowed_visited": sum(1 for url in engine.visited_urls if "/private/" in url),
+              "terms": len(engine.index), "postings": engine.index.num_postings}
+
+    return timings, checks
+
+
+'''
+end to end benchmark on a reproducible synthetic site, every stage is the median of repeat runs
+
+the results are compared with the JSON baseline file when it exists: a stage slower than
+the baseline by more than tolerance is a regression and the exit status is 1. --save
+writes the results as the new baseline.
+'''
+def bench_suite(args):
+    config = {name: getattr(args, name) for name in ("pages", "links", "words", "structure", "duplicates", "images",
+                                                     "private", "external", "workers", "clusters", "queries", "k", "seed")}
+    site = generate_site(args.pages, args.links, args.words, seed=args.seed, structure=args.structure,
+                         duplicates=args.duplicates, images=args.images, private=args.private, external=args.external)
+
+    timings, checks = run_suite(args, site)
+    results = {"config": config, "checks": checks,
+               "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                               "cpus": os.cpu_count(), "numpy": np.__version__},
+               "seconds": {stage: float(np.median(t)) for stage, t in timings.items()}}
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            print("Warning: " + args.baseline + " was recorded with another configuration.")
+        if baseline["checks"] != checks:
+            print("Warning: the crawl differs from the baseline: " + str(baseline["checks"]))
+
+    regressions = []
+    print("{: <25} {: >12} {: >12} {: >10}".format("Stage", "ms", "baseline ms", "change"))
+    for stage in SUITE_STAGES:
+        seconds = results["seconds"][stage]
+        line = "{: <25} {: >12.3f}".format(stage, seconds * 1000)
+
+        if baseline is not None and baseline["seconds"].get(stage):
+            change = seconds / baseline["seconds"][stage] - 1
+            line += " {: >12.3f} {: >+9.1f}%".format(baseline["seconds"][stage] * 1000, change * 100)
+            if change > args.tolerance:
+                regressions.append(stage)
+                line += "  REGRESSION"
+        print(line)
+
+    print("\n" + ", ".join(name + " " + str(value) for name, value in checks.items()))
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print("Baseline written to " + args.baseline + ".")
+    elif regressions:
+        print(str(len(regressions)) + " stages slower than the baseline by more than " +
+              str(round(args.tolerance * 100)) + "%: " + ", ".join(regressions))
+        sys.exit(1)
+
+
+'''
+documents indexed by crawls collapsing near-duplicates at several distances, then the time of
+SimHash index lookups against comparing every fingerprint, per document
+'''
+def bench_near_duplicates(args):
+    site = generate_site(args.pages, near_duplicates=args.near)
+    exact_docs = None
+
+    with SiteServer(site) as server:
+        for distance in [None] + args.distances:
+            engine = SearchEngine(server.url())
+            engine.thesaurus = {}
+            engine.set_near_duplicates(distance)
+
+            start = time.perf_counter()
+            with redirect_stdout(io.StringIO()):
+                engine.crawl()
+                engine.build_frequency_matrix()
+            elapsed = time.perf_counter() - start
+
+            exact_docs = engine.index.num_docs if exact_docs is None else exact_docs
+            print("{: <25} docs {: >6}   postings {: >8}   collapsed {: >4} of {}   crawl and build {: >8.1f} ms".format(
+                "exact" if distance is None else "within " + str(distance) + " bits", engine.index.num_docs,
+                engine.index.num_postings, exact_docs - engine.index.num_docs, args.near, elapsed * 1000))
+
+    # documents of random words like the pages of generate_site
+    rng = random.Random(0)
+    fingerprints = [simhash(["word" + str(rng.randrange(20000)) for _ in range(200)]) for _ in range(args.docs)]
+    for distance in args.distances:
+        index = SimHashIndex(distance)
+        start = time.perf_counter()
+        for doc_id, fingerprint in enumerate(fingerprints):
+            if index.find(fingerprint) is None:
+                index.add(doc_id, fingerprint)
+        banded = time.perf_counter() - start
+
+        start = time.perf_counter()
+        kept = []
+        for fingerprint in fingerprints:
+            if all(hamming_distance(fingerprint, f) > distance for f in kept):
+                kept.append(fingerprint)
+        scanned = time.perf_counter() - start
+
+        print("{: <25} banded {: >8.3f} ms/doc   every pair {: >8.3f} ms/doc   same result: {}".format(
+            str(args.docs) + " docs, " + str(distance) + " bits", banded * 1000 / args.docs, scanned * 1000 / args.docs,
+            len(index) == len(kept)))
+
+
+'''
+peak memory and time of recording and indexing documents with their words kept in memory
+against indexing them out of core with SPIMI at several memory budgets
+
+documents are generated one at a time, the way a crawl records them
+'''
+def bench_spimi(args):
+    reference = None
+
+    with tempfile.TemporaryDirectory() as directory:
+        for budget in [None] + args.budgets:
+            engine = SearchEngine("http://127.0.0.1")
+            engine.set_near_duplicates(None)
+            if budget is not None:
+                engine.set_spimi(os.path.join(directory, str(budget)), budget)
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            for i, (doc_id, words) in enumerate(iter_doc_words(args.docs)):
+                engine.record_page("http://127.0.0.1/doc" + str(i) + ".html", "http://127.0.0.1/", "Document " + str(i),
+                                   doc_id, words, [])
+            record = time.perf_counter() - start
+            runs = len(engine.spimi.runs) + 1 if budget is not None else 0
+
+            start = time.perf_counter()
+            engine.build_frequency_matrix()
+            build = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            index = (list(engine.index.terms), engine.index.offsets.tolist(), np.asarray(engine.index.doc_ids).tolist(),
+                     np.asarray(engine.index.tfs).tolist())
+            reference = index if reference is None else reference
+
+            print("{: <25} record {: >8.1f} ms   build {: >8.1f} ms   peak {: >8.1f} MB   runs {: >4}   identical index: {}".format(
+                "words in memory" if budget is None else "spimi, " + str(budget) + " MB", record * 1000, build * 1000,
+                peak / 2 ** 20, runs, index == reference))
+
+
+# returns the doc numbers in the postings of every term, decoding every posting of the terms
+def decoded_intersect(index, term_ids):
+    term_ids = sorted(term_ids, key=lambda t: index.offsets[t + 1] - index.offsets[t])
+    matches = index.term_docs(term_ids[0])
+    for t in term_ids[1:]:
+        matches = matches[search_sorted(matches, index.term_docs(t))[0]]
+    return matches
+
+
+# returns the mean seconds of repeats calls of function()
+def mean_time(function, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        function()
+    return (time.perf_counter() - start) / repeats
+
+
+'''
+size, decode throughput, query latency and intersections of compressed postings against flat arrays
+
+intersections are of the two to three most frequent terms of random queries, with skip pointers
+against decoding every posting of the terms
+'''
+def bench_postings(args):
+    for num_docs in args.docs:
+        engine = build_engine(num_docs)
+        engine.set_query_cache(0)
+        index = engine.index
+        queries = generate_queries(engine, args.queries)
+
+        start = time.perf_counter()
+        compressed = CompressedIndex.from_index(index)
+        encode = time.perf_counter() - start
+
+        postings = index.num_postings / 1e6
+        flat_decode = mean_time(lambda: (np.array(index.doc_ids), np.array(index.tfs)), args.repeats)
+        full_decode = mean_time(lambda: (compressed.doc_ids, compressed.tfs), args.repeats)
+        term_decode = mean_time(lambda: [compressed.term_postings(t) for t in range(len(compressed))], 1)
+
+        with tempfile.TemporaryDirectory() as directory:
+            engine.save_index(os.path.join(directory, "flat.idx"))
+            flat_file = os.path.getsize(os.path.join(directory, "flat.idx"))
+            engine.index = compressed
+            engine.save_index(os.path.join(directory, "compressed.idx"))
+            compressed_file = os.path.getsize(os.path.join(directory, "compressed.idx"))
+
+        engine.index = index
+        engine.index_changed()
+        flat_latencies, flat_results = timed_queries(engine, queries, args.k)
+        engine.index = compressed
+        engine.index_changed()
+        latencies, results = timed_queries(engine, queries, args.k)
+        engine.index = index
+
+        print(str(num_docs) + " docs, " + str(index.num_postings) + " postings")
+        print("{: <25} postings {: >8.2f} MB   index file {: >8.2f} MB   decode {: >8.1f} M postings/s".format(
+            "  flat arrays", index.postings_nbytes() / 1e6, flat_file / 1e6, postings / flat_decode))
+        print("{: <25} postings {: >8.2f} MB   index file {: >8.2f} MB   decode {: >8.1f} M postings/s   "
+              "by term {: >8.1f} M postings/s   encode {: >8.1f} ms".format(
+                  "  compressed", compressed.postings_nbytes() / 1e6, compressed_file / 1e6, postings / full_decode,
+                  postings / term_decode, encode * 1000))
+        print("{: <25} p50 {: >8.3f} ms   p99 {: >8.3f} ms".format("  queries, flat", *percentiles(flat_latencies)))
+        print("{: <25} p50 {: >8.3f} ms   p99 {: >8.3f} ms   identical results: {}".format(
+            "  queries, compressed", *percentiles(latencies), results == flat_results))
+
+        # the terms of the queries, and the rarest term of each query with the two most frequent terms
+        doc_freqs = index.doc_freqs()
+        frequent = np.argsort(-doc_freqs, kind="stable")[:2].tolist()
+        query_terms = [sorted(set(index.term_id(engine.stem(w)) for w in query.split()) - {None}) for query in queries]
+        term_lists = {"query terms": [term_ids for term_ids in query_terms if len(term_ids) > 1],
+                      "rare and frequent": [[min(term_ids, key=lambda t: doc_freqs[t])] + frequent
+                                            for term_ids in query_terms if term_ids]}
+
+        for name, lists in term_lists.items():
+            timings = []
+            for intersect in (index.intersect, compressed.intersect, lambda term_ids: decoded_intersect(compressed, term_ids)):
+                start = time.perf_counter()
+                matches = [intersect(term_ids).tolist() for term_ids in lists]
+                timings.append(((time.perf_counter() - start) / max(1, len(lists)) * 1000, matches))
+
+            print("{: <25} flat {: >8.3f} ms   skips {: >8.3f} ms   no skips {: >8.3f} ms   identical matches: {}".format(
+                "  intersect " + name, timings[0][0], timings[1][0], timings[2][0],
+                timings[0][1] == timings[1][1] == timings[2][1]))
+
+
+'''
+documents scored per query and latency of MaxScore top k retrieval against scoring every document
+in the postings of the query terms, for queries of one to three words and of two to six words
+'''
+def bench_top_k(args):
+    for num_docs in args.docs:
+        engine = build_engine(num_docs)
+        engine.set_query_cache(0)
+        short_queries = generate_queries(engine, args.queries)
+        long_queries = [a + " " + b for a, b in zip(short_queries, generate_queries(engine, args.queries, seed=1))]
+
+        print(str(num_docs) + " docs")
+        for name, queries in (("1 to 3 words", short_queries), ("2 to 6 words", long_queries)):
+            runs = []
+            for pruning in (False, True):
+                engine.set_top_k_pruning(pruning)
+                stats.enable()
+                stats.reset()
+                latencies, results = timed_queries(engine, queries, args.k)
+                runs.append((latencies, results, stats.counters["docs_scored"] / len(queries),
+                             stats.counters["postings_scored"] / len(queries)))
+                stats.enable(False)
+
+            print("{: <25} p50 {: >8.3f} ms   p99 {: >8.3f} ms   docs scored {: >8.1f}   postings scored {: >8.1f}".format(
+                "  " + name + ", every doc", *percentiles(runs[0][0]), runs[0][2], runs[0][3]))
+            print("{: <25} p50 {: >8.3f} ms   p99 {: >8.3f} ms   docs scored {: >8.1f}   postings scored {: >8.1f}   "
+                  "identical results: {}".format("  " + name + ", MaxScore", *percentiles(runs[1][0]), runs[1][2],
+                                                 runs[1][3], runs[1][1] == runs[0][1]))
+
+        engine.set_top_k_pruning(False)
+
+
+# returns a robots.txt of about num_rules rules: disallowed directories with allowed subdirectories, and wildcards
+def generate_robots_txt(num_rules, seed=0):
+    rng = random.Random(seed)
+    lines = ["User-agent: *", "Disallow: /*.pdf$", "Disallow: /*?session="]
+
+    for i in range(num_rules // 2):
+        lines.append("Disallow: /dir" + str(i) + "/")
+        if rng.random() < 0.5:
+            lines.append("Allow: /dir" + str(i) + "/public/")
+        else:
+            lines.append("Disallow: /page" + str(i))
+
+    return "\n".join(lines) + "\n"
+
+
+# returns random paths of pages in the directories of generate_robots_txt, some of them matching its rules
+def generate_paths(num_paths, num_rules, seed=0):
+    rng = random.Random(seed)
+    paths = []
+
+    for _ in range(num_paths):
+        directory = "/dir" + str(rng.randrange(num_rules)) + "/" + rng.choice(["", "public/", "a/b/", "public/c/"])
+        page = "page" + str(rng.randrange(num_rules)) + rng.choice([".html", ".html", ".pdf", ".html?session=1"])
+        paths.append(directory + page if rng.random() < 0.8 else "/" + page)
+
+    return paths
+
+
+# the longest rule matching a path decides, found by trying every rule
+def scanned_allowed(rules, path):
+    longest, allowed = 0, True
+
+    for rule, rule_allowed in rules.rules:
+        if "*" in rule or rule.endswith("$"):
+            matches = re.match(".*".join(re.escape(part) for part in rule.rstrip("$").split("*"))
+                               + ("$" if rule.endswith("$") else ""), path) is not None
+        else:
+            matches = path.startswith(rule)
+
+        if matches and (len(rule) > longest or (len(rule) == longest and rule_allowed)):
+            longest, allowed = len(rule), rule_allowed
+
+    return allowed
+
+
+# urls and their canonical form, checked before the link filter is timed
+CANONICAL_URLS = [("HTTP://Example.COM:80/a/../b.html#top", "http://example.com/b.html"),
+                  ("http://h/a/../../b", "http://h/b"), ("http://h/a/b/./../c/", "http://h/a/c/"),
+                  ("http://h/a/..", "http://h/"), ("https://h:443?q=../x", "https://h/?q=../x")]
+
+
+# the original link filter: the url regex compiled on every call and the seed url looked up anywhere in the url
+def legacy_filter_link(pwd, url, seed_url):
+    if pwd not in url:
+        url = urllib.parse.urljoin(pwd, url)
+    if not re.compile(VALID_URL.pattern, re.IGNORECASE).match(url):
+        return None
+    return url, seed_url in url
+
+
+# the link filter of add_links: the precompiled url regex, the canonical url and its prefix checked against the seed url
+def filter_link(crawler, pwd, url):
+    if pwd not in url:
+        url = urllib.parse.urljoin(pwd, url)
+    if not crawler.url_is_valid(url):
+        return None
+    url = canonicalize_url(url)
+    return url, crawler.url_is_within_scope(url)
+
+
+'''
+robots.txt checks per second of the rule trie against trying every rule and against the original
+lookup of the directory of a url in the disallowed directories, which ignores Allow and wildcard
+rules, then links filtered per second by the crawler against the original link filter
+'''
+def bench_url_filter(args):
+    base = "http://127.0.0.1/site"
+    crawler = WebCrawler(base)
+
+    for num_rules in args.rules:
+        rules = parse_robots_txt(generate_robots_txt(num_rules))
+        paths = generate_paths(args.urls, num_rules)
+        disallowed_dirs = set(base + path for path, allowed in rules.rules if not allowed)
+
+        print(str(len(rules)) + " rules, " + str(len(paths)) + " urls")
+        timings = []
+        for name, allowed in (("trie", rules.allowed), ("every rule", lambda path: scanned_allowed(rules, path)),
+                              ("directory lookup", lambda path: crawler.get_pwd(base + path) not in disallowed_dirs)):
+            start = time.perf_counter()
+            decisions = [allowed(path) for path in paths]
+            timings.append((name, time.perf_counter() - start, decisions))
+
+        for name, seconds, decisions in timings:
+            print("{: <25} {: >12.0f} urls/sec   decisions differing from the trie: {}".format(
+                "  " + name, len(paths) / seconds, sum(a != b for a, b in zip(decisions, timings[0][2]))))
+
+    wrong = [(url, canonicalize_url(url)) for url, canonical in CANONICAL_URLS if canonicalize_url(url) != canonical]
+    print("canonical urls: " + ("ok" if not wrong else "wrong " + str(wrong)))
+
+    graph = generate_link_graph(max(1, args.urls // 12), base=base)
+    links = [(crawler.get_pwd(url), link) for url, page_links in graph.items() for link in page_links]
+    print(str(len(links)) + " links")
+    for name, filter_links in (("  link filter", lambda: [filter_link(crawler, pwd, url) for pwd, url in links]),
+                               ("  original", lambda: [legacy_filter_link(pwd, url, base) for pwd, url in links])):
+        start = time.perf_counter()
+        filtered = filter_links()
+        seconds = time.perf_counter() - start
+        print("{: <25} {: >12.0f} links/sec   {} in scope".format(
+            name, len(links) / seconds, sum(1 for f in filtered if f is not None and f[1])))
+
+
+# the original fetch: urlopen on a new connection for every page, without compression, downloading graphics
+def legacy_fetch(url, validators=None):
+    request = urllib.request.Request(url)
+    for validator, value in (validators or {}).items():
+        request.add_header(CONDITIONAL_HEADERS[validator], value)
+
+    handle = urllib.request.urlopen(request)
+    content = handle.read()
+    validators = {v: handle.headers[v] for v in CONDITIONAL_HEADERS if handle.headers.get(v)}
+    return content, validators, handle.headers.get_content_charset()
+
+
+'''
+pages crawled per second, connections opened and body bytes sent by the site for the original
+fetch against the pooled keep-alive connections of HttpClient, without and with gzip compression
+'''
+def bench_fetch(args):
+    site = generate_site(args.pages, images=args.images, seed=1)
+    baseline = None
+
+    for name, compress, fetch in (("urlopen per page", False, legacy_fetch), ("pooled connections", False, None),
+                                  ("pooled, gzip", True, None)):
+        with SiteServer(site, args.latency, compress=compress, connect_latency=args.connect_latency) as server:
+            crawler = WebCrawler(server.url())
+            crawler.set_concurrency(args.workers)
+            if fetch is not None:
+                crawler.fetch_page = fetch
+
+            start = time.perf_counter()
+            with redirect_stdout(io.StringIO()):
+                crawler.crawl()
+            seconds = time.perf_counter() - start
+
+        output = (list(crawler.visited_urls), crawler.doc_words, list(crawler.graphic_urls), list(crawler.broken_urls))
+        output = json.loads(json.dumps(output).replace(server.url(), ""))
+        baseline = baseline or output
+        print("{: <25} {: >10.1f} pages/sec   {: >6} connections   {: >10.2f} MB sent   same pages: {}".format(
+            name, crawler.num_pages_crawled / seconds, server.connections, server.bytes_sent / 1e6, output == baseline))
+
+
+# compares the serial crawl loop with the concurrent one in pages/sec
+def bench_crawl(args):
+    site = generate_site(args.pages)
+
+    with SiteServer(site, args.latency) as server:
+        serial, serial_time = timed_crawl(server.url(), args.pages)
+        print("{: <25} {: >10.1f} pages/sec".format("serial", serial.num_pages_crawled / serial_time))
+
+        for workers in args.workers:
+            crawler, seconds = timed_crawl(server.url(), args.pages, workers, args.perhost, args.delay)
+            same = crawler.visited_urls == serial.visited_urls and crawler.doc_words == serial.doc_words \
+                and crawler.broken_urls == serial.broken_urls
+            print("{: <25} {: >10.1f} pages/sec   identical output: {}".format(
+                str(workers) + " workers", crawler.num_pages_crawled / seconds, same))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search Engine benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    crawl_parser = subparsers.add_parser("crawl", help="Serial vs concurrent crawl of a local synthetic site.")
+    crawl_parser.add_argument("--pages", type=int, default=60, help="Number of pages in the site.")
+    crawl_parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every response.")
+    crawl_parser.add_argument("--workers", type=int, nargs="+", default=[4, 8, 16], help="Worker counts to compare.")
+    crawl_parser.add_argument("--perhost", type=int, default=None, help="Maximum concurrent requests per host.")
+    crawl_parser.add_argument("--delay", type=float, default=0, help="Politeness delay between requests to a host.")
+    crawl_parser.set_defaults(run=bench_crawl)
+
+    index_parser = subparsers.add_parser("index", help="build_frequency_matrix on synthetic documents.")
+    index_parser.add_argument("--docs", type=int, nargs="+", default=[10, 1000, 10000], help="Corpus sizes to build.")
+    index_parser.add_argument("--legacy-max", type=int, default=10,
+                              help="Largest corpus also built with the original per-term loop.")
+    index_parser.set_defaults(run=bench_index)
+
+    query_parser = subparsers.add_parser("query", help="process_query latency on synthetic corpora.")
+    query_parser.add_argument("--docs", type=int, nargs="+", default=[300, 1000, 10000, 50000], help="Corpus sizes to query.")
+    query_parser.add_argument("--queries", type=int, default=500, help="Number of queries per corpus.")
+    query_parser.add_argument("-k", type=int, default=6, help="Number of results per query.")
+    query_parser.add_argument("--legacy-max", type=int, default=300,
+                              help="Largest corpus also scored with the original exhaustive loop.")
+    query_parser.add_argument("--legacy-queries", type=int, default=20, help="Number of queries scored exhaustively.")
+    query_parser.set_defaults(run=bench_query)
+
+    file_parser = subparsers.add_parser("indexfile", help="save_index/load_index against pickling the engine.")
+    file_parser.add_argument("--docs", type=int, nargs="+", default=[1000, 10000, 50000], help="Corpus sizes to save.")
+    file_parser.set_defaults(run=bench_index_file)
+
+    refresh_parser = subparsers.add_parser("refresh", help="Incremental refresh against a full rebuild.")
+    refresh_parser.add_argument("--pages", type=int, default=200, help="Number of pages in the site.")
+    refresh_parser.add_argument("--changed", type=float, default=0.05, help="Fraction of pages changed or removed.")
+    refresh_parser.add_argument("--latency", type=float, default=0.01, help="Seconds added to every response.")
+    refresh_parser.add_argument("--workers", type=int, default=1, help="Number of fetch workers.")
+    refresh_parser.set_defaults(run=bench_refresh)
+
+    frontier_parser = subparsers.add_parser("frontier", help="Frontier and visited set bookkeeping on link graphs.")
+    frontier_parser.add_argument("--urls", type=int, nargs="+", default=[1000, 10000, 100000], help="Link graph sizes.")
+    frontier_parser.add_argument("--legacy-max", type=int, default=10000,
+                                 help="Largest graph also walked with the original list bookkeeping.")
+    frontier_parser.set_defaults(run=bench_frontier)
+
+    tokenize_parser = subparsers.add_parser("tokenize", help="Page tokenization throughput on one core.")
+    tokenize_parser.add_argument("--pages", type=int, default=200, help="Number of pages to tokenize.")
+    tokenize_parser.add_argument("--words", type=int, nargs="+", default=[200, 2000, 20000], help="Words per page.")
+    tokenize_parser.set_defaults(run=bench_tokenize)
+
+    parse_parser = subparsers.add_parser("parse", help="Page parsing and term counting on worker processes.")
+    parse_parser.add_argument("--pages", type=int, default=500, help="Number of pages to parse.")
+    parse_parser.add_argument("--words", type=int, default=2000, help="Words per page.")
+    parse_parser.add_argument("--docs", type=int, default=10000, help="Number of documents to build an index of.")
+    parse_parser.add_argument("--processes", type=int, nargs="+", default=[2, 4, 8], help="Process counts to compare.")
+    parse_parser.set_defaults(run=bench_parse)
+
+    cluster_parser = subparsers.add_parser("cluster", help="cluster_docs on synthetic corpora.")
+    cluster_parser.add_argument("--docs", type=int, nargs="+", default=[1000, 10000, 100000], help="Corpus sizes to cluster.")
+    cluster_parser.add_argument("-k", type=int, default=5, help="Number of leaders.")
+    cluster_parser.add_argument("--iterations", type=int, default=20, help="Mini-batch k-means iterations.")
+    cluster_parser.add_argument("--legacy-max", type=int, default=1000,
+                                help="Largest corpus also clustered with the original pairwise loop.")
+    cluster_parser.set_defaults(run=bench_cluster)
+
+    pruned_parser = subparsers.add_parser("pruned", help="Cluster pruned query scoring against scoring every document.")
+    pruned_parser.add_argument("--docs", type=int, nargs="+", default=[10000, 50000], help="Corpus sizes to query.")
+    pruned_parser.add_argument("--clusters", type=int, default=20, help="Number of clusters.")
+    pruned_parser.add_argument("--iterations", type=int, default=20, help="Mini-batch k-means iterations.")
+    pruned_parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 5], help="Probe counts to compare.")
+    pruned_parser.add_argument("--queries", type=int, default=500, help="Number of queries per corpus.")
+    pruned_parser.add_argument("-k", type=int, default=6, help="Number of results per query.")
+    pruned_parser.set_defaults(run=bench_pruned)
+
+    cache_parser = subparsers.add_parser("cache", help="Repeated queries with and without the query cache.")
+    cache_parser.add_argument("--docs", type=int, default=10000, help="Number of documents.")
+    cache_parser.add_argument("--queries", type=int, default=2000, help="Number of queries.")
+    cache_parser.add_argument("--distinct", type=int, default=200, help="Number of distinct queries.")
+    cache_parser.add_argument("--size", type=int, default=1024, help="Cache size.")
+    cache_parser.add_argument("-k", type=int, default=6, help="Number of results per query.")
+    cache_parser.set_defaults(run=bench_cache)
+
+    thesaurus_parser = subparsers.add_parser("thesaurus", help="Thesaurus expansion of sparse queries.")
+    thesaurus_parser.add_argument("--docs", type=int, default=10000, help="Number of documents.")
+    thesaurus_parser.add_argument("--queries", type=int, default=300, help="Number of queries.")
+    thesaurus_parser.add_argument("-k", type=int, default=6, help="Number of results per query.")
+    thesaurus_parser.set_defaults(run=bench_thesaurus)
+
+    titles_parser = subparsers.add_parser("titles", help="Title index lookups against scanning every title.")
+    titles_parser.add_argument("--docs", type=int, nargs="+", default=[10000, 50000], help="Corpus sizes to query.")
+    titles_parser.add_argument("--queries", type=int, default=500, help="Number of queries per corpus.")
+    titles_parser.add_argument("-k", type=int, default=6, help="Number of results per query.")
+    titles_parser.set_defaults(run=bench_titles)
+
+    batch_parser = subparsers.add_parser("batch", help="batch_search throughput on a saved index.")
+    batch_parser.add_argument("--docs", type=int, nargs="+", default=[10000, 50000], help="Corpus sizes to query.")
+    batch_parser.add_argument("--queries", type=int, default=2000, help="Number of queries per corpus.")
+    batch_parser.add_argument("--workers", type=int, nargs="+", default=[2, 4], help="Worker counts to compare.")
+    batch_parser.add_argument("-k", type=int, default=6, help="Number of results per query.")
+    batch_parser.set_defaults(run=bench_batch)
+
+    server_parser = subparsers.add_parser("server", help="QueryServer latency with concurrent clients and a hot swap.")
+    server_parser.add_argument("--docs", type=int, nargs="+", default=[10000], help="Corpus sizes to serve.")
+    server_parser.add_argument("--queries", type=int, default=2000, help="Number of requests per run.")
+    server_parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16], help="Client thread counts to compare.")
+    server_parser.add_argument("--swap-after", type=float, default=0.5, help="Seconds before the index is swapped.")
+    server_parser.add_argument("-k", type=int, default=6, help="Number of results per query.")
+    server_parser.set_defaults(run=bench_server)
+
+    stats_parser = subparsers.add_parser("stats", help="Overhead of the stage stats and their report.")
+    stats_parser.add_argument("--docs", type=int, default=10000, help="Corpus size.")
+    stats_parser.add_argument("--queries", type=int, default=2000, help="Number of queries.")
+    stats_parser.add_argument("-k", type=int, default=6, help="Number of results per query.")
+    stats_parser.set_defaults(run=bench_stats)
+
+    suite_parser = subparsers.add_parser("suite", help="Crawl, index, cluster, save, load and query a synthetic site against a JSON baseline.")
+    suite_parser.add_argument("--pages", type=int, default=300, help="Number of pages in the site.")
+    suite_parser.add_argument("--links", type=int, default=5, help="Links per page.")
+    suite_parser.add_argument("--words", type=int, default=200, help="Words per page.")
+    suite_parser.add_argument("--structure", choices=["random", "tree"], default="random", help="How pages link to each other.")
+    suite_parser.add_argument("--duplicates", type=int, default=10, help="Pages that are copies of other pages.")
+    suite_parser.add_argument("--images", type=int, default=10, help="GIF files linked from pages.")
+    suite_parser.add_argument("--private", type=int, default=5, help="Pages in a directory disallowed by robots.txt.")
+    suite_parser.add_argument("--external", type=int, default=5, help="Links to other hosts.")
+    suite_parser.add_argument("--workers", type=int, default=1, help="Pages fetched concurrently by the crawl.")
+    suite_parser.add_argument("--clusters", type=int, default=5, help="Number of cluster leaders.")
+    suite_parser.add_argument("--queries", type=int, default=1000, help="Number of queries.")
+    suite_parser.add_argument("-k", type=int, default=6, help="Number of results per query.")
+    suite_parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the median is reported.")
+    suite_parser.add_argument("--seed", type=int, default=0, help="Seed of the site, the cluster leaders and the queries.")
+    suite_parser.add_argument("--baseline", default="Output/benchmark_baseline.json", help="JSON baseline file.")
+    suite_parser.add_argument("--tolerance", type=float, default=0.2, help="Slowdown over the baseline reported as a regression.")
+    suite_parser.add_argument("--save", action="store_true", help="Write the results as the new baseline.")
+    suite_parser.set_defaults(run=bench_suite)
+
+    near_parser = subparsers.add_parser("neardup", help="Near-duplicate pages collapsed by the crawl and SimHash lookup cost.")
+    near_parser.add_argument("--pages", type=int, default=300, help="Number of pages in the site.")
+    near_parser.add_argument("--near", type=int, default=40, help="Pages that are copies with a session token and a timestamp.")
+    near_parser.add_argument("--distances", type=int, nargs="+", default=[3, 5], help="Maximum distances in bits to compare.")
+    near_parser.add_argument("--docs", type=int, default=5000, help="Synthetic documents for the lookup timings.")
+    near_parser.set_defaults(run=bench_near_duplicates)
+
+    spimi_parser = subparsers.add_parser("spimi", help="Out of core SPIMI indexing against keeping every word in memory.")
+    spimi_parser.add_argument("--docs", type=int, default=5000, help="Number of documents recorded.")
+    spimi_parser.add_argument("--budgets", type=float, nargs="+", default=[1, 4], help="Memory budgets in MB to compare.")
+    spimi_parser.set_defaults(run=bench_spimi)
+
+    postings_parser = subparsers.add_parser("postings", help="Compressed postings against flat arrays: size, decoding, queries and intersections.")
+    postings_parser.add_argument("--docs", type=int, nargs="+", default=[2000, 20000], help="Corpus sizes.")
+    postings_parser.add_argument("--queries", type=int, default=300, help="Number of queries per corpus.")
+    postings_parser.add_argument("--repeats", type=int, default=10, help="Full decodes timed per corpus.")
+    postings_parser.add_argument("-k", type=int, default=6, help="Results per query.")
+    postings_parser.set_defaults(run=bench_postings)
+
+    top_k_parser = subparsers.add_parser("topk", help="MaxScore top k retrieval against scoring every document of the query postings.")
+    top_k_parser.add_argument("--docs", type=int, nargs="+", default=[2000, 20000], help="Corpus sizes.")
+    top_k_parser.add_argument("--queries", type=int, default=300, help="Number of queries per corpus.")
+    top_k_parser.add_argument("-k", type=int, default=6, help="Results per query.")
+    top_k_parser.set_defaults(run=bench_top_k)
+
+    url_filter_parser = subparsers.add_parser("urlfilter", help="robots.txt rule matching and link filtering throughput.")
+    url_filter_parser.add_argument("--rules", type=int, nargs="+", default=[10, 1000], help="robots.txt sizes.")
+    url_filter_parser.add_argument("--urls", type=int, default=20000, help="Number of urls checked per robots.txt.")
+    url_filter_parser.set_defaults(run=bench_url_filter)
+
+    fetch_parser = subparsers.add_parser("fetch", help="Pooled keep-alive, compressed fetches against a new connection per page.")
+    fetch_parser.add_argument("--pages", type=int, default=200, help="Number of pages in the site.")
+    fetch_parser.add_argument("--images", type=int, default=40, help="GIF files linked from pages.")
+    fetch_parser.add_argument("--latency", type=float, default=0.002, help="Seconds added to every response.")
+    fetch_parser.add_argument("--connect-latency", type=float, default=0.02, help="Seconds added to every new connection.")
+    fetch_parser.add_argument("--workers", type=int, default=1, help="Number of fetch workers.")
+    fetch_parser.set_defaults(run=bench_fetch)
+
+    arguments = parser.parse_args()
+    arguments.run(arguments)
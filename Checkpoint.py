@@ -0,0 +1,69 @@
+import sqlite3
+import json
+
+
+class CrawlCheckpoint:
+    '''
+    Append only log of the pages processed by a crawl, stored in a SQLite file
+
+    every processed page is one row, in the order the crawl processed them. Rows are
+    committed every interval pages, so a crash loses at most the last interval pages.
+    Replaying the rows through WebCrawler.record_page rebuilds the crawl state.
+    '''
+    def __init__(self, filename, interval=10):
+        self.filename = filename
+        self.interval = int(interval)
+        self.pending = 0  # rows written since the last commit
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS crawl (key TEXT PRIMARY KEY, value TEXT)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS pages (seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                                "url TEXT, broken INTEGER, title TEXT, doc_id TEXT, words TEXT, links TEXT, "
+                                "validators TEXT)")
+        self.connection.commit()
+
+    # returns the seed url the checkpoint was written for, or None for a new checkpoint
+    def get_seed_url(self):
+        row = self.connection.execute("SELECT value FROM crawl WHERE key = 'seed_url'").fetchone()
+        return row[0] if row is not None else None
+
+    # empties the checkpoint to start a new crawl of seed_url
+    def reset(self, seed_url):
+        self.connection.execute("DELETE FROM pages")
+        self.connection.execute("INSERT OR REPLACE INTO crawl VALUES ('seed_url', ?)", (seed_url,))
+        self.connection.commit()
+        self.pending = 0
+
+    # appends a fetched page, words is None for pages whose words aren't stored
+    def log_page(self, url, title, doc_id, words, links, validators):
+        self.connection.execute("INSERT INTO pages (url, broken, title, doc_id, words, links, validators) "
+                                "VALUES (?, 0, ?, ?, ?, ?, ?)",
+                                (url, title, doc_id, json.dumps(words), json.dumps(links), json.dumps(validators)))
+        self.written()
+
+    # appends a page that couldn't be fetched
+    def log_broken(self, url):
+        self.connection.execute("INSERT INTO pages (url, broken) VALUES (?, 1)", (url,))
+        self.written()
+
+    def written(self):
+        self.pending += 1
+        if self.pending >= self.interval:
+            self.flush()
+
+    # commits the rows written since the last commit
+    def flush(self):
+        self.connection.commit()
+        self.pending = 0
+
+    # yields (url, broken, title, doc_id, words, links, validators) in crawl order
+    def pages(self):
+        for url, broken, title, doc_id, words, links, validators in self.connection.execute(
+                "SELECT url, broken, title, doc_id, words, links, validators FROM pages ORDER BY seq"):
+            if broken:
+                yield url, True, None, None, None, None, None
+            else:
+                yield url, False, title, doc_id, json.loads(words), json.loads(links), json.loads(validators)
+
+    def close(self):
+        self.flush()
+        self.connection.close()
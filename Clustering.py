@@ -0,0 +1,154 @@
+import numpy as np
+
+
+'''
+Leader-follower clustering of document vectors
+
+documents are the rows of a SciPy CSR matrix and leaders are documents. Distances are
+euclidean, computed a chunk of rows at a time as |x|^2 - 2 x.c + |c|^2 against every
+center at once, so memory stays at chunk_size * k floats.
+'''
+CHUNK_SIZE = 4096
+
+
+# returns the squared norm of every row of a sparse matrix
+def squared_norms(X):
+    return np.asarray(X.multiply(X).sum(axis=1)).ravel()
+
+
+'''
+returns (position of the closest center, squared distance) of every row of X
+centers is a dense (k x terms) array, ties go to the first center
+'''
+def closest_centers(X, centers, chunk_size=CHUNK_SIZE):
+    x_norms = squared_norms(X)
+    c_norms = (centers ** 2).sum(axis=1)
+    closest = np.zeros(X.shape[0], dtype=np.int64)
+    distances = np.zeros(X.shape[0])
+
+    for start in range(0, X.shape[0], chunk_size):
+        end = min(start + chunk_size, X.shape[0])
+        d2 = x_norms[start:end, None] - 2 * (X[start:end] @ centers.T) + c_norms[None, :]
+        np.maximum(d2, 0, out=d2)
+
+        closest[start:end] = d2.argmin(axis=1)
+        distances[start:end] = d2[np.arange(end - start), closest[start:end]]
+
+    return closest, distances
+
+
+# returns k distinct random rows of X
+def random_leaders(X, k, rng):
+    return rng.sample(range(X.shape[0]), k)
+
+
+'''
+returns k distinct rows of X picked the k-means++ way: every leader after the first is
+picked with a probability proportional to its squared distance to the closest leader
+no leaders are picked when k is 0, like random_leaders
+'''
+def kmeans_plus_plus_leaders(X, k, rng, chunk_size=CHUNK_SIZE):
+    if k < 1:
+        return []
+
+    leaders = [rng.randrange(X.shape[0])]
+    _, d2 = closest_centers(X, X[leaders].toarray(), chunk_size)
+
+    while len(leaders) < k:
+        d2[leaders] = 0
+        cumulative = np.cumsum(d2)
+
+        if cumulative[-1] > 0:
+            leader = int(np.searchsorted(cumulative, rng.random() * cumulative[-1], side="right"))
+            leader = min(leader, X.shape[0] - 1)
+        else:
+            # every remaining row sits on a leader
+            leader = rng.choice(np.setdiff1d(np.arange(X.shape[0]), leaders).tolist())
+
+        leaders.append(leader)
+        _, new_d2 = closest_centers(X, X[[leader]].toarray(), chunk_size)
+        np.minimum(d2, new_d2, out=d2)
+
+    return leaders
+
+
+'''
+moves the rows of X used as leaders with mini-batch k-means
+
+each iteration assigns batch_size random rows to their closest center and moves every
+center to the running mean of the rows assigned to it so far. The leaders are then the
+rows closest to the final centers, as distinct rows in the order of the centers.
+'''
+def mini_batch_leaders(X, leaders, iterations, batch_size, rng, chunk_size=CHUNK_SIZE):
+    centers = X[leaders].toarray()
+    counts = np.ones(len(leaders))  # number of rows each center is the mean of
+
+    for _ in range(iterations):
+        batch = np.array(rng.sample(range(X.shape[0]), min(batch_size, X.shape[0])))
+        closest, _ = closest_centers(X[batch], centers, chunk_size)
+
+        for c in np.unique(closest).tolist():
+            members = X[batch[closest == c]]
+            centers[c] = (centers[c] * counts[c] + np.asarray(members.sum(axis=0)).ravel()) / (counts[c] + members.shape[0])
+            counts[c] += members.shape[0]
+
+    # the row closest to each center, a chunk of rows at a time
+    c_norms = (centers ** 2).sum(axis=1)
+    x_norms = squared_norms(X)
+    order = []  # rows of X sorted by their distance to each center
+    for c in range(len(leaders)):
+        d2 = np.zeros(X.shape[0])
+        for start in range(0, X.shape[0], chunk_size):
+            end = min(start + chunk_size, X.shape[0])
+            d2[start:end] = x_norms[start:end] - 2 * (X[start:end] @ centers[c]) + c_norms[c]
+        order.append(np.argsort(d2, kind="stable"))
+
+    chosen = []
+    for rows in order:
+        chosen.append(next(int(r) for r in rows if int(r) not in chosen))
+
+    return chosen
+
+
+'''
+clusters the rows of X around k leaders
+returns {leader: [(follower, distance)]}, leaders in the order they were picked and followers by row
+
+init is "random" or "kmeans++", iterations is the number of mini-batch k-means iterations
+run before the followers are assigned (0 keeps the initial leaders), k = 0 makes no clusters
+'''
+def leader_follower(X, k, rng, init="random", iterations=0, batch_size=1024, chunk_size=CHUNK_SIZE):
+    if init == "kmeans++":
+        leaders = kmeans_plus_plus_leaders(X, k, rng, chunk_size)
+    else:
+        leaders = random_leaders(X, k, rng)
+
+    if iterations > 0 and leaders:
+        leaders = mini_batch_leaders(X, leaders, iterations, batch_size, rng, chunk_size)
+
+    clusters = {leader: [] for leader in leaders}
+    followers = np.setdiff1d(np.arange(X.shape[0]), leaders)
+    assign_followers(X, clusters, followers, chunk_size)
+
+    return clusters
+
+
+# adds each follower (a row of X) to the list of its closest leader in clusters
+def assign_followers(X, clusters, followers, chunk_size=CHUNK_SIZE):
+    followers = np.asarray(followers, dtype=np.int64)
+    if len(followers) == 0 or len(clusters) == 0:
+        return
+
+    leaders = list(clusters)
+    closest, d2 = closest_centers(X[followers], X[leaders].toarray(), chunk_size)
+
+    for f, c, d in zip(followers.tolist(), closest.tolist(), np.sqrt(d2).tolist()):
+        clusters[leaders[c]].append((f, d))
+
+
+# returns the distances of followers (rows of X) to their leader, a row of X
+def follower_distances(X, leader, followers, chunk_size=CHUNK_SIZE):
+    if len(followers) == 0:
+        return []
+    _, d2 = closest_centers(X[np.asarray(followers, dtype=np.int64)], X[[leader]].toarray(), chunk_size)
+    return np.sqrt(d2).tolist()
@@ -0,0 +1,215 @@
+from InvertedIndex import InvertedIndex, search_sorted
+import numpy as np
+
+
+'''
+Postings compressed with delta gaps, variable byte codes and skip pointers
+
+the doc numbers of a term are stored as the gaps between consecutive doc numbers, the first
+one as is, and the gaps and term frequencies as variable byte codes: 7 bits per byte, most
+significant first, the high bit set on the last byte of a number. Most gaps and frequencies
+are small, so most postings take two bytes instead of eight.
+
+the postings of a term are cut into blocks of SKIP_INTERVAL postings. Every block has a skip
+pointer: its last doc number and where its bytes start, so a block can be decoded on its own
+and a lookup skips the blocks that can't hold the doc numbers it's after.
+'''
+SKIP_INTERVAL = 128  # postings per block
+
+
+# returns the number of bytes of the variable byte code of every value
+def varbyte_lengths(values):
+    values = np.asarray(values, dtype=np.int64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 63, 7):
+        lengths += values >= (1 << shift)
+    return lengths
+
+
+# returns the variable byte codes of non negative integers as a uint8 array
+def varbyte_encode(values):
+    values = np.asarray(values, dtype=np.int64)
+    lengths = varbyte_lengths(values)
+    ends = np.cumsum(lengths) - 1  # position of the last byte of every value
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.uint8)
+
+    numbers = np.repeat(np.arange(len(values)), lengths)  # value of every byte
+    shifts = 7 * (ends[numbers] - np.arange(len(numbers)))
+    encoded = ((values[numbers] >> shifts) & 0x7F).astype(np.uint8)
+    encoded[ends] |= 0x80
+
+    return encoded
+
+
+# returns the integers of a uint8 array of variable byte codes as an int64 array
+def varbyte_decode(encoded):
+    encoded = np.asarray(encoded, dtype=np.uint8)
+    ends = np.flatnonzero(encoded & 0x80)
+    if len(ends) == len(encoded):
+        return (encoded & 0x7F).astype(np.int64)  # every value fits in a byte
+
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    numbers = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = 7 * (ends[numbers] - np.arange(len(numbers)))
+
+    return np.add.reduceat((encoded & 0x7F).astype(np.int64) << shifts, starts)
+
+
+class CompressedIndex(InvertedIndex):
+    '''
+    InvertedIndex whose postings are kept compressed, see the module docstring
+
+    the postings of a term are decoded when they're read. doc_ids and tfs decode every
+    posting, they're meant for the bulk work done once per index (doc vectors, length norms)
+    '''
+    def __init__(self, docs, terms, offsets, doc_gaps, tf_codes, skip_docs, skip_doc_offsets, skip_tf_offsets):
+        self.docs = docs
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_gaps = doc_gaps  # uint8 variable byte codes of the doc number gaps
+        self.tf_codes = tf_codes  # uint8 variable byte codes of the term frequencies
+        self.skip_docs = skip_docs  # last doc number of every block
+        self.skip_doc_offsets = skip_doc_offsets  # start of every block in doc_gaps, and the end of the last one
+        self.skip_tf_offsets = skip_tf_offsets  # start of every block in tf_codes, and the end of the last one
+        self.term_ids = None
+
+        # the blocks of term t are blocks[block_starts[t]:block_starts[t + 1]]
+        counts = np.diff(self.offsets)
+        self.block_starts = np.zeros(len(counts) + 1, dtype=np.int64)
+        self.block_starts[1:] = np.cumsum((counts + SKIP_INTERVAL - 1) // SKIP_INTERVAL)
+
+        # posting number of the start of every block, and whether it's the first block of its term
+        block_terms = np.repeat(np.arange(len(counts)), np.diff(self.block_starts))
+        block_numbers = np.arange(len(block_terms)) - self.block_starts[block_terms]
+        self.block_postings = np.append(self.offsets[block_terms] + SKIP_INTERVAL * block_numbers, self.offsets[-1])
+        self.first_blocks = block_numbers == 0
+
+    # compresses the postings of an InvertedIndex
+    @classmethod
+    def from_index(cls, index):
+        offsets = np.asarray(index.offsets, dtype=np.int64)
+        doc_ids = np.asarray(index.doc_ids, dtype=np.int64)
+        tfs = np.asarray(index.tfs, dtype=np.int64)
+
+        # gaps between the doc numbers of a term, the first doc number of a term is stored as is
+        gaps = np.diff(doc_ids, prepend=0)
+        term_starts = offsets[:-1][np.diff(offsets) > 0]
+        gaps[term_starts] = doc_ids[term_starts]
+
+        gap_lengths, tf_lengths = varbyte_lengths(gaps), varbyte_lengths(tfs)
+        gap_ends = np.concatenate(([0], np.cumsum(gap_lengths)))
+        tf_ends = np.concatenate(([0], np.cumsum(tf_lengths)))
+
+        # blocks of SKIP_INTERVAL postings, restarting at every term
+        counts = np.diff(offsets)
+        num_blocks = (counts + SKIP_INTERVAL - 1) // SKIP_INTERVAL
+        block_terms = np.repeat(np.arange(len(counts)), num_blocks)
+        block_numbers = np.arange(len(block_terms)) - np.repeat(np.cumsum(num_blocks) - num_blocks, num_blocks)
+        block_postings = offsets[block_terms] + SKIP_INTERVAL * block_numbers
+        block_ends = np.minimum(block_postings + SKIP_INTERVAL, offsets[block_terms + 1])
+
+        return cls(index.docs, index.terms, offsets, varbyte_encode(gaps), varbyte_encode(tfs),
+                   doc_ids[block_ends - 1].astype(np.int32), np.append(gap_ends[block_postings], gap_ends[-1]),
+                   np.append(tf_ends[block_postings], tf_ends[-1]))
+
+    # returns the index with its postings decoded into flat arrays
+    def decompress(self):
+        return InvertedIndex(self.docs, self.terms, self.offsets, self.doc_ids, self.tfs)
+
+    # returns a new uncompressed index, see InvertedIndex.update
+    def update(self, removed, added):
+        return self.decompress().update(removed, added)
+
+    @property
+    def doc_ids(self):
+        return self.decode_blocks(0, len(self.skip_docs))[0]
+
+    @property
+    def tfs(self):
+        return varbyte_decode(self.tf_codes).astype(np.int32)
+
+    def postings_nbytes(self):
+        return self.offsets.nbytes + self.doc_gaps.nbytes + self.tf_codes.nbytes + self.skip_docs.nbytes \
+            + self.skip_doc_offsets.nbytes + self.skip_tf_offsets.nbytes
+
+    '''
+    returns (doc numbers, term frequencies) of the consecutive blocks first to last - 1,
+    with the term frequencies only if tfs is True (None otherwise)
+    '''
+    def decode_blocks(self, first, last, tfs=True):
+        gaps = varbyte_decode(self.doc_gaps[self.skip_doc_offsets[first]:self.skip_doc_offsets[last]])
+
+        # doc numbers are the running sum of the gaps, restarting at every term
+        doc_ids = np.cumsum(gaps)
+        term_starts = self.block_postings[first:last][self.first_blocks[first:last]] - self.block_postings[first]
+        if len(term_starts) > 0:
+            restarts = np.zeros(len(gaps), dtype=np.int64)
+            restarts[term_starts] = np.diff(np.concatenate(([0], doc_ids[term_starts] - gaps[term_starts])))
+            doc_ids -= np.cumsum(restarts)
+
+        # a block that isn't the first of its term starts after the last doc number of the previous block
+        if first < last and not self.first_blocks[first]:
+            doc_ids[:term_starts[0] if len(term_starts) > 0 else len(doc_ids)] += int(self.skip_docs[first - 1])
+
+        tf_values = None
+        if tfs:
+            tf_values = varbyte_decode(self.tf_codes[self.skip_tf_offsets[first]:self.skip_tf_offsets[last]])
+            tf_values = tf_values.astype(np.int32)
+
+        return doc_ids.astype(np.int32), tf_values
+
+    # returns (doc numbers, term frequencies) of the term at row t
+    def term_postings(self, t):
+        first, last = self.block_starts[t], self.block_starts[t + 1]
+        tfs = varbyte_decode(self.tf_codes[self.skip_tf_offsets[first]:self.skip_tf_offsets[last]])
+        return self.term_docs(t), tfs.astype(np.int32)
+
+    # returns the doc numbers of the term at row t
+    def term_docs(self, t):
+        first, last = self.block_starts[t], self.block_starts[t + 1]
+        return np.cumsum(varbyte_decode(self.doc_gaps[self.skip_doc_offsets[first]:self.skip_doc_offsets[last]])
+                         ).astype(np.int32)
+
+    # returns (doc numbers, posting numbers) of the postings of a sorted array of blocks, each block decoded on its own
+    def block_docs(self, blocks):
+        if len(blocks) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int64)
+
+        starts, ends = self.skip_doc_offsets[blocks], self.skip_doc_offsets[blocks + 1]
+        lengths = ends - starts
+        byte_starts = np.cumsum(lengths) - lengths
+        gaps = varbyte_decode(self.doc_gaps[np.repeat(starts - byte_starts, lengths) + np.arange(lengths.sum())])
+
+        # the running sum of the gaps restarts at every block, from the last doc number of the block before
+        counts = self.block_postings[blocks + 1] - self.block_postings[blocks]
+        block_ends = np.cumsum(counts)
+        doc_ids = np.cumsum(gaps)
+        bases = np.where(self.first_blocks[blocks], 0, self.skip_docs[blocks - 1])
+        previous = np.concatenate(([0], doc_ids[block_ends[:-1] - 1]))
+        doc_ids += np.repeat(bases - previous, counts)
+
+        positions = np.arange(len(doc_ids)) + np.repeat(self.block_postings[blocks] - (block_ends - counts), counts)
+        return doc_ids.astype(np.int32), positions
+
+    '''
+    returns (whether each of the sorted doc numbers is in the postings of the term at row t,
+    posting numbers of the doc numbers found)
+
+    only the blocks the skip pointers say can hold the doc numbers are decoded, or all
+    the postings of the term when that would be at least half of its blocks
+    '''
+    def find_postings(self, t, doc_numbers):
+        first, last = int(self.block_starts[t]), int(self.block_starts[t + 1])
+
+        if 2 * len(doc_numbers) < last - first:
+            # the block of a doc number is the first one whose last doc number isn't smaller
+            blocks = first + np.searchsorted(self.skip_docs[first:last], doc_numbers)
+            blocks = np.unique(blocks[blocks < last])
+
+            if 2 * len(blocks) < last - first:
+                docs, positions = self.block_docs(blocks)
+                found, found_positions = search_sorted(doc_numbers, docs)
+                return found, positions[found_positions]
+
+        return InvertedIndex.find_postings(self, t, doc_numbers)
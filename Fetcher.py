@@ -0,0 +1,329 @@
+import urllib.request
+import urllib.parse
+import urllib.error
+import http.client
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from Instrumentation import stats
+
+
+# request header used to revalidate each cache validator of a response
+CONDITIONAL_HEADERS = {"ETag": "If-None-Match", "Last-Modified": "If-Modified-Since"}
+
+# the User-Agent urllib sends, robots.txt groups are matched against its product token (UrlFilter.ROBOTS_AGENT)
+USER_AGENT = "Python-urllib/" + urllib.request.__version__
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 10  # as many as urllib follows
+RETRY_CODES = (429, 500, 502, 503, 504)  # answers a request is retried after
+CHUNK_BYTES = 64 * 1024  # bytes read from a connection at a time
+
+
+class ConnectionPool:
+    '''
+    Persistent HTTP connections, kept open between requests to the same host
+
+    a connection serves one request at a time: a request takes an idle connection to its host
+    or opens a new one, and puts it back once the response has been read, unless the server
+    is closing it. At most max_idle idle connections are kept per host.
+    '''
+    def __init__(self, timeout=10, max_idle=8):
+        self.timeout = timeout  # seconds to connect, and between two reads of a response
+        self.max_idle = int(max_idle)
+        self.lock = threading.Lock()
+        self.idle = {}  # (scheme, host) : [idle connections]
+
+    # the connections belong to the process, a copy of the pool starts without any
+    def __getstate__(self):
+        return {"timeout": self.timeout, "max_idle": self.max_idle}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    # returns (a connection to a host, whether it served a request before)
+    def take(self, scheme, host):
+        with self.lock:
+            connections = self.idle.get((scheme, host))
+            if connections:
+                return connections.pop(), True
+
+        stats.count("connections_opened")
+        connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        return connection_class(host, timeout=self.timeout), False
+
+    def put_back(self, scheme, host, connection):
+        with self.lock:
+            connections = self.idle.setdefault((scheme, host), [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    # closes the idle connections
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class HttpClient:
+    '''
+    Fetches urls over the persistent connections of a ConnectionPool
+
+    responses are asked for gzip or deflate compressed and decompressed as they're read, up
+    to max_body_bytes of content: a longer page is cut there. A request that can't connect,
+    times out or is answered with one of RETRY_CODES is sent again up to retries times,
+    backoff seconds later then twice as long every time. Redirects are followed, and a HEAD
+    request a server doesn't answer is sent again as a GET.
+    '''
+    def __init__(self, timeout=10, retries=2, backoff=0.5, max_body_bytes=10 * 2 ** 20, max_idle=8):
+        self.retries = int(retries)
+        self.backoff = float(backoff)
+        self.max_body_bytes = int(max_body_bytes)
+        self.pool = ConnectionPool(timeout, max_idle)
+
+    def close(self):
+        self.pool.close()
+
+    '''
+    returns (raw bytes of a page, {validator: value}, charset of the response or None)
+    raises urllib.error.HTTPError for broken pages and urllib.error.URLError for pages that can't be fetched
+    given the validators of a previous response, an unchanged page raises an HTTPError with code 304
+    a HEAD request returns the headers identifying the file in place of its bytes, see head_content
+    '''
+    def fetch(self, url, validators=None, method="GET"):
+        headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "gzip, deflate"}
+        for validator, value in (validators or {}).items():
+            headers[CONDITIONAL_HEADERS[validator]] = value
+
+        with stats.timer("fetch"):
+            if urllib.parse.urlsplit(url).scheme.lower() not in ("http", "https"):
+                return self.fetch_with_urllib(url, headers)
+
+            redirects = 0
+            while True:
+                status, reason, response_headers, content = self.request(method, url, headers)
+
+                if method == "HEAD" and status in (405, 501):
+                    method = "GET"
+                elif status in REDIRECT_CODES and response_headers.get("Location") and redirects < MAX_REDIRECTS:
+                    url = urllib.parse.urljoin(url, response_headers["Location"])
+                    redirects += 1
+                else:
+                    break
+
+            if status >= 300:
+                stats.count("http_" + str(status))
+                raise urllib.error.HTTPError(url, status, reason, response_headers, None)
+
+        stats.count("pages_fetched")
+        stats.count("bytes_fetched", len(content))
+
+        if method == "HEAD":
+            content = head_content(url, response_headers)
+
+        validators = {v: response_headers[v] for v in CONDITIONAL_HEADERS if response_headers.get(v)}
+        return content, validators, response_headers.get_content_charset()
+
+    # fetch for the schemes http.client doesn't speak (ftp), without pooling, compression or retries
+    def fetch_with_urllib(self, url, headers):
+        request = urllib.request.Request(url, headers={k: v for k, v in headers.items() if k != "Accept-Encoding"})
+        try:
+            handle = urllib.request.urlopen(request, timeout=self.pool.timeout)
+        except urllib.error.HTTPError as e:
+            stats.count("http_" + str(e.code))
+            raise
+        content = handle.read(self.max_body_bytes)
+
+        stats.count("pages_fetched")
+        stats.count("bytes_fetched", len(content))
+
+        validators = {v: handle.headers[v] for v in CONDITIONAL_HEADERS if handle.headers.get(v)}
+        return content, validators, handle.headers.get_content_charset()
+
+    '''
+    returns (status, reason, headers, content) of the answer to a request, retrying it when it
+    fails or is answered with one of RETRY_CODES, with exponential backoff
+    raises urllib.error.URLError when the last try fails
+    '''
+    def request(self, method, url, headers):
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                stats.count("fetch_retries")
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+
+            try:
+                answer = self.send(method, url, headers)
+            except (OSError, http.client.HTTPException, zlib.error) as e:
+                error = e
+                continue
+
+            if answer[0] not in RETRY_CODES or attempt == self.retries:
+                return answer
+            error = str(answer[0]) + " " + answer[1]
+
+        raise urllib.error.URLError(error)
+
+    # returns (status, reason, headers, content) of the answer to a request sent once on a pooled connection
+    def send(self, method, url, headers):
+        parts = urllib.parse.urlsplit(url)
+        path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+
+        while True:
+            connection, reused = self.pool.take(parts.scheme.lower(), parts.netloc)
+            try:
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                # a server may close a kept alive connection at any time, the request is sent again on a new one
+                if reused and isinstance(e, (http.client.RemoteDisconnected, ConnectionError)):
+                    continue
+                raise
+            break
+
+        if reused:
+            stats.count("connections_reused")
+
+        try:
+            content, complete = self.read_body(response)
+        except (OSError, http.client.HTTPException, zlib.error):
+            connection.close()
+            raise
+
+        # a connection with unread bytes or that the server is closing can't serve another request
+        if complete and not response.will_close:
+            self.pool.put_back(parts.scheme.lower(), parts.netloc, connection)
+        else:
+            connection.close()
+
+        return response.status, response.reason, response.msg, content
+
+    '''
+    returns (the content of a response decompressed, whether the response was read to the end)
+    the content is cut at max_body_bytes, and so is the decompressed content of a compressed response
+    '''
+    def read_body(self, response):
+        limit = self.max_body_bytes
+        encoding = (response.getheader("Content-Encoding") or "").strip().lower()
+
+        if encoding not in ("gzip", "x-gzip", "deflate"):
+            content = response.read(limit + 1)
+        else:
+            # gzip and zlib headers are both detected by 32 + MAX_WBITS
+            decompressor = zlib.decompressobj(32 + zlib.MAX_WBITS)
+            chunks, size, received = [], 0, 0
+
+            while size <= limit:
+                raw = response.read(CHUNK_BYTES)
+                if not raw:
+                    chunks.append(decompressor.flush())
+                    break
+
+                if received == 0 and encoding == "deflate" and raw[0] & 0x0F != 8:
+                    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)  # raw deflate, without the zlib header
+                received += len(raw)
+
+                chunks.append(decompressor.decompress(raw, limit + 1 - size))
+                size += len(chunks[-1])
+
+            content = b"".join(chunks)
+            stats.count("bytes_compressed", received)
+
+        if len(content) > limit:
+            stats.count("bodies_truncated")
+            return content[:limit], False
+
+        return content, True
+
+
+'''
+returns what stands in for the bytes of a file fetched with a HEAD request: its ETag, or else its
+Content-Length and Last-Modified, so the file gets a new DocumentID when it changes. Files served
+with the same ETag, or the same length and modification time, get the same one. The url is used
+when the response has neither, then a changed file keeps its DocumentID and no copy is found
+'''
+def head_content(url, headers):
+    if headers.get("ETag"):
+        identity = "ETag: " + headers["ETag"]
+    elif headers.get("Content-Length") and headers.get("Last-Modified"):
+        identity = "Content-Length: " + headers["Content-Length"] + "\nLast-Modified: " + headers["Last-Modified"]
+    else:
+        identity = "URL: " + url
+    return identity.encode("utf-8")
+
+
+# the HttpClient fetch_url fetches with
+client = HttpClient()
+
+
+# fetches a url with the shared HttpClient, see HttpClient.fetch
+def fetch_url(url, validators=None, method="GET"):
+    return client.fetch(url, validators, method)
+
+
+class ConcurrentFetcher:
+    '''
+    Fetches pages on a pool of worker threads
+
+    per_host_limit caps the number of requests in flight to the same host and
+    delay is the minimum number of seconds between two requests to the same host
+    '''
+    def __init__(self, workers, per_host_limit=None, delay=0, fetch=fetch_url):
+        self.workers = int(workers)
+        self.per_host_limit = int(per_host_limit) if per_host_limit else None
+        self.delay = float(delay)
+        self.fetch = fetch
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.lock = threading.Lock()
+        self.host_slots = {}  # host : semaphore limiting concurrent requests
+        self.host_next_request = {}  # host : earliest time the next request may start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    # schedules a url to be fetched and returns its future, extra arguments are passed to fetch
+    def submit(self, url, *args):
+        return self.executor.submit(self.fetch_politely, url, *args)
+
+    # cancels everything that hasn't started yet and waits for the running fetches
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    # returns the semaphore for a host, creating it on first use
+    def get_host_slot(self, host):
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self.host_slots[host]
+
+    # blocks until the politeness delay for a host has passed, then reserves the next slot
+    def wait_for_host(self, host):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.host_next_request.get(host, now))
+            self.host_next_request[host] = start + self.delay
+
+        if start > now:
+            time.sleep(start - now)
+
+    def fetch_politely(self, url, *args):
+        host = urllib.parse.urlsplit(url).netloc
+
+        if self.per_host_limit is None:
+            if self.delay > 0:
+                self.wait_for_host(host)
+            return self.fetch(url, *args)
+
+        with self.get_host_slot(host):
+            if self.delay > 0:
+                self.wait_for_host(host)
+            return self.fetch(url, *args)
@@ -0,0 +1,180 @@
+from collections.abc import Mapping
+import numpy as np
+import bisect
+import json
+import mmap
+import os
+
+
+'''
+Index file layout
+
+    magic (8 bytes) | version (uint32) | header length (uint32) | header (JSON) | sections
+
+the header holds the small metadata (seed url, N, clusters) and the offset, dtype and
+length of every section. Sections are flat arrays aligned to 8 bytes, relative to the
+end of the header, so they can be used straight from a memory map.
+'''
+MAGIC = b"IIITDIDX"
+VERSION = 5  # version 2 added the crawl state sections, version 3 the title index, version 4 the SimHash fingerprints, version 5 compressed postings
+SUPPORTED_VERSIONS = (1, 2, 3, 4, 5)
+ALIGNMENT = 8
+WRITE_CHUNK = 1 << 20  # array items written at a time
+
+
+class StringTable:
+    '''
+    Sequence of strings stored as one utf-8 blob and the offsets of each string in it
+
+    strings are only decoded when they're accessed
+    '''
+    def __init__(self, blob, offsets):
+        self.blob = blob  # uint8 array
+        self.offsets = offsets  # int64 array, string i is blob[offsets[i]:offsets[i + 1]]
+
+    # returns (blob, offsets) of a list of strings
+    @staticmethod
+    def encode(strings):
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("string table index out of range")
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    # returns the position of a string in a sorted table, or None if it isn't there
+    def find(self, s):
+        i = bisect.bisect_left(self, s)
+        return i if i < len(self) and self[i] == s else None
+
+
+class StoredMapping(Mapping):
+    '''
+    Read only {key: value} backed by two string tables of the same length
+
+    the key to position lookup is built on first access, mappings over the same keys can
+    share it with shared_keys (another StoredMapping), so the keys are only decoded once
+    '''
+    def __init__(self, keys, values, shared_keys=None):
+        self.keys_table = keys
+        self.values_table = values
+        self.shared_keys = shared_keys
+        self.positions = None
+
+    def __getitem__(self, key):
+        return self.values_table[self.position(key)]
+
+    # returns the position of a key in the keys table
+    def position(self, key):
+        if self.shared_keys is not None:
+            return self.shared_keys.position(key)
+        if self.positions is None:
+            self.positions = {k: i for i, k in enumerate(self.keys_table)}
+        return self.positions[key]
+
+    # returns the value at a position of the tables, without looking up its key
+    def value_at(self, i):
+        return self.values_table[i]
+
+    def __iter__(self):
+        return iter(self.keys_table)
+
+    def __len__(self):
+        return len(self.keys_table)
+
+
+class IndexFile:
+    '''
+    A memory mapped index file
+
+    arrays are read only views of the map, pages are loaded by the OS when they're first read
+    '''
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.map[:len(MAGIC)] != MAGIC:
+            raise ValueError(filename + " is not an index file")
+
+        self.version = int(np.frombuffer(self.map, dtype=np.uint32, count=1, offset=len(MAGIC))[0])
+        if self.version not in SUPPORTED_VERSIONS:
+            raise ValueError(filename + " has index format version " + str(self.version)
+                             + ", expected " + str(VERSION))
+
+        header_length = int(np.frombuffer(self.map, dtype=np.uint32, count=1, offset=len(MAGIC) + 4)[0])
+        header_start = len(MAGIC) + 8
+        self.header = json.loads(self.map[header_start:header_start + header_length].decode("utf-8"))
+        self.data_start = align(header_start + header_length)
+
+    # returns a section of the file as an array
+    def array(self, name):
+        section = self.header["sections"][name]
+        return np.frombuffer(self.map, dtype=np.dtype(section["dtype"]), count=section["count"],
+                             offset=self.data_start + section["offset"])
+
+    # returns whether or not the file has a section
+    def has_section(self, name):
+        return name in self.header["sections"] or name + "_blob" in self.header["sections"]
+
+    # returns a list of strings written by write_index_file as a StringTable
+    def strings(self, name):
+        return StringTable(self.array(name + "_blob"), self.array(name + "_offsets"))
+
+    # unmaps the file, the arrays and strings read from it must not be used anymore
+    def close(self):
+        self.map.close()
+
+
+# rounds a file position up to the section alignment
+def align(position):
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+'''
+writes an index file from {name: array} sections and a dict of JSON metadata
+lists of strings are stored as <name>_blob and <name>_offsets
+'''
+def write_index_file(filename, metadata, arrays, strings):
+    sections = dict(arrays)
+    for name, values in strings.items():
+        sections[name + "_blob"], sections[name + "_offsets"] = StringTable.encode(values)
+
+    header = dict(metadata, version=VERSION, sections={})
+    position = 0
+    for name, array in sections.items():
+        array = np.ascontiguousarray(array)
+        sections[name] = array
+        header["sections"][name] = {"offset": position, "dtype": array.dtype.str, "count": len(array)}
+        position = align(position + array.nbytes)
+
+    encoded_header = json.dumps(header).encode("utf-8")
+
+    # write next to the target and rename, so a map of the previous file stays valid
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.array([VERSION, len(encoded_header)], dtype=np.uint32).tobytes())
+        f.write(encoded_header)
+        data_start = align(f.tell())
+        f.write(b"\0" * (data_start - f.tell()))
+
+        # a chunk at a time, so memory mapped sections aren't read into memory whole
+        for name, array in sections.items():
+            f.write(b"\0" * (data_start + header["sections"][name]["offset"] - f.tell()))
+            for start in range(0, len(array), WRITE_CHUNK):
+                f.write(array[start:start + WRITE_CHUNK].tobytes())
+
+    os.replace(tmp_filename, filename)
@@ -0,0 +1,235 @@
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+import threading
+import bisect
+import json
+import sys
+import time
+
+
+# upper bounds in seconds of the buckets of the stage time histograms, the last bucket has no bound
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# rate : (counter, stage timer), the counter divided by the seconds spent in the stage
+RATES = {"pages_fetched_per_s": ("pages_fetched", "fetch"), "bytes_fetched_per_s": ("bytes_fetched", "fetch"),
+         "pages_parsed_per_s": ("pages_parsed", "parse"), "words_tokenized_per_s": ("words_tokenized", "tokenize"),
+         "stems_per_s": ("words_stemmed", "stem"), "queries_per_s": ("queries", "query")}
+
+
+class StageTimer:
+    '''
+    Number of runs, total, min and max seconds and a histogram of the run times of a stage
+    '''
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)  # runs per bucket, not cumulative
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    # adds the runs of another timer, given as its state
+    def merge(self, state):
+        count, total, minimum, maximum, buckets = state
+        if count == 0:
+            return
+
+        self.count += count
+        self.total += total
+        self.min = minimum if self.min is None else min(self.min, minimum)
+        self.max = max(self.max, maximum)
+        self.buckets = [a + b for a, b in zip(self.buckets, buckets)]
+
+    def state(self):
+        return self.count, self.total, self.min, self.max, list(self.buckets)
+
+    '''
+    returns the estimated q quantile in seconds, interpolated within its histogram bucket
+    like the histogram_quantile of Prometheus, clamped to the min and max seen
+    '''
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        cumulative = 0
+        for i, n in enumerate(self.buckets):
+            if n > 0 and cumulative + n >= rank:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(max(lower + (upper - lower) * (rank - cumulative) / n, self.min), self.max)
+            cumulative += n
+
+        return self.max
+
+
+class Stats:
+    '''
+    Counters, gauges and stage timers of crawling, indexing and querying
+
+    disabled by default, every method returns right away until enable() is called so the
+    calls can stay on hot paths. Worker processes have their own Stats: take() returns what
+    a worker recorded and merge() adds it to the Stats of the main process.
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters = Counter()  # name : running total
+            self.gauges = {}  # name : last value
+            self.timers = {}  # name : StageTimer
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    # adds amount to a counter
+    def count(self, name, amount=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] += amount
+
+    # sets a gauge to its current value
+    def gauge(self, name, value):
+        if self.enabled:
+            with self.lock:
+                self.gauges[name] = value
+
+    # records a run of a stage that took seconds
+    def record(self, name, seconds):
+        if self.enabled:
+            with self.lock:
+                if name not in self.timers:
+                    self.timers[name] = StageTimer()
+                self.timers[name].add(seconds)
+
+    # returns a context manager recording the time spent in its block as a run of a stage
+    def timer(self, name):
+        if not self.enabled:
+            return nullcontext()
+        return self.timed(name)
+
+    @contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    # returns (counters, gauges, timer states) and resets the stats, see merge
+    def take(self):
+        with self.lock:
+            state = (dict(self.counters), dict(self.gauges), {n: t.state() for n, t in self.timers.items()})
+        self.reset()
+        return state
+
+    # adds the stats taken from another process
+    def merge(self, state):
+        if not self.enabled:
+            return
+
+        counters, gauges, timers = state
+        with self.lock:
+            self.counters.update(counters)
+            self.gauges.update(gauges)
+            for name, timer_state in timers.items():
+                if name not in self.timers:
+                    self.timers[name] = StageTimer()
+                self.timers[name].merge(timer_state)
+
+    # returns the stats as a dict that can be written as JSON, times are in milliseconds
+    def summary(self):
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            timers = {name: {"count": t.count, "total_ms": t.total * 1000,
+                             "mean_ms": t.total / t.count * 1000 if t.count else 0.0,
+                             "min_ms": (t.min or 0.0) * 1000, "max_ms": t.max * 1000,
+                             "p50_ms": t.quantile(0.5) * 1000, "p90_ms": t.quantile(0.9) * 1000,
+                             "p99_ms": t.quantile(0.99) * 1000,
+                             "buckets": {str(b): n for b, n in zip(BUCKETS + ("+Inf",), t.buckets)}}
+                      for name, t in sorted(self.timers.items())}
+
+        rates = {}
+        for rate, (counter, timer) in RATES.items():
+            if counter in counters and timer in timers and timers[timer]["total_ms"] > 0:
+                rates[rate] = counters[counter] / (timers[timer]["total_ms"] / 1000)
+
+        return {"uptime_s": time.time() - self.started, "counters": counters, "gauges": gauges,
+                "rates": rates, "timers": timers}
+
+    # returns the stats as a table, one line per stage timer then the counters, gauges and rates
+    def table(self):
+        summary = self.summary()
+        lines = ["{: <16} {: >8} {: >12} {: >10} {: >10} {: >10} {: >10}".format(
+            "Stage", "Runs", "Total ms", "Mean ms", "p50 ms", "p99 ms", "Max ms")]
+
+        for name, t in summary["timers"].items():
+            lines.append("{: <16} {: >8} {: >12.1f} {: >10.3f} {: >10.3f} {: >10.3f} {: >10.3f}".format(
+                name, t["count"], t["total_ms"], t["mean_ms"], t["p50_ms"], t["p99_ms"], t["max_ms"]))
+
+        for title, values in (("Counter", summary["counters"]), ("Gauge", summary["gauges"]), ("Rate", summary["rates"])):
+            if values:
+                lines.append("")
+                lines.append("{: <24} {: >16}".format(title, "Value"))
+                for name, value in sorted(values.items()):
+                    lines.append("{: <24} {: >16}".format(name, round(value, 1) if isinstance(value, float) else value))
+
+        return "\n".join(lines)
+
+    # returns the stats in the Prometheus text format, stage timers are histograms in seconds
+    def prometheus(self, prefix="search_engine"):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            timers = [(name, t.state()) for name, t in sorted(self.timers.items())]
+
+        lines = []
+        for name, value in counters:
+            lines += ["# TYPE {}_{}_total counter".format(prefix, name), "{}_{}_total {}".format(prefix, name, value)]
+
+        for name, value in gauges:
+            lines += ["# TYPE {}_{} gauge".format(prefix, name), "{}_{} {}".format(prefix, name, value)]
+
+        for name, (count, total, _, _, buckets) in timers:
+            metric = prefix + "_" + name + "_seconds"
+            lines.append("# TYPE " + metric + " histogram")
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ("+Inf",), buckets):
+                cumulative += n
+                lines.append('{}_bucket{{le="{}"}} {}'.format(metric, bound, cumulative))
+            lines += ["{}_sum {}".format(metric, total), "{}_count {}".format(metric, count)]
+
+        return "\n".join(lines) + "\n"
+
+    # writes the stats to a file, as JSON if its name ends in .json and in the Prometheus text format otherwise
+    def dump(self, filename):
+        with open(filename, "w") as f:
+            if filename.endswith(".json"):
+                json.dump(self.summary(), f, indent=2)
+            else:
+                f.write(self.prometheus())
+
+    # prints the table of the stats to stderr and writes them to filename, if any
+    def report(self, filename=None):
+        print("\n" + self.table(), file=sys.stderr)
+
+        if filename:
+            try:
+                self.dump(filename)
+            except IOError as e:
+                print("Error writing stats file: " + str(e), file=sys.stderr)
+
+
+# the stats of this process
+stats = Stats()
@@ -0,0 +1,177 @@
+import numpy as np
+from scipy.sparse import csc_matrix
+
+
+# returns (whether each value is in a sorted array, positions of the values found), with a binary search per value
+def search_sorted(values, sorted_values):
+    if len(sorted_values) == 0:
+        return np.zeros(len(values), dtype=bool), np.zeros(0, dtype=np.int64)
+
+    positions = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    found = sorted_values[positions] == values
+    return found, positions[found]
+
+
+class InvertedIndex:
+    '''
+    Term -> postings index stored as three flat arrays (the CSC layout of the term-doc matrix)
+
+    the postings of term t are doc_ids[offsets[t]:offsets[t + 1]] with their term frequencies
+    in tfs at the same positions, sorted by doc number. A doc number is the column of the
+    document in the old frequency matrix, docs[doc number] is its DocumentID.
+    '''
+    def __init__(self, docs=None, terms=None, offsets=None, doc_ids=None, tfs=None):
+        self.docs = docs if docs is not None else []  # doc number : DocumentID
+        self.terms = terms if terms is not None else []  # sorted list of stemmed terms
+        self.offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self.doc_ids = doc_ids if doc_ids is not None else np.zeros(0, dtype=np.int32)
+        self.tfs = tfs if tfs is not None else np.zeros(0, dtype=np.int32)
+        self.term_ids = None  # term : row, built on first lookup
+
+    def __len__(self):
+        return len(self.terms)
+
+    '''
+    builds an index from {term: ([doc numbers], [term frequencies])}
+    doc numbers must be increasing within each postings list
+    '''
+    @classmethod
+    def from_postings(cls, docs, postings):
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[t][0]) for t in terms])
+
+        doc_ids = np.fromiter((d for t in terms for d in postings[t][0]), dtype=np.int32, count=offsets[-1])
+        tfs = np.fromiter((f for t in terms for f in postings[t][1]), dtype=np.int32, count=offsets[-1])
+
+        return cls(list(docs), terms, offsets, doc_ids, tfs)
+
+    # builds an index from a dense term-doc frequency matrix (row=term, col=doc)
+    @classmethod
+    def from_dense(cls, docs, terms, frequency_matrix):
+        postings = {}
+
+        for term, row in zip(terms, frequency_matrix):
+            postings[term] = ([d for d, f in enumerate(row) if f > 0], [f for f in row if f > 0])
+
+        return cls.from_postings(docs, postings)
+
+    '''
+    returns a new index without the DocumentIDs in removed and with the docs in
+    added = [(DocumentID, {term: frequency})] appended after the remaining docs
+
+    remaining docs keep their order, so the result is the index a full build would produce
+    '''
+    def update(self, removed, added):
+        keep = np.array([doc_id not in removed for doc_id in self.docs], dtype=bool)
+        docs = [doc_id for doc_id, k in zip(self.docs, keep) if k] + [doc_id for doc_id, _ in added]
+
+        # remaining postings, renumbered to close the gaps of the removed docs
+        new_numbers = np.cumsum(keep) - 1
+        posting_keep = keep[self.doc_ids]
+        old_terms = np.repeat(np.arange(len(self.terms)), np.diff(self.offsets))[posting_keep]
+        old_docs = new_numbers[self.doc_ids[posting_keep]]
+        old_tfs = self.tfs[posting_keep]
+
+        # terms that still have postings, plus the terms of the added docs
+        terms = set(self.terms[t] for t in np.unique(old_terms).tolist())
+        terms.update(term for _, counts in added for term in counts)
+        terms = sorted(terms)
+        term_ids = {t: i for i, t in enumerate(terms)}
+
+        old_to_new = np.array([term_ids.get(t, -1) for t in self.terms], dtype=np.int64)
+        added_terms = [term_ids[term] for _, counts in added for term in counts]
+        added_docs = [len(docs) - len(added) + i for i, (_, counts) in enumerate(added) for _ in counts]
+        added_tfs = [f for _, counts in added for f in counts.values()]
+
+        all_terms = np.concatenate([old_to_new[old_terms], np.array(added_terms, dtype=np.int64)])
+        all_docs = np.concatenate([old_docs, np.array(added_docs, dtype=np.int64)])
+        all_tfs = np.concatenate([old_tfs, np.array(added_tfs, dtype=np.int32)])
+
+        # group the postings by term, sorted by doc number within each term
+        order = np.lexsort((all_docs, all_terms))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(all_terms, minlength=len(terms)))
+
+        return InvertedIndex(docs, terms, offsets, all_docs[order].astype(np.int32), all_tfs[order].astype(np.int32))
+
+    @property
+    def num_docs(self):
+        return len(self.docs)
+
+    @property
+    def num_postings(self):
+        return int(self.offsets[-1])
+
+    # returns the row of a term or None if the term isn't indexed
+    def term_id(self, term):
+        # terms read from an index file are found with a binary search
+        if not isinstance(self.terms, list):
+            return self.terms.find(term)
+
+        if self.term_ids is None:
+            self.term_ids = {t: i for i, t in enumerate(self.terms)}
+        return self.term_ids.get(term)
+
+    # returns (doc numbers, term frequencies) of a term, both empty if it isn't indexed
+    def postings(self, term):
+        t = self.term_id(term)
+        if t is None:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+
+        return self.term_postings(t)
+
+    # returns (doc numbers, term frequencies) of the term at row t
+    def term_postings(self, t):
+        start, end = self.offsets[t], self.offsets[t + 1]
+        return self.doc_ids[start:end], self.tfs[start:end]
+
+    # returns the doc numbers of the term at row t
+    def term_docs(self, t):
+        return self.doc_ids[self.offsets[t]:self.offsets[t + 1]]
+
+    # returns (whether each of the sorted doc numbers is in the postings of the term at row t, posting numbers of those found)
+    def find_postings(self, t, doc_numbers):
+        found, positions = search_sorted(doc_numbers, self.term_docs(t))
+        return found, self.offsets[t] + positions
+
+    # returns the sorted doc numbers in the postings of every term in term_ids, shortest postings first
+    def intersect(self, term_ids):
+        term_ids = sorted(term_ids, key=lambda t: self.offsets[t + 1] - self.offsets[t])
+        if len(term_ids) == 0:
+            return np.zeros(0, dtype=np.int32)
+
+        matches = self.term_docs(term_ids[0])
+        for t in term_ids[1:]:
+            matches = matches[self.find_postings(t, matches)[0]]
+
+        return matches
+
+    # returns the bytes taken by the postings
+    def postings_nbytes(self):
+        return self.offsets.nbytes + self.doc_ids.nbytes + self.tfs.nbytes
+
+    # returns the dense frequency row of the term at row t (one entry per doc)
+    def dense_row(self, t):
+        row = [0] * self.num_docs
+        doc_ids, tfs = self.term_postings(t)
+
+        for d, f in zip(doc_ids.tolist(), tfs.tolist()):
+            row[d] = f
+
+        return row
+
+    # returns the total frequency of each term across all docs
+    def term_totals(self):
+        totals = np.zeros(len(self.terms), dtype=np.int64)
+        np.add.at(totals, np.repeat(np.arange(len(self.terms)), np.diff(self.offsets)), self.tfs)
+        return totals
+
+    # returns the number of docs each term appears in
+    def doc_freqs(self):
+        return np.diff(self.offsets)
+
+    # returns a SciPy CSR matrix view of the index (row=doc, col=term)
+    def to_csr(self, dtype=np.float64):
+        return csc_matrix((self.tfs.astype(dtype), self.doc_ids, self.offsets),
+                          shape=(self.num_docs, len(self.terms))).tocsr()
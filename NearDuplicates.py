@@ -0,0 +1,104 @@
+from collections import Counter
+import hashlib
+import numpy as np
+
+
+'''
+Near-duplicate detection with 64 bit SimHash fingerprints
+
+the fingerprint of a document is the SimHash of its words weighted by their counts, so
+documents differing by a few words (a timestamp, a session token) get fingerprints that
+differ in a few bits. Fingerprints are looked up in bands: with max_distance + 1 bands,
+two fingerprints differing in at most max_distance bits agree on at least one band, so
+only the documents sharing a band with a page are compared to it.
+'''
+FINGERPRINT_BITS = 64
+
+# word : 64 bit hash, memoizes word_hash
+word_hashes = {}
+
+
+# returns a 64 bit hash of a word, the same in every process unlike hash()
+def word_hash(word):
+    h = word_hashes.get(word)
+    if h is None:
+        h = word_hashes[word] = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+    return h
+
+
+# returns the SimHash fingerprint of a list of words
+def simhash(words):
+    counts = Counter(words)
+    if len(counts) == 0:
+        return 0
+
+    hashes = np.array([word_hash(w) for w in counts], dtype="<u8")
+    weights = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+
+    # bit j of every hash as a row of +1/-1, summed with the word counts as weights
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    totals = weights @ (bits.astype(np.float64) * 2 - 1)
+
+    return int(np.packbits(totals > 0, bitorder="little").view("<u8")[0])
+
+
+# returns the number of bits two fingerprints differ in
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex:
+    '''
+    Fingerprints of documents, looked up by the documents within max_distance bits of a fingerprint
+    '''
+    def __init__(self, max_distance=3):
+        self.max_distance = int(max_distance)
+        self.fingerprints = {}  # DocumentID : fingerprint
+        self.bands = {}  # (band, bits of the band) : [DocumentIDs]
+
+        # (shift, mask) of every band, the bits are split as evenly as possible
+        num_bands = self.max_distance + 1
+        bounds = [FINGERPRINT_BITS * b // num_bands for b in range(num_bands + 1)]
+        self.band_masks = [(bounds[b], (1 << (bounds[b + 1] - bounds[b])) - 1) for b in range(num_bands)]
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.fingerprints
+
+    def band_keys(self, fingerprint):
+        return [(b, (fingerprint >> shift) & mask) for b, (shift, mask) in enumerate(self.band_masks)]
+
+    def add(self, doc_id, fingerprint):
+        if doc_id in self.fingerprints:
+            self.remove(doc_id)
+
+        self.fingerprints[doc_id] = fingerprint
+        for key in self.band_keys(fingerprint):
+            self.bands.setdefault(key, []).append(doc_id)
+
+    def remove(self, doc_id):
+        fingerprint = self.fingerprints.pop(doc_id, None)
+        if fingerprint is None:
+            return
+
+        for key in self.band_keys(fingerprint):
+            self.bands[key].remove(doc_id)
+            if len(self.bands[key]) == 0:
+                del self.bands[key]
+
+    '''
+    returns the DocumentID of the closest fingerprint within max_distance bits, or None
+    ties go to the document found first, in band order then in the order documents were added
+    '''
+    def find(self, fingerprint):
+        closest, closest_distance = None, self.max_distance + 1
+
+        for key in self.band_keys(fingerprint):
+            for doc_id in self.bands.get(key, ()):
+                distance = hamming_distance(fingerprint, self.fingerprints[doc_id])
+                if distance < closest_distance:
+                    closest, closest_distance = doc_id, distance
+
+        return closest
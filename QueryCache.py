@@ -0,0 +1,87 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class QueryCache:
+    '''
+    LRU cache of query results, entries expire ttl seconds after they were stored (None = never)
+
+    entries are stored with the version of the index that produced them, reading with
+    another version empties the cache, so results never outlive the index they came from
+    the cache can be shared by threads
+    '''
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = int(max_size)
+        self.ttl = float(ttl) if ttl is not None else None
+        self.entries = OrderedDict()  # key : (time stored, results), least recently used first
+        self.version = None  # index version of the entries
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    # pickles the settings and counters only, the entries belong to the index of this process
+    def __getstate__(self):
+        state = dict(self.__dict__, entries=OrderedDict(), version=None)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    # returns the results stored for a key or None
+    def get(self, key, version):
+        with self.lock:
+            return self.get_locked(key, version)
+
+    def get_locked(self, key, version):
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.version = version
+
+        entry = self.entries.get(key)
+        if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+            del self.entries[key]
+            self.expirations += 1
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    # stores the results of a key, evicting the least recently used entry when the cache is full
+    def put(self, key, version, results):
+        if self.max_size <= 0 or version != self.version:
+            return
+
+        with self.lock:
+            self.entries[key] = (time.monotonic(), results)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    # returns the fraction of lookups answered from the cache
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def stats(self):
+        return {"size": len(self.entries), "max_size": self.max_size, "ttl": self.ttl, "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hit_rate(), "expirations": self.expirations,
+                "invalidations": self.invalidations}
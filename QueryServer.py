@@ -0,0 +1,184 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import deque, Counter
+import urllib.parse
+import threading
+import json
+import time
+import os
+import numpy as np
+from Instrumentation import stats
+
+
+class RequestMetrics:
+    '''
+    Counts of the requests answered by a QueryServer and the latencies of the last window searches
+    '''
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.latencies = deque(maxlen=window)  # seconds of the most recent searches
+        self.statuses = Counter()  # HTTP status : number of responses
+        self.searches = 0
+
+    def record(self, status, seconds=None):
+        with self.lock:
+            self.statuses[status] += 1
+            if seconds is not None:
+                self.searches += 1
+                self.latencies.append(seconds)
+
+    def snapshot(self):
+        with self.lock:
+            latencies = list(self.latencies)
+            statuses = dict(self.statuses)
+            searches = self.searches
+
+        uptime = time.time() - self.started
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000 if latencies else (0, 0, 0)
+        return {"uptime_s": uptime, "searches": searches, "searches_per_s": searches / uptime if uptime > 0 else 0,
+                "responses": {str(status): count for status, count in statuses.items()},
+                "latency_ms": {"p50": float(p50), "p90": float(p90), "p99": float(p99),
+                               "max": max(latencies) * 1000 if latencies else 0, "window": len(latencies)}}
+
+
+class QueryServer:
+    '''
+    Answers queries over HTTP with JSON from an index loaded once at startup
+
+        GET  /search?q=<query>&k=<results>   ranked results of process_query
+        GET  /metrics                        request counts, latency percentiles, the index and the stage stats
+        POST /reload                         loads the index file again and swaps it in
+
+    load_engine(filename) returns a SearchEngine ready for queries. A reload builds the new
+    engine next to the one serving requests and swaps the reference, so requests in flight
+    finish on the engine they started with. With watch_interval the index file is checked
+    every watch_interval seconds and reloaded when it's replaced.
+    '''
+    def __init__(self, load_engine, index_filename, host="127.0.0.1", port=8000, watch_interval=None):
+        self.load_engine = load_engine
+        self.index_filename = index_filename
+        self.watch_interval = watch_interval
+        self.reload_lock = threading.Lock()  # one reload at a time
+        self.engine = None
+        self.index_mtime = None
+        self.loaded_at = None
+        self.reloads = 0
+        self.metrics = RequestMetrics()
+        self.reload()
+
+        self.server = ThreadingHTTPServer((host, int(port)), self.make_handler())
+        self.server.daemon_threads = True
+        self.stopped = threading.Event()
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    # returns the base url of the server
+    def url(self):
+        return "http://" + self.server.server_address[0] + ":" + str(self.server.server_address[1])
+
+    def serve_forever(self):
+        if self.watch_interval:
+            threading.Thread(target=self.watch, daemon=True).start()
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    # loads the index file into a new engine and swaps it in, returns the new engine
+    def reload(self):
+        with self.reload_lock:
+            mtime = os.stat(self.index_filename).st_mtime_ns
+            engine = self.load_engine(self.index_filename)
+
+            # a single assignment, requests read self.engine once
+            self.engine = engine
+            self.index_mtime = mtime
+            self.loaded_at = time.time()
+            self.reloads += 1
+            return engine
+
+    # reloads the index whenever its file is replaced, until the server is shut down
+    def watch(self):
+        while not self.stopped.wait(self.watch_interval):
+            try:
+                if os.stat(self.index_filename).st_mtime_ns != self.index_mtime:
+                    self.reload()
+            except (OSError, ValueError) as e:
+                print("Error reloading index file: " + str(e))
+
+    # returns (results of process_query as dicts, seconds it took)
+    def search(self, query, k):
+        engine = self.engine
+        results, seconds = engine.timed_query(query, k)
+        return engine.result_records(results), seconds
+
+    def index_info(self):
+        engine = self.engine
+        return {"file": self.index_filename, "docs": engine.index.num_docs, "terms": len(engine.index),
+                "loaded_at": self.loaded_at, "reloads": self.reloads - 1, "cache": engine.query_cache.stats()}
+
+    def make_handler(self):
+        query_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def send_json(self, status, body, seconds=None):
+                encoded = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded)))
+                self.end_headers()
+                self.wfile.write(encoded)
+                query_server.metrics.record(status, seconds)
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                parameters = urllib.parse.parse_qs(url.query)
+
+                if url.path == "/search":
+                    query = parameters.get("q", [""])[0]
+                    try:
+                        k = int(parameters.get("k", ["6"])[0])
+                    except ValueError:
+                        k = 0
+
+                    if len(query.split()) == 0 or not 0 < k <= 1000:
+                        self.send_json(400, {"error": "expected /search?q=<query>&k=<1 to 1000>"})
+                        return
+
+                    results, seconds = query_server.search(query, k)
+                    self.send_json(200, {"query": query, "k": k, "latency_ms": round(seconds * 1000, 3),
+                                         "results": results}, seconds)
+
+                elif url.path == "/metrics":
+                    metrics = dict(query_server.metrics.snapshot(), index=query_server.index_info())
+                    if stats.enabled:
+                        metrics["stages"] = stats.summary()
+                    self.send_json(200, metrics)
+
+                else:
+                    self.send_json(404, {"error": "unknown path " + url.path})
+
+            def do_POST(self):
+                if urllib.parse.urlsplit(self.path).path != "/reload":
+                    self.send_json(404, {"error": "unknown path " + self.path})
+                    return
+
+                try:
+                    query_server.reload()
+                except (OSError, ValueError) as e:
+                    self.send_json(500, {"error": "error reloading index file: " + str(e)})
+                    return
+
+                self.send_json(200, {"index": query_server.index_info()})
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -1,25 +1,101 @@
-
-from WebCrawler import WebCrawler
+from WebCrawler import WebCrawler, UrlQueue, UrlSet
+from InvertedIndex import InvertedIndex, search_sorted
+from CompressedPostings import CompressedIndex
+from IndexFile import IndexFile, StoredMapping, write_index_file, MAGIC
+from Clustering import leader_follower, assign_followers, follower_distances
+from QueryCache import QueryCache
+from QueryServer import QueryServer
+from UrlFilter import RobotsRules
+from Instrumentation import stats
+from scipy.sparse import csc_matrix
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import redirect_stdout
+from itertools import repeat
 import pickle
+import atexit
 import sys
+import os
+import json
+import time
 import argparse
 import numpy as np
 import random
-from sklearn.metrics.pairwise import euclidean_distances
-from nltk.stem import PorterStemmer
 import math
 import csv
+from collections import Counter
 from textwrap import wrap
 
 
+# attributes that decide how queries are answered, copied to batch search worker processes
+QUERY_SETTINGS = ["stop_words", "thesaurus", "synonym_weight", "cluster_probes", "title_scoring",
+                  "title_weight", "bm25_k1", "bm25_b", "top_k_pruning"]
+
+# slack of the MaxScore bounds, covering the rounding of scores added up in another order
+SCORE_TOLERANCE = 1e-9
+
+# engine of a batch search worker process, loaded by init_search_worker
+worker_engine = None
+
+
+'''
+returns a new engine answering queries from an index file, with the query settings of another engine
+the engine doesn't print anything while answering queries
+raises ValueError if the file can't be loaded
+'''
+def load_search_engine(filename, settings, cache_size=1024, cache_ttl=None):
+    engine = SearchEngine("")
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        loaded = engine.load_index(filename)
+    if loaded == 0:
+        raise ValueError("can't load index file " + filename)
+
+    engine.__dict__.update(settings)
+    engine.print_expansions = False
+    engine.set_query_cache(cache_size, cache_ttl)
+    engine.index_changed()
+    return engine
+
+
+# loads the index file of a batch search worker process, each process maps the same file
+def init_search_worker(filename, settings):
+    global worker_engine
+    worker_engine = load_search_engine(filename, settings)
+
+
+# answers a query in a batch search worker process, returns (results, seconds)
+def search_worker(query, k):
+    return worker_engine.timed_query(query, k)
+
+
 class SearchEngine(WebCrawler):
     def __init__(self, seed_url):
         super().__init__(seed_url)
         self.thesaurus = None  # {word: alternative}
         self.thesaurus_file = None
+        self.synonyms = None  # (thesaurus, {word: [(synonym, stemmed synonym)]}) built from the thesaurus
+        self.synonym_weight = 0.5  # weight of the terms only a synonym adds to a query
         self.clusters = None  # {leader: [ (followerN, distanceN) ]}
+        self.cluster_seed = None  # seed of the leaders picked by cluster_docs (None = random module)
+        self.cluster_init = "random"  # "random" or "kmeans++" leaders
+        self.cluster_iterations = 0  # mini-batch k-means iterations moving the leaders
+        self.cluster_batch_size = 1024  # documents per mini-batch
+        self.cluster_probes = None  # number of clusters scored per query (None = every document is scored)
+        self.cluster_vectors = None  # (clusters, doc_weights, leader vectors, members, starts, member vectors)
         self.N = None  # number of docs indexed
         self.df = None  # doc frequency for each term
+        self.doc_weights = None  # L2 normalized tf-idf weight of each posting in self.index
+        self.index_file = None  # memory mapped IndexFile the index was loaded from
+        self.index_version = 0  # changes whenever anything process_query reads changes
+        self.title_index = InvertedIndex()  # lower case title word : postings of (doc number, occurrences)
+        self.title_scoring = "boost"  # "boost" adds .25 for title matches, "bm25f" scores title and body with BM25F
+        self.title_weight = 2.0  # BM25F weight of a title occurrence relative to a body occurrence
+        self.bm25_k1 = 1.2  # BM25F term frequency saturation
+        self.bm25_b = 0.75  # BM25F length normalization of both fields
+        self.field_norms = None  # (index, title index, body length norms, title length norms) used by BM25F
+        self.top_k_pruning = False  # score only the documents that can reach the top k (MaxScore)
+        self.term_bounds = None  # (doc weights, largest absolute doc weight of every term) used by MaxScore
+        self.query_cache = QueryCache()  # (query words, k, expanded, probes) : results of process_query
+        self.print_expansions = True  # whether evaluate_query says when it expands a query, off for query servers
 
     # parses a thesaurus file and sets attribute
     def set_thesaurus(self, thesaurus_file):
@@ -35,6 +111,8 @@ class SearchEngine(WebCrawler):
 
             self.thesaurus = thesaurus
             self.thesaurus_file = thesaurus_file
+            self.get_synonyms()
+            self.index_changed()
 
         except IOError as e:
             print("Error opening" + thesaurus_file + " error({0}): {1}".format(e.errno, e.strerror))
@@ -44,7 +122,58 @@ class SearchEngine(WebCrawler):
             print("Error opening" + thesaurus_file + "Unexpected error:", sys.exc_info()[0])
             raise
 
-    # loads index from disk
+    '''
+    returns {word: [(synonym, stemmed synonym)]} of the thesaurus, built on first use after set_thesaurus
+
+    the synonyms of a word include the synonyms of its synonyms, in the order the old
+    recursive expansion appended them to a query, split into words
+    '''
+    def get_synonyms(self):
+        if self.synonyms is None or self.synonyms[0] is not self.thesaurus:
+            synonyms = {}
+
+            for word in self.thesaurus or {}:
+                expansion = [word]
+                for term in expansion:
+                    expansion += [syn for syn in (self.thesaurus or {}).get(term, []) if syn not in expansion]
+
+                synonyms[word] = [(w, self.stem(w)) for syn in expansion[1:] for w in syn.split()]
+
+            self.synonyms = (self.thesaurus, synonyms)
+
+        return self.synonyms[1]
+
+    # returns the synonyms of the query words that aren't query words, each one once: [(synonym, stemmed synonym)]
+    def expand_query(self, words):
+        synonyms = self.get_synonyms()
+        expansion = {}
+
+        for word in words:
+            for synonym, stem in synonyms.get(word, []):
+                if synonym not in words:
+                    expansion.setdefault(synonym, stem)
+
+        return list(expansion.items())
+
+    # sets the weight of the terms added by thesaurus expansion relative to the query terms (1 = same weight)
+    def set_synonym_weight(self, weight):
+        self.synonym_weight = float(weight)
+        self.index_changed()
+
+    # modify parent method to invalidate the cached query results
+    def set_stop_words(self, filepath):
+        super().set_stop_words(filepath)
+        self.index_changed()
+
+    # caches up to size query results for ttl seconds (None = until the index changes), a size of 0 disables the cache
+    def set_query_cache(self, size=1024, ttl=None):
+        self.query_cache = QueryCache(size, ttl)
+
+    # marks the cached query results as stale
+    def index_changed(self):
+        self.index_version += 1
+
+    # loads index from disk, either an index file or an index pickled by older versions
     def load_index(self, filename="Output/exported_index.obj"):
         try:
             f = open(filename, "rb")
@@ -52,17 +181,207 @@ class SearchEngine(WebCrawler):
             print("Error opening index file: " + filename)
             return 0
 
-        tmp_dict = pickle.load(f)
+        if f.read(len(MAGIC)) == MAGIC:
+            f.close()
+
+            try:
+                with stats.timer("load_index"):
+                    self.map_index(IndexFile(filename))
+            except ValueError as e:
+                print("Error opening index file: " + str(e))
+                return 0
+
+            print("Index successfully imported from disk.")
+            return
+
+        f.seek(0)
+        with stats.timer("load_index"):
+            tmp_dict = pickle.load(f)
         f.close()
 
+        # indexes exported before the inverted index stored a dense frequency matrix
+        if "frequency_matrix" in tmp_dict:
+            tmp_dict["index"] = InvertedIndex.from_dense(list(tmp_dict["doc_words"].keys()), tmp_dict["all_terms"],
+                                                         tmp_dict.pop("frequency_matrix"))
+
         self.__dict__.update(tmp_dict)
+
+        # older indexes kept the frontier and the url collections in lists
+        self.url_frontier = UrlQueue(self.url_frontier)
+        for name in ("outgoing_urls", "broken_urls", "graphic_urls"):
+            setattr(self, name, UrlSet(getattr(self, name)))
+        # and the robots.txt rules in lists of urls
+        if self.robots_txt is not None:
+            rules = [(url[len(self.seed_url):], allowed) for allowed, key in ((False, "Disallowed"), (True, "Allowed"))
+                     for url in self.robots_txt[key]]
+            self.robots.add(self.seed_url, RobotsRules(rules))
+
+        if "doc_weights" not in tmp_dict:
+            self.build_doc_vectors()
+        self.build_title_index()
+        self.index_changed()
         print("Index successfully imported from disk.")
 
-    # saves index from disk
+    # serves queries from a memory mapped index file
+    def map_index(self, index_file):
+        header = index_file.header
+        docs = index_file.strings("docs")
+
+        self.seed_url = header["seed_url"]
+        self.domain_url = header["domain_url"]
+        self.N = header["N"]
+        self.clusters = None if header["clusters"] is None else \
+            {leader: [tuple(f) for f in followers] for leader, followers in header["clusters"]}
+
+        # the postings of index files written with compression stay compressed in the map
+        if index_file.has_section("doc_gaps"):
+            self.index = CompressedIndex(docs, index_file.strings("terms"), index_file.array("offsets"),
+                                         index_file.array("doc_gaps"), index_file.array("tf_codes"),
+                                         index_file.array("skip_docs"), index_file.array("skip_doc_offsets"),
+                                         index_file.array("skip_tf_offsets"))
+            self.compress_postings = True
+        else:
+            self.index = InvertedIndex(docs, index_file.strings("terms"), index_file.array("offsets"),
+                                       index_file.array("doc_ids"), index_file.array("tfs"))
+        self.all_terms = self.index.terms
+        self.df = index_file.array("df")
+        self.doc_weights = index_file.array("doc_weights")
+
+        # the doc number of a document is its position in the tables, the three mappings share one key lookup
+        self.doc_titles = StoredMapping(docs, index_file.strings("titles"))
+        self.doc_urls = StoredMapping(docs, index_file.strings("urls"), self.doc_titles)
+        self.doc_snippets = StoredMapping(docs, index_file.strings("snippets"), self.doc_titles)
+        self.doc_words = {}
+        self.index_file = index_file
+        self.near_duplicates = {}
+
+        # index files written before the title index have their title index built from the titles
+        if index_file.has_section("title_terms"):
+            self.title_index = InvertedIndex(docs, index_file.strings("title_terms"), index_file.array("title_offsets"),
+                                             index_file.array("title_doc_ids"), index_file.array("title_tfs"))
+        else:
+            self.build_title_index()
+        self.index_changed()
+
+    # saves index to disk as an index file that can be memory mapped
     def save_index(self, filename="Output/exported_index.obj"):
-        f = open(filename, 'wb')
-        pickle.dump(self.__dict__, f)
-        f.close()
+        docs = list(self.index.docs)
+        positions = {doc_id: d for d, doc_id in enumerate(docs)}
+        fingerprints = self.near_duplicate_index.fingerprints if self.near_duplicate_index is not None else {}
+        fingerprints = {positions[doc_id]: f for doc_id, f in fingerprints.items() if doc_id in positions}
+        clusters = None if self.clusters is None else \
+            [[int(leader), [[int(f), float(d)] for f, d in followers]] for leader, followers in self.clusters.items()]
+
+        metadata = {"seed_url": self.seed_url, "domain_url": self.domain_url, "N": self.N, "clusters": clusters,
+                    "num_pages_crawled": self.num_pages_crawled, "num_pages_indexed": self.num_pages_indexed}
+        if isinstance(self.index, CompressedIndex):
+            arrays = {"offsets": self.index.offsets, "doc_gaps": self.index.doc_gaps, "tf_codes": self.index.tf_codes,
+                      "skip_docs": self.index.skip_docs, "skip_doc_offsets": self.index.skip_doc_offsets,
+                      "skip_tf_offsets": self.index.skip_tf_offsets}
+        else:
+            arrays = {"offsets": self.index.offsets, "doc_ids": self.index.doc_ids, "tfs": self.index.tfs}
+        arrays.update({"df": np.asarray(self.df, dtype=np.int64), "doc_weights": self.doc_weights,
+                       "title_offsets": self.title_index.offsets, "title_doc_ids": self.title_index.doc_ids,
+                       "title_tfs": self.title_index.tfs,
+                       "simhash_docs": np.array(sorted(fingerprints), dtype=np.int64),
+                       "simhashes": np.array([fingerprints[d] for d in sorted(fingerprints)], dtype=np.uint64)})
+        strings = {"terms": self.index.terms, "docs": docs, "title_terms": self.title_index.terms,
+                   "titles": [self.doc_titles[d] for d in docs],
+                   "urls": [self.doc_urls[d] for d in docs],
+                   "snippets": [self.doc_snippet(d) for d in docs]}
+
+        # crawl state, used to refresh the index with recrawl
+        strings.update({"visited_urls": list(self.visited_urls),
+                        "visited_titles": [title for title, _ in self.visited_urls.values()],
+                        "visited_doc_ids": [doc_id for _, doc_id in self.visited_urls.values()],
+                        "etags": [self.url_validators.get(url, {}).get("ETag", "") for url in self.visited_urls],
+                        "last_modified": [self.url_validators.get(url, {}).get("Last-Modified", "")
+                                          for url in self.visited_urls],
+                        "near_duplicate_urls": list(self.near_duplicates),
+                        "near_duplicate_doc_ids": list(self.near_duplicates.values()),
+                        "url_frontier": self.url_frontier, "outgoing_urls": self.outgoing_urls,
+                        "broken_urls": self.broken_urls, "graphic_urls": self.graphic_urls})
+
+        with stats.timer("write_index"):
+            write_index_file(filename, metadata, arrays, strings)
+
+    # reads the crawl state of the mapped index file, returns False if the file has none
+    def load_crawl_state(self):
+        if self.index_file is None or not self.index_file.has_section("visited_urls"):
+            return False
+
+        header = self.index_file.header
+        urls = list(self.index_file.strings("visited_urls"))
+        titles = self.index_file.strings("visited_titles")
+        doc_ids = self.index_file.strings("visited_doc_ids")
+        etags = self.index_file.strings("etags")
+        last_modified = self.index_file.strings("last_modified")
+
+        self.visited_urls = {url: (titles[i], doc_ids[i]) for i, url in enumerate(urls)}
+        self.url_validators = {}
+        for i, url in enumerate(urls):
+            validators = {"ETag": etags[i], "Last-Modified": last_modified[i]}
+            self.url_validators[url] = {v: value for v, value in validators.items() if value}
+
+        if self.index_file.has_section("near_duplicate_urls"):
+            self.near_duplicates = dict(zip(self.index_file.strings("near_duplicate_urls"),
+                                            self.index_file.strings("near_duplicate_doc_ids")))
+
+        self.url_frontier = UrlQueue(self.index_file.strings("url_frontier"))
+        for name in ("outgoing_urls", "broken_urls", "graphic_urls"):
+            setattr(self, name, UrlSet(self.index_file.strings(name)))
+        self.num_pages_crawled = header["num_pages_crawled"]
+        self.num_pages_indexed = header["num_pages_indexed"]
+
+        return True
+
+    # modify parent method to load the crawl state of a mapped index and make its documents writable
+    def recrawl(self):
+        if self.index_file is not None and len(self.visited_urls) == 0 and not self.load_crawl_state():
+            print("This index file has no crawl state. The site has to be crawled again.")
+            return False
+
+        self.doc_titles = dict(self.doc_titles)
+        self.doc_urls = dict(self.doc_urls)
+        self.doc_snippets = dict(self.doc_snippets)
+        self.load_fingerprints()
+
+        super().recrawl()
+        return True
+
+    # adds the SimHash fingerprints of the mapped index file to near_duplicate_index
+    def load_fingerprints(self):
+        if self.index_file is None or self.near_duplicate_index is None or not self.index_file.has_section("simhashes"):
+            return
+
+        docs = self.index.docs
+        fingerprints = zip(self.index_file.array("simhash_docs").tolist(), self.index_file.array("simhashes").tolist())
+        for d, fingerprint in fingerprints:
+            if docs[d] not in self.near_duplicate_index:
+                self.near_duplicate_index.add(docs[d], fingerprint)
+
+    # re-crawls the site incrementally and applies the changes to the index and clusters, returns whether it did
+    def refresh_index(self):
+        with stats.timer("recrawl"):
+            if not self.recrawl():
+                return False
+
+        removed, added = self.update_frequency_matrix()
+        print("\nIndex refreshed: " + str(removed) + " documents removed, " + str(added) + " documents added.")
+        return True
+
+    # returns the first 20 words of a document
+    def doc_snippet(self, doc_id):
+        if doc_id in self.doc_words:
+            return " ".join(self.doc_words[doc_id][:20])
+        return self.doc_snippets[doc_id]
+
+    # returns (title, url, first 20 words) of the document with doc number d, read by position from a mapped index
+    def doc_fields(self, d):
+        doc_id = self.index.docs[d]
+        if isinstance(self.doc_titles, StoredMapping) and doc_id not in self.doc_words:
+            return self.doc_titles.value_at(d), self.doc_urls.value_at(d), self.doc_snippets.value_at(d)
+        return self.doc_titles[doc_id], self.doc_urls[doc_id], self.doc_snippet(doc_id)
 
     def validate_query(self, query):
         for q in query.split():
@@ -70,44 +389,74 @@ class SearchEngine(WebCrawler):
                 return False
         return True
 
+    # sets how cluster_docs picks leaders: seed of the random leaders, "random" or "kmeans++" and mini-batch iterations
+    def set_clustering(self, seed=None, init="random", iterations=0, batch_size=1024):
+        self.cluster_seed = int(seed) if seed is not None else None
+        self.cluster_init = init
+        self.cluster_iterations = int(iterations)
+        self.cluster_batch_size = int(batch_size)
+
     """
-    clusters tf matrix into k pairs of leaders and followers
+    clusters the tf-idf doc vectors into k pairs of leaders and followers
     populates self.clusters
+
+    without a seed the leaders are drawn from the random module
     """
     def cluster_docs(self, k=5):
-        # transpose tf matrix
-        X = np.matrix([list(x) for x in zip(*self.frequency_matrix)])
+        X = self.doc_vector_matrix()
 
-        # normalize term frequencies
-        X_max, X_min = X.max(), X.min()
-        X = (X - X_min) / (X_max - X_min)
-
-        if len(X) < k:
+        if X.shape[0] < k:
             print("Warning: not enough documents to pick " + str(k) + " leaders.")
-            k = int(len(X) / 2)
+            k = int(X.shape[0] / 2)
             print("Clustering around " + str(k) + " leaders.")
 
-        # pick a random sample of k docs to be leaders
-        leader_indices = random.sample(range(0, len(X)), k)
-        follower_indices = list(set([i for i in range(len(X))]) - set(leader_indices))
+        rng = random.Random(self.cluster_seed) if self.cluster_seed is not None else random
 
         # stores leader: [(follower, distance)]
-        clusters = {l: [] for l in leader_indices}
-
-        # assign each follower to its closest leader
-        for f in follower_indices:
-            min_dist = sys.maxsize
-            min_dist_index = -1
-
-            for l in leader_indices:
-                cur_dist = euclidean_distances(X[f], X[l])
-                if cur_dist < min_dist:
-                    min_dist = cur_dist
-                    min_dist_index = l
-
-            clusters[min_dist_index].append((f, min_dist[0][0]))
-
+        with stats.timer("cluster"):
+            self.clusters = leader_follower(X, k, rng, self.cluster_init, self.cluster_iterations, self.cluster_batch_size)
+        self.index_changed()
+
+    # returns the normalized tf-idf doc vectors as a sparse matrix (row=doc, col=term)
+    def doc_vector_matrix(self):
+        return csc_matrix((self.doc_weights, self.index.doc_ids, self.index.offsets),
+                          shape=(self.index.num_docs, len(self.index))).tocsr()
+
+    '''
+    keeps self.clusters in step with an index update
+    old_docs are the DocumentIDs of the index before the update, in doc number order
+
+    followers of removed leaders and new documents join their closest remaining leader
+    '''
+    def update_clusters(self, old_docs):
+        if self.clusters is None:
+            return
+
+        positions = {doc_id: d for d, doc_id in enumerate(self.index.docs)}
+        renumber = [positions.get(doc_id, -1) for doc_id in old_docs]  # old doc number : new doc number
+
+        clusters = {}
+        orphans = set(range(self.index.num_docs)) - set(renumber)  # the added docs
+        for leader, followers in self.clusters.items():
+            kept = [renumber[f] for f, _ in followers if renumber[f] >= 0]
+
+            if renumber[leader] >= 0:
+                clusters[renumber[leader]] = kept
+            else:
+                orphans.update(kept)
+
+        if len(clusters) == 0:
+            self.cluster_docs()
+            return
+
+        # the document vectors are reweighted with the new df, so the kept followers are measured again
+        with stats.timer("cluster"):
+            X = self.doc_vector_matrix()
+            for leader, kept in clusters.items():
+                clusters[leader] = list(zip(kept, follower_distances(X, leader, kept)))
+            assign_followers(X, clusters, sorted(orphans))
         self.clusters = clusters
+        self.index_changed()
 
     # returns a normalized list
     def normalize_list(self, input_list):
@@ -123,8 +472,377 @@ class SearchEngine(WebCrawler):
     def build_frequency_matrix(self):
         super().build_frequency_matrix()
 
-        self.N = len(self.frequency_matrix[0])
-        self.df = [sum(row) for row in self.frequency_matrix]
+        self.N = self.index.num_docs
+        self.df = self.index.term_totals().tolist()
+        self.build_title_index()
+        with stats.timer("doc_vectors"):
+            self.build_doc_vectors()
+
+    '''
+    modify parent method to update the number of docs, doc freqs, doc vectors and clusters
+    the title index and the doc vectors of every document are rebuilt, only the new documents are clustered
+    '''
+    def update_frequency_matrix(self):
+        old_docs = list(self.index.docs)
+        changes = super().update_frequency_matrix()
+
+        # N and the doc freqs change the idf of every term, so every doc vector is recomputed
+        self.N = self.index.num_docs
+        self.df = self.index.term_totals().tolist()
+        self.build_title_index()
+        with stats.timer("doc_vectors"):
+            self.build_doc_vectors()
+        self.update_clusters(old_docs)
+
+        return changes
+
+    '''
+    indexes the lower case words of the document titles, doc numbers are those of self.index
+    populates self.title_index
+    '''
+    def build_title_index(self):
+        postings = {}  # title word : ([doc numbers], [occurrences])
+
+        for d, doc_id in enumerate(self.index.docs):
+            for word, count in Counter(self.doc_titles[doc_id].lower().split()).items():
+                if word not in postings:
+                    postings[word] = ([], [])
+                postings[word][0].append(d)
+                postings[word][1].append(count)
+
+        self.title_index = InvertedIndex.from_postings(self.index.docs, postings)
+
+    # returns the doc numbers whose title has one of the words, read from the title index
+    def title_matches(self, words):
+        matches = [self.title_index.postings(word)[0] for word in words]
+        return np.unique(np.concatenate(matches)).tolist() if matches else []
+
+    # sets how titles are scored: "boost" (.25 per matching title) or "bm25f" with the title weight and BM25 parameters
+    def set_title_scoring(self, mode="boost", title_weight=2.0, k1=1.2, b=0.75):
+        self.title_scoring = mode
+        self.title_weight = float(title_weight)
+        self.bm25_k1 = float(k1)
+        self.bm25_b = float(b)
+        self.index_changed()
+
+    '''
+    returns (body length norms, title length norms) of every document for BM25F, built on first use
+    the norm of a field is (1 - b) + b * length / average length, the body length being the number of indexed words
+    '''
+    def get_field_norms(self):
+        if self.field_norms is None or self.field_norms[0] is not self.index or self.field_norms[1] is not self.title_index:
+            norms = []
+
+            for field in (self.index, self.title_index):
+                lengths = np.bincount(field.doc_ids, weights=field.tfs, minlength=self.index.num_docs)
+                average = lengths.mean() if len(lengths) > 0 and lengths.mean() > 0 else 1
+                norms.append((1 - self.bm25_b) + self.bm25_b * lengths / average)
+
+            self.field_norms = (self.index, self.title_index, norms[0], norms[1])
+
+        return self.field_norms[2], self.field_norms[3]
+
+    '''
+    returns the BM25F score of every document that has a query word in its body or title
+    as (doc numbers, scores, scores with the synonyms), like cosine_scores
+
+    each query word is looked up stemmed in the body and as is in the title, its pseudo term frequency
+    being the length normalized body occurrences plus title_weight times the title occurrences
+    '''
+    def bm25f_scores(self, words, expansion):
+        word_counts = Counter(w for w in words if w not in self.stop_words)
+        synonym_counts = Counter(synonym for synonym, _ in expansion if synonym not in self.stop_words)
+        body_norms, title_norms = self.get_field_norms()
+
+        doc_numbers, products = [], []
+        for word in sorted(set(word_counts).union(synonym_counts)):
+            body_docs, body_tfs = self.index.postings(self.stem(word))
+            title_docs, title_tfs = self.title_index.postings(word)
+
+            candidates, positions = np.unique(np.concatenate([body_docs, title_docs]), return_inverse=True)
+            if len(candidates) == 0:
+                continue
+
+            # pseudo term frequency of every candidate across both fields
+            tf = np.bincount(positions, minlength=len(candidates), weights=np.concatenate(
+                [body_tfs / body_norms[body_docs], self.title_weight * title_tfs / title_norms[title_docs]]))
+            idf = math.log((self.N - len(candidates) + 0.5) / (len(candidates) + 0.5) + 1)
+
+            # weights of the word in the query and in the query with its synonyms
+            q = np.array([word_counts[word], (word_counts[word] + synonym_counts[word])
+                          * (1 if word in word_counts else self.synonym_weight)])
+
+            doc_numbers.append(candidates)
+            products.append((idf * tf / (self.bm25_k1 + tf))[:, None] * q)
+
+        if len(doc_numbers) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0), np.zeros(0)
+
+        return self.add_products(np.concatenate(doc_numbers), np.concatenate(products))
+
+    '''
+    precomputes the normalized tf-idf vector of every document
+    populates self.doc_weights, aligned with the postings of self.index
+    '''
+    def build_doc_vectors(self):
+        if self.index.num_postings == 0:
+            self.doc_weights = np.zeros(0)
+            self.index_changed()
+            return
+
+        # log weighted tf of every distinct frequency and the idf of every term
+        tfs = self.index.tfs
+        log_tf = np.zeros(int(tfs.max()) + 1)
+        for f in np.unique(tfs).tolist():
+            log_tf[f] = 1 + math.log10(f)
+        idf = np.array([math.log10(self.N / df) for df in self.df])
+
+        # tf-idf weight of every posting (postings are grouped by term)
+        weights = log_tf[tfs] * np.repeat(idf, np.diff(self.index.offsets))
+
+        # divide every weight by the norm of its document
+        norms = np.sqrt(np.bincount(self.index.doc_ids, weights=weights ** 2, minlength=self.N))
+        norms[norms == 0] = 1
+        self.doc_weights = weights / norms[self.index.doc_ids]
+        self.index_changed()
+
+    '''
+    returns (sorted term ids, weights) of the terms of a query and of its synonyms
+
+    weights has two columns of normalized tf-idf weights, the query without and with its synonyms.
+    Synonyms count as occurrences of the terms they stem to, and the weight of a term
+    that only a synonym has is scaled by synonym_weight.
+    '''
+    def query_weights(self, query_terms, synonym_terms=()):
+        term_counts = Counter(self.index.term_id(q) for q in query_terms)
+        synonym_counts = Counter(self.index.term_id(q) for q in synonym_terms)
+        term_ids = sorted(set(term_counts).union(synonym_counts))
+
+        q_prime = self.normalize_list([(1 + math.log10(term_counts[t])) * math.log10(self.N / self.df[t])
+                                       if t in term_counts else 0 for t in term_ids])
+        q_expanded = self.normalize_list([(1 + math.log10(term_counts[t] + synonym_counts[t]))
+                                          * math.log10(self.N / self.df[t])
+                                          * (1 if t in term_counts else self.synonym_weight) for t in term_ids])
+
+        return term_ids, np.array([q_prime, q_expanded]).T.reshape(len(term_ids), 2)
+
+    '''
+    returns the cosine similarity of a query with every document that shares a term with it
+    as (doc numbers, scores, scores with the synonyms), documents missing from the result have a score of 0
+
+    only the postings of the query and synonym terms are read, once for both scores
+    '''
+    def cosine_scores(self, query_terms, synonym_terms=()):
+        # normalized tf-idf weights of the query
+        term_ids, q_prime = self.query_weights(query_terms, synonym_terms)
+
+        if len(term_ids) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0), np.zeros(0)
+
+        # (doc number, q weights * doc weight) of every posting of the query terms, in term order
+        slices = [slice(self.index.offsets[t], self.index.offsets[t + 1]) for t in term_ids]
+        doc_numbers = np.concatenate([self.index.term_docs(t) for t in term_ids])
+        products = np.concatenate([self.doc_weights[s][:, None] * q for q, s in zip(q_prime, slices)])
+
+        scores = self.add_products(doc_numbers, products)
+        stats.count("docs_scored", len(scores[0]))
+        stats.count("postings_scored", len(doc_numbers))
+        return scores
+
+    # prunes the documents that can't reach the top k of a query, the top k stay the same
+    def set_top_k_pruning(self, enabled=True):
+        self.top_k_pruning = bool(enabled)
+
+    # returns the largest absolute doc weight of every term, built on first use after build_doc_vectors
+    def get_term_bounds(self):
+        if self.term_bounds is None or self.term_bounds[0] is not self.doc_weights:
+            starts = np.asarray(self.index.offsets[:-1])
+            bounds = np.zeros(len(starts))
+            indexed = np.diff(self.index.offsets) > 0
+
+            if len(self.doc_weights) > 0:
+                bounds[indexed] = np.maximum.reduceat(np.abs(self.doc_weights), starts[indexed])
+            self.term_bounds = (self.doc_weights, bounds)
+
+        return self.term_bounds[1]
+
+    '''
+    returns the k best (doc number, score) of a query like top_hits, but with MaxScore pruning
+
+    q are the weights of the terms in term_ids and title_boosts the [(doc numbers, boost)] of the titles.
+    A query term and a doc weight always have the same sign, so every term adds at most its q weight
+    times its largest doc weight to a score and nothing takes away from it. The postings are read
+    from the term with the largest bound down; once the kth best score so far is above the bound of
+    the remaining terms, no other document can make the top k. From then on only the documents still
+    able to reach the kth score are looked up in the remaining postings, with the skip pointers of
+    a compressed index. The documents left are scored in full in the order cosine_scores adds
+    the terms up, so the scores and the ranking are those of exhaustive scoring.
+    '''
+    def max_score_top_k(self, term_ids, q, title_boosts, k):
+        bounds = self.get_term_bounds()
+
+        # (bound, term row or None for a title, weight, title doc numbers) of every list that can add to a score
+        lists = [(abs(weight) * bounds[t], t, weight, None) for t, weight in zip(term_ids, q.tolist()) if weight != 0]
+        lists += [(boost, None, boost, np.array(matches, dtype=np.int64))
+                  for matches, boost in title_boosts if len(matches) > 0 and boost > 0]
+        lists.sort(key=lambda l: -l[0])
+        remaining = np.cumsum([l[0] for l in lists][::-1])[::-1].tolist() + [0.0]  # bound of the lists from i on
+
+        candidates, partial = np.zeros(0, dtype=np.int64), np.zeros(0)
+        postings_scored = 0
+        for i, (_, t, weight, title_docs) in enumerate(lists):
+            threshold = np.partition(partial, len(partial) - k)[len(partial) - k] if 0 < k <= len(partial) else 0.0
+
+            if threshold > 0 and remaining[i] < threshold - SCORE_TOLERANCE:
+                # no new document can reach the top k, only the candidates that still can are looked up
+                keep = partial + remaining[i] >= threshold - SCORE_TOLERANCE
+                candidates, partial = candidates[keep], partial[keep]
+
+                if t is None:
+                    partial[search_sorted(candidates, title_docs)[0]] += weight
+                else:
+                    found, positions = self.index.find_postings(t, candidates)
+                    partial[found] += weight * self.doc_weights[positions]
+                    postings_scored += len(positions)
+            else:
+                if t is None:
+                    docs, values = title_docs, np.full(len(title_docs), weight)
+                else:
+                    docs = self.index.term_docs(t)
+                    values = weight * self.doc_weights[self.index.offsets[t]:self.index.offsets[t + 1]]
+                    postings_scored += len(docs)
+
+                candidates, positions = np.unique(np.concatenate([candidates, docs]), return_inverse=True)
+                partial = np.bincount(positions, weights=np.concatenate([partial, values]), minlength=len(candidates))
+
+        stats.count("docs_scored", len(candidates))
+        stats.count("postings_scored", postings_scored)
+
+        # the scores of the candidates left, added up in the order of exhaustive scoring
+        scores = np.zeros(len(candidates))
+        for t, weight in zip(term_ids, q.tolist()):
+            if weight != 0:
+                found, positions = self.index.find_postings(t, candidates)
+                scores[found] += self.doc_weights[positions] * weight
+        for matches, boost in title_boosts:
+            found = search_sorted(candidates, np.array(matches, dtype=np.int64))[0]
+            scores[found] = boost + scores[found]
+
+        # best scores first, ties in document order
+        top = [i for i in np.lexsort((candidates, -scores)).tolist() if scores[i] > 0][:k]
+        return [(d, score) for d, score in zip(candidates[top].tolist(), scores[top].tolist())]
+
+    '''
+    returns the k best (doc number, score) of the documents, after adding the [(doc numbers, boost)] of the titles
+    doc_numbers are sorted first if a scorer returns them in another order, only the k selected are
+    sorted by score, ties in document order like a full sort
+    '''
+    def top_hits(self, doc_numbers, scores, title_boosts, k):
+        if np.any(doc_numbers[1:] < doc_numbers[:-1]):
+            order = np.argsort(doc_numbers, kind="stable")
+            doc_numbers, scores = doc_numbers[order], scores[order]
+
+        title_boosts = [(np.asarray(matches, dtype=np.int64), boost) for matches, boost in title_boosts if len(matches) > 0]
+        if title_boosts:
+            # title matches without a score are appended after doc_numbers, the full list isn't re-sorted
+            extra = np.unique(np.concatenate([matches[~search_sorted(matches, doc_numbers)[0]] for matches, _ in title_boosts]))
+            scores = np.concatenate([scores, np.zeros(len(extra))])
+            for matches, boost in title_boosts:
+                found, positions = search_sorted(matches, doc_numbers)
+                positions = np.concatenate([positions, len(doc_numbers) + np.searchsorted(extra, matches[~found])])
+                scores[positions] += boost
+            doc_numbers = np.concatenate([doc_numbers, extra])
+
+        # only keep results if score > 0
+        positive = scores > 0
+        doc_numbers, scores = doc_numbers[positive], scores[positive]
+        if k <= 0 or len(scores) == 0:
+            return []
+
+        # the scores above the kth best, then the documents tied with it in document order
+        top = np.arange(len(scores))
+        if len(scores) > k:
+            kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+            above = np.flatnonzero(scores > kth)
+            tied = np.flatnonzero(scores == kth)
+            tied = tied[np.argsort(doc_numbers[tied], kind="stable")]
+            top = np.concatenate([above, tied[:k - len(above)]])
+
+        top = top[np.lexsort((doc_numbers[top], -scores[top]))]
+        return list(zip(doc_numbers[top].tolist(), scores[top].tolist()))
+
+    # adds up the (n x 2) products of each document, returns (doc numbers, scores, scores with the synonyms)
+    def add_products(self, doc_numbers, products):
+        candidates, positions = np.unique(doc_numbers, return_inverse=True)
+        return candidates, np.bincount(positions, weights=products[:, 0], minlength=len(candidates)), \
+            np.bincount(positions, weights=products[:, 1], minlength=len(candidates))
+
+    '''
+    returns the cosine similarity of a query with the documents of the probes clusters whose
+    leaders are the most similar to the query (with its synonyms), as (doc numbers, scores, scores with the synonyms)
+
+    only the postings of the query terms within the probed clusters are read
+    '''
+    def pruned_cosine_scores(self, query_terms, probes, synonym_terms=()):
+        term_ids, q_prime = self.query_weights(query_terms, synonym_terms)
+
+        if len(term_ids) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0), np.zeros(0)
+
+        leader_vectors, members, starts, member_vectors = self.get_cluster_vectors()
+
+        # probe the clusters of the leaders closest to the query, ties go to the first leader
+        leader_scores = np.zeros(leader_vectors.shape[0])
+        for t, q in zip(term_ids, q_prime[:, 1]):
+            column = slice(leader_vectors.indptr[t], leader_vectors.indptr[t + 1])
+            leader_scores[leader_vectors.indices[column]] += q * leader_vectors.data[column]
+        probed = np.argsort(-leader_scores, kind="stable")[:probes].tolist()
+
+        # (row, q weights * doc weight) of the postings of the query terms inside the probed clusters
+        rows, products = [], []
+        for t, q in zip(term_ids, q_prime):
+            column = slice(member_vectors.indptr[t], member_vectors.indptr[t + 1])
+            column_rows = member_vectors.indices[column]
+            column_weights = member_vectors.data[column]
+            bounds = np.searchsorted(column_rows, starts)
+
+            for c in probed:
+                rows.append(column_rows[bounds[c]:bounds[c + 1]])
+                products.append(column_weights[bounds[c]:bounds[c + 1], None] * q)
+
+        # members are in cluster order, the doc numbers are returned sorted like those of the other scorers
+        candidates, scores, expanded_scores = self.add_products(np.concatenate(rows), np.concatenate(products))
+        doc_numbers = members[candidates]
+        order = np.argsort(doc_numbers, kind="stable")
+        return doc_numbers[order], scores[order], expanded_scores[order]
+
+    '''
+    returns (leader vectors, members, starts, member vectors), built on first use after clustering
+
+    members are the doc numbers of every cluster in the order of self.clusters, cluster c being
+    members[starts[c]:starts[c + 1]], and row i of the member vectors is the doc vector of
+    members[i]. The vectors are CSC matrices, so the postings of a term in a cluster are contiguous.
+    '''
+    def get_cluster_vectors(self):
+        if self.cluster_vectors is None or self.cluster_vectors[0] is not self.clusters \
+                or self.cluster_vectors[1] is not self.doc_weights:
+            X = self.doc_vector_matrix()
+            clusters = [sorted([leader] + [f for f, _ in followers]) for leader, followers in self.clusters.items()]
+
+            members = np.array([d for cluster in clusters for d in cluster], dtype=np.int64)
+            starts = np.zeros(len(clusters) + 1, dtype=np.int64)
+            starts[1:] = np.cumsum([len(cluster) for cluster in clusters])
+            member_vectors = X[members].tocsc()
+            member_vectors.sort_indices()
+
+            self.cluster_vectors = (self.clusters, self.doc_weights,
+                                    X[list(self.clusters)].tocsc(), members, starts, member_vectors)
+
+        return self.cluster_vectors[2:]
+
+    # scores only the documents of the probes clusters closest to each query, None scores every document
+    def set_cluster_probes(self, probes):
+        self.cluster_probes = int(probes) if probes else None
 
     # returns log weighted tf-idf weight of a document or query (log tf times idf)
     def tf_idf(self, doc):
@@ -158,68 +876,143 @@ class SearchEngine(WebCrawler):
     
     Arguments: k is the number of results to return
                query_expanded is a boolean used to stop the recursive call for query expansion 
+
+    results are cached by the words of the query, which also decide the title boosts and
+    thesaurus expansion, in any order. The cache keeps them as tuples and every call returns
+    new lists, so a caller changing its results doesn't change the cached ones
     """
     def process_query(self, user_query, k=6, query_expanded=False):
-        # list of scores for each query vs docs
-        scores = {doc_id: 0 for doc_id in self.doc_titles.keys()}  # DocID : score
-
-        # set score equal to .25 if any of the query terms appear in the titles
-        for t in self.doc_titles.keys():
-            cur_title = self.doc_titles[t].lower()
-            if len(set(user_query.split()).intersection(cur_title.split())) > 0:
-                scores[t] = 0.25
-
-        # split query into list
-        query = user_query
-        query = query.split()
-
-        # remove stop words
-        query = [q for q in query if q not in self.stop_words]
-
-        # stem terms in query
-        stemmer = PorterStemmer()
-        query = [stemmer.stem(q) for q in query]
-
-        # filter out terms that aren't in any of the documents
-        query = [q for q in query if q in self.all_terms]
-
-        # convert query to list of term frequencies
-        query = [query.count(term) for term in self.all_terms]
-
-        # transpose tf matrix to get list of docs
-        docs = [list(x) for x in zip(*self.frequency_matrix)]
-
-        # execute cosine similarity for each document, add to the score
-        for i, (doc_id, score) in enumerate(scores.items()):
-            scores[doc_id] += self.cosine_similarity(query, docs[i])
-
-        # sort by scores in descending order
-        sorted_scores = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-
-        # populate 2D list sorted results: [[score, title, URL, first 20 words]], but only keep results if score > 0
-        results = [['%06.4f' % score, self.doc_titles[doc_id], self.doc_urls[doc_id].replace(self.domain_url, ''),
-                    " ".join(self.doc_words[doc_id][:20])] for doc_id, score in sorted_scores if score > 0]
+        with stats.timer("query"):
+            key = (tuple(sorted(user_query.split())), k, query_expanded, self.cluster_probes)
+            results = self.query_cache.get(key, self.index_version)
+
+            if results is None:
+                with stats.timer("score"):
+                    results = tuple(map(tuple, self.evaluate_query(user_query, k, query_expanded)))
+                self.query_cache.put(key, self.index_version, results)
+
+        stats.count("queries")
+        return [list(result) for result in results]
+
+    # scores a query against the index, see process_query
+    def evaluate_query(self, user_query, k=6, query_expanded=False):
+        words = user_query.split()
+
+        # synonyms of the query words, only used when the query alone finds less than k/2 results
+        expansion = [] if query_expanded else self.expand_query(words)
+        query_words = set(words)
+        expanded_words = query_words.union(synonym for synonym, _ in expansion)
+
+        # doc numbers whose title shares a word with the query, and those sharing only a synonym
+        if self.title_scoring == "bm25f":
+            title_matches, synonym_title_matches = [], []  # titles are scored as a field
+        else:
+            title_matches = self.title_matches(query_words)
+            synonym_title_matches = sorted(set(self.title_matches(expanded_words - query_words)) - set(title_matches))
+
+        # remove stop words, stem terms in query and filter out terms that aren't in any of the documents
+        query = [self.stem(q) for q in words if q not in self.stop_words]
+        query = [q for q in query if self.index.term_id(q) is not None]
+        synonym_terms = [stem for synonym, stem in expansion
+                         if synonym not in self.stop_words and self.index.term_id(stem) is not None]
+
+        # add .25 if any of the query terms appear in the titles
+        title_boosts = [(title_matches, 0.25)]
+
+        # cosine similarity of the documents in the postings of the query terms, or only of the documents
+        # in the clusters closest to the query, or only of those that can make the top k
+        max_score = self.top_k_pruning and self.title_scoring != "bm25f" and not (self.cluster_probes and self.clusters)
+        if max_score:
+            term_ids, q_weights = self.query_weights(query, synonym_terms)
+            top_hits = self.max_score_top_k(term_ids, q_weights[:, 0], title_boosts, k)
+        else:
+            if self.title_scoring == "bm25f":
+                doc_numbers, similarities, expanded_similarities = self.bm25f_scores(words, expansion)
+            elif self.cluster_probes and self.clusters:
+                doc_numbers, similarities, expanded_similarities = \
+                    self.pruned_cosine_scores(query, self.cluster_probes, synonym_terms)
+            else:
+                doc_numbers, similarities, expanded_similarities = self.cosine_scores(query, synonym_terms)
+            top_hits = self.top_hits(doc_numbers, similarities, title_boosts, k)
 
         # Handle K, < K, and K/2 results
-        # if less results than threshold, do thesaurus expansion
-        if len(results) < k/2 and query_expanded is False:
-            print("Less than K/2 results. Performing thesaurus expansion...")
-
-            # split original query into list
-            query = user_query.split()
-
-            # expand query using the thesaurus
-            for term in query:
-                # add synonyms to the end of the query
-                if term in self.thesaurus:
-                    query += [syn for syn in self.thesaurus[term] if syn not in query]
+        # if less results than threshold, use the scores of the query expanded with the thesaurus
+        # (there are less than k/2 results with a score > 0 exactly when the top k has less than k/2)
+        if len(top_hits) < k/2 and query_expanded is False:
+            if self.print_expansions:
+                print("Less than K/2 results. Performing thesaurus expansion...")
+            stats.count("query_expansions")
+
+            title_boosts.append((synonym_title_matches, 0.25 * self.synonym_weight))
+            if max_score:
+                top_hits = self.max_score_top_k(term_ids, q_weights[:, 1], title_boosts, k)
+            else:
+                top_hits = self.top_hits(doc_numbers, expanded_similarities, title_boosts, k)
 
-            # recursively call process_query with the new query
-            return self.process_query(" ".join(query), k, True)
+        # populate 2D list sorted results: [[score, title, URL, first 20 words]]
+        results = []
+        for d, score in top_hits:
+            title, url, snippet = self.doc_fields(d)
+            results.append(['%06.4f' % score, title, url.replace(self.domain_url, ''), snippet])
 
         # return the first k results
         return results[:k]
 
+    # returns the query settings copied to the engines of batch search workers and query servers
+    def query_settings(self):
+        return {name: getattr(self, name) for name in QUERY_SETTINGS}
+
+    # returns results of process_query as a list of dicts, for JSON output
+    @staticmethod
+    def result_records(results):
+        return [{"rank": i + 1, "score": float(score), "title": title, "url": url, "snippet": snippet}
+                for i, (score, title, url, snippet) in enumerate(results)]
+
+    # returns (results of process_query, seconds it took)
+    def timed_query(self, user_query, k=6):
+        start = time.perf_counter()
+        results = self.process_query(user_query, k)
+        return results, time.perf_counter() - start
+
+    '''
+    answers a sequence of queries and writes one JSON line per query to output, in query order
+    returns {"queries", "seconds", "qps", "p50_ms", "p90_ms", "p99_ms"}
+
+    with several workers the queries are answered by a thread pool, or with processes by a pool
+    of processes that each map index_filename (an index file written by save_index)
+    '''
+    def batch_search(self, queries, output, k=6, workers=1, processes=False, index_filename=None):
+        queries = [q.strip() for q in queries if len(q.strip()) > 0]
+        latencies = []
+        start = time.perf_counter()
+
+        # process_query prints when it expands a query, which would end up in the results
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            if workers > 1 and processes:
+                executor = ProcessPoolExecutor(workers, initializer=init_search_worker,
+                                               initargs=(index_filename, self.query_settings()))
+                answers = executor.map(search_worker, queries, repeat(k), chunksize=max(1, len(queries) // (workers * 16)))
+            elif workers > 1:
+                executor = ThreadPoolExecutor(workers)
+                answers = executor.map(self.timed_query, queries, repeat(k))
+            else:
+                executor = None
+                answers = map(self.timed_query, queries, repeat(k))
+
+            try:
+                for query, (results, seconds) in zip(queries, answers):
+                    latencies.append(seconds)
+                    output.write(json.dumps({"query": query, "latency_ms": round(seconds * 1000, 3),
+                                             "results": self.result_records(results)}) + "\n")
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+
+        seconds = time.perf_counter() - start
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000 if latencies else (0, 0, 0)
+        return {"queries": len(queries), "seconds": seconds, "qps": len(queries) / seconds if seconds > 0 else 0,
+                "p50_ms": float(p50), "p90_ms": float(p90), "p99_ms": float(p99)}
+
     def display_clusters(self):
         if self.clusters is not None:
             for leader, followers in self.clusters.items():
@@ -264,7 +1057,13 @@ class SearchEngine(WebCrawler):
             if int(main_menu_input) == 1:
                 # check to make sure index hasn't been built
                 if self.clusters is not None:
-                    print("Index has already been built. \nYou'll need to restart the program to build a new one.")
+                    refresh_input = "-1"
+                    while refresh_input != "y" and refresh_input != "n":
+                        refresh_input = input("Index has already been built. "
+                                              "Would you like to refresh it with an incremental re-crawl? (y/n) ").lower()
+
+                    if refresh_input == "y":
+                        self.refresh_index()
 
                 else:  # prompt user to import from file
                     import_input = "-1"
@@ -356,7 +1155,7 @@ class SearchEngine(WebCrawler):
 
             # user wants to enter search query
             elif int(main_menu_input) == 2:
-                if len(self.visited_urls) == 0:
+                if self.index.num_docs == 0:
                     print("You must build the index first.")
                 else:
                     while True:
@@ -404,19 +1203,119 @@ if __name__ == "__main__":
                         help="Stop words file: a newline separated list of stop words. (Default is Input/stopwords.txt)", required=False, default="Input/stopwords.txt")
     parser.add_argument("-t", "--thesaurus",
                         help="Thesaurus file: a comma separated list of words and their synonyms. (Default is Input/thesaurus.csv)", required=False, default="Input/thesaurus.csv")
+    parser.add_argument("-w", "--workers", help="Number of pages fetched concurrently. (Default is 1, a serial crawl)", required=False, default="1")
+    parser.add_argument("--perhost", help="Maximum number of concurrent requests to one host.", required=False, default=None)
+    parser.add_argument("--delay", help="Politeness delay in seconds between requests to one host. (Default is 0)", required=False, default="0")
+    parser.add_argument("--timeout", help="Seconds a fetch waits for a host before it's retried. (Default is 10)", required=False, default="10")
+    parser.add_argument("--retries", help="Number of times a fetch that fails or times out is retried, with exponential backoff. (Default is 2)", required=False, default="2")
+    parser.add_argument("--maxbody", help="Megabytes of a page kept, longer pages are cut. (Default is 10)", required=False, default="10")
+    parser.add_argument("--processes", help="Number of worker processes parsing pages and counting terms. (Default is 1)", required=False, default="1")
+    parser.add_argument("--neardup", help="Index pages whose SimHash differs from a stored page in at most this many bits as that page. (Default is 3, -1 only for exact duplicates)", required=False, default="3")
+    parser.add_argument("--stemcrawl", help="Stem words while crawling instead of when building the index.", action="store_true")
+    parser.add_argument("--spimi", help="Index pages out of core, writing postings runs to this directory and keeping snippets instead of their words.", required=False, default=None)
+    parser.add_argument("--memorybudget", help="Megabytes of postings kept in memory by --spimi before a run is written. (Default is 256)", required=False, default="256")
+    parser.add_argument("--compress", help="Keep the postings delta and variable byte encoded, in memory and in the exported index.", action="store_true")
+    parser.add_argument("-c", "--checkpoint", help="Log the crawl to this checkpoint file so it can be resumed.", required=False, default=None)
+    parser.add_argument("--resume", help="Resume the crawl logged in the checkpoint file. (Default file is Output/crawl_checkpoint.db)", action="store_true")
+    parser.add_argument("--clusterseed", help="Seed of the cluster leaders. (Default is unseeded)", required=False, default=None)
+    parser.add_argument("--clusterinit", help="How cluster leaders are picked. (Default is random)", choices=["random", "kmeans++"], default="random")
+    parser.add_argument("--clusteriterations", help="Mini-batch k-means iterations moving the cluster leaders. (Default is 0)", required=False, default="0")
+    parser.add_argument("--probes", help="Score only the documents of the N clusters closest to a query. (Default scores every document)", required=False, default=None)
+    parser.add_argument("--cachesize", help="Number of query results cached. (Default is 1024, 0 disables the cache)", required=False, default="1024")
+    parser.add_argument("--cachettl", help="Seconds a cached query result is kept. (Default is until the index changes)", required=False, default=None)
+    parser.add_argument("--synonymweight", help="Weight of the terms added by thesaurus expansion. (Default is 0.5, 1 weighs them like query terms)", required=False, default="0.5")
+    parser.add_argument("--maxscore", help="Score only the documents that can make the top k of a query (MaxScore). The results don't change.", action="store_true")
+    parser.add_argument("--titlescoring", help="How titles are scored. (Default is boost: .25 for a title sharing a query word)", choices=["boost", "bm25f"], default="boost")
+    parser.add_argument("-b", "--batch", help="Answer the queries of this file (one per line, - for stdin) as JSON lines and exit.", required=False, default=None)
+    parser.add_argument("-o", "--output", help="File the batch results are written to. (Default is stdout)", required=False, default="-")
+    parser.add_argument("-i", "--index", help="Index file used by batch queries, the query server and --refresh. (Default is Output/exported_index.obj)", required=False, default="Output/exported_index.obj")
+    parser.add_argument("-k", help="Number of results per batch query. (Default is 6)", required=False, default="6")
+    parser.add_argument("--batchworkers", help="Number of batch queries answered concurrently. (Default is 1)", required=False, default="1")
+    parser.add_argument("--batchprocesses", help="Answer batch queries on worker processes instead of threads.", action="store_true")
+    parser.add_argument("--serve", help="Answer queries over HTTP on this port with the index file (see -i) and exit on Ctrl-C.", required=False, default=None)
+    parser.add_argument("--host", help="Address the query server listens on. (Default is 127.0.0.1)", required=False, default="127.0.0.1")
+    parser.add_argument("--watch", help="Seconds between checks for a new index file to serve. (Default is no checks, POST /reload instead)", required=False, default=None)
+    parser.add_argument("--stats", help="Time the crawl, index build and queries stage by stage and print a report at exit.", action="store_true")
+    parser.add_argument("--statsfile", help="Also write the stats to this file: JSON if it ends in .json, Prometheus text otherwise.", required=False, default=None)
+    parser.add_argument("-r", "--refresh", help="Re-crawl the index file given by -i incrementally, export it and exit.", action="store_true")
 
     argument = parser.parse_args()
 
+    if argument.stats or argument.statsfile:
+        stats.enable()
+        atexit.register(stats.report, argument.statsfile)
+
     # set attributes based off arguments
     if int(argument.pagelimit) > 1:
         search_engine.set_page_limit(argument.pagelimit)
+        search_engine.set_concurrency(argument.workers, argument.perhost, argument.delay)
+        search_engine.set_fetch_options(argument.timeout, argument.retries, argument.maxbody)
+        search_engine.set_stem_at_crawl(argument.stemcrawl)
+        search_engine.set_near_duplicates(int(argument.neardup) if int(argument.neardup) >= 0 else None)
+        search_engine.set_processes(argument.processes)
+        search_engine.set_clustering(argument.clusterseed, argument.clusterinit, argument.clusteriterations)
+        search_engine.set_cluster_probes(argument.probes)
+        search_engine.set_top_k_pruning(argument.maxscore)
+        search_engine.set_query_cache(argument.cachesize, argument.cachettl)
+        search_engine.set_synonym_weight(argument.synonymweight)
+        search_engine.set_title_scoring(argument.titlescoring)
+        search_engine.set_compression(argument.compress)
+
+        if argument.spimi:
+            search_engine.set_spimi(argument.spimi, argument.memorybudget)
+
+        if argument.checkpoint or argument.resume:
+            search_engine.set_checkpoint(argument.checkpoint or "Output/crawl_checkpoint.db", argument.resume)
 
         if argument.stopwords:
             search_engine.set_stop_words(argument.stopwords)
         if argument.thesaurus:
             search_engine.set_thesaurus(argument.thesaurus)
 
+        # answer a file of queries without the menu
+        if argument.batch:
+            with redirect_stdout(sys.stderr):
+                loaded = search_engine.load_index(argument.index)
+            if loaded == 0:
+                sys.exit(1)
+
+            query_file = sys.stdin if argument.batch == "-" else open(argument.batch)
+            output_file = sys.stdout if argument.output == "-" else open(argument.output, "w")
+
+            summary = search_engine.batch_search(query_file, output_file, int(argument.k), int(argument.batchworkers),
+                                                 argument.batchprocesses, argument.index)
+            output_file.flush()
+
+            print("{queries} queries in {seconds:.3f} s: {qps:.1f} queries/sec, p50 {p50_ms:.3f} ms, "
+                  "p90 {p90_ms:.3f} ms, p99 {p99_ms:.3f} ms".format(**summary),
+                  file=sys.stderr if argument.output == "-" else sys.stdout)
+
+        # serve queries over HTTP without the menu
+        elif argument.serve:
+            settings = search_engine.query_settings()
+            try:
+                query_server = QueryServer(lambda filename: load_search_engine(filename, settings, argument.cachesize, argument.cachettl),
+                                           argument.index, argument.host, argument.serve,
+                                           float(argument.watch) if argument.watch else None)
+            except (OSError, ValueError) as e:
+                print("Error starting query server: " + str(e))
+                sys.exit(1)
+
+            print("Serving " + argument.index + " at " + query_server.url() + "/search?q=&k=")
+            try:
+                query_server.serve_forever()
+            except KeyboardInterrupt:
+                query_server.shutdown()
+
+        # refresh the index file without the menu, a file that can't be loaded or refreshed is left as it is
+        elif argument.refresh:
+            if search_engine.load_index(argument.index) == 0 or not search_engine.refresh_index():
+                sys.exit(1)
+            search_engine.save_index(argument.index)
+            print("Exported to " + argument.index + ".")
+
         # show main menu to user
-        search_engine.display_menu()
+        else:
+            search_engine.display_menu()
     else:
         print("Sorry. You must crawl a minimum of 2 pages. Otherwise, why would you need a search engine?")
@@ -0,0 +1,140 @@
+from InvertedIndex import InvertedIndex
+from IndexFile import IndexFile, write_index_file
+from itertools import groupby, repeat, count
+from operator import itemgetter
+import tempfile
+import heapq
+import os
+import numpy as np
+
+
+'''
+Single-pass in-memory indexing (SPIMI) of corpora larger than memory
+
+documents are added one at a time with their term counts and their postings are collected
+in an in-memory block. When the block is estimated to take memory_budget bytes it's written
+to disk as a run: an index file of the block sorted by term. finish() merges the runs k ways,
+term by term, into flat postings files that the index it returns memory maps.
+'''
+POSTING_BYTES = 80  # estimated bytes of a posting in a block: two list slots and two ints
+TERM_BYTES = 200  # estimated bytes of a new term in a block: its string, dict entry and lists
+
+
+class SpimiIndexer:
+    '''
+    Builds an InvertedIndex from documents added in doc number order within memory_budget bytes
+
+    the runs and the merged postings are written to directory, a temporary directory by default
+    '''
+    def __init__(self, directory=None, memory_budget=256 * 2 ** 20):
+        self.directory = directory
+        self.memory_budget = int(memory_budget)
+        self.docs = []  # doc number : DocumentID, of the documents added since the last finish
+        self.block = {}  # term : ([doc numbers], [term frequencies]) of the block in memory
+        self.block_bytes = 0  # estimated size of the block
+        self.runs = []  # file names of the runs written since the last finish
+        self.generation = 0  # number of finished indexes, names their postings files
+
+    def __len__(self):
+        return len(self.docs)
+
+    # returns the directory of the runs, creating it on first use
+    def get_directory(self):
+        if self.directory is None:
+            self.directory = tempfile.mkdtemp(prefix="spimi")
+        os.makedirs(self.directory, exist_ok=True)
+        return self.directory
+
+    # adds the {term: frequency} counts of the next document, writing the block to disk when it's full
+    def add(self, doc_id, term_counts):
+        doc = len(self.docs)
+        self.docs.append(doc_id)
+
+        for term, frequency in term_counts.items():
+            postings = self.block.get(term)
+            if postings is None:
+                postings = self.block[term] = ([], [])
+                self.block_bytes += TERM_BYTES + len(term)
+            postings[0].append(doc)
+            postings[1].append(frequency)
+
+        self.block_bytes += POSTING_BYTES * len(term_counts)
+        if self.block_bytes >= self.memory_budget:
+            self.flush()
+
+    # writes the block in memory to disk as a run sorted by term
+    def flush(self):
+        if len(self.block) == 0:
+            return
+
+        run = InvertedIndex.from_postings([], self.block)
+        filename = os.path.join(self.get_directory(), "run" + str(self.generation) + "_" + str(len(self.runs)) + ".idx")
+        write_index_file(filename, {}, {"offsets": run.offsets, "doc_ids": run.doc_ids, "tfs": run.tfs},
+                         {"terms": run.terms})
+
+        self.runs.append(filename)
+        self.block = {}
+        self.block_bytes = 0
+
+    '''
+    returns the index of the documents added since the last finish and starts over, a second
+    finish without new documents returns an empty index
+
+    the runs are merged into flat postings files, then unmapped and deleted
+    '''
+    def finish(self):
+        self.flush()
+        prefix = os.path.join(self.get_directory(), "postings" + str(self.generation))
+
+        runs = [IndexFile(filename) for filename in self.runs]
+        try:
+            terms, offsets = self.merge_runs(runs, prefix)
+        finally:
+            for run in runs:
+                run.close()
+        for filename in self.runs:
+            os.remove(filename)
+
+        # the merged postings stay on disk, mapped instead of read
+        if offsets[-1] > 0:
+            doc_ids = np.memmap(prefix + ".doc_ids", dtype=np.int32, mode="r")
+            tfs = np.memmap(prefix + ".tfs", dtype=np.int32, mode="r")
+        else:
+            doc_ids, tfs = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+
+        index = InvertedIndex(self.docs, terms, np.array(offsets, dtype=np.int64), doc_ids, tfs)
+
+        self.docs = []
+        self.runs = []
+        self.generation += 1
+
+        return index
+
+    '''
+    writes the postings of runs merged by term to prefix.doc_ids and prefix.tfs, returns (terms, offsets)
+
+    the runs are merged with a heap of their next terms: the postings of a term are the
+    postings of the runs that have it, in run order, so they stay sorted by doc number.
+    Nothing read from the runs is kept, so they can be closed once this returns
+    '''
+    @staticmethod
+    def merge_runs(runs, prefix):
+        run_arrays = [(run.array("offsets"), run.array("doc_ids"), run.array("tfs")) for run in runs]
+        run_terms = [zip(run.strings("terms"), repeat(r), count()) for r, run in enumerate(runs)]  # (term, run, row)
+
+        terms = []
+        offsets = [0]
+        with open(prefix + ".doc_ids", "wb") as doc_ids_file, open(prefix + ".tfs", "wb") as tfs_file:
+            for term, group in groupby(heapq.merge(*run_terms), key=itemgetter(0)):
+                num_postings = 0
+                for _, r, t in group:
+                    run_offsets, doc_ids, tfs = run_arrays[r]
+                    start, end = int(run_offsets[t]), int(run_offsets[t + 1])
+                    doc_ids_file.write(doc_ids[start:end].tobytes())
+                    tfs_file.write(tfs[start:end].tobytes())
+                    num_postings += end - start
+
+                terms.append(term)
+                offsets.append(offsets[-1] + num_postings)
+
+        return terms, offsets
@@ -0,0 +1,60 @@
+import re
+import string
+
+
+# the characters removed from words (the backslash of string.punctuation escapes "]", so backslashes are kept)
+PUNCTUATION = re.compile('[' + string.punctuation + ']')
+
+'''
+A word is a string of non-space characters, beginning with an alphabetic character.
+It may contain special characters, but the last character of a word is either alphabetic or numeric.
+'''
+VALID_WORD = re.compile(r'^[a-zA-z](\S*)[a-zA-z0-9]$')
+
+
+# returns the text of a page, decoded once with the charset of the response (utf-8 by default)
+def decode_page(content, charset=None):
+    try:
+        return content.decode(charset or "utf-8", errors="replace")
+    except LookupError:
+        return content.decode("utf-8", errors="replace")
+
+
+'''
+yields the lower case, punctuation free words of a sequence of text chunks
+
+the chunks are treated as if they were joined into one string, so a word that
+spans two chunks (e.g. "foo<b>bar</b>") is yielded once, without building the string
+'''
+def split_words(chunks):
+    partial = ""  # the end of the previous chunk, which may continue in the next one
+
+    for chunk in chunks:
+        chunk = PUNCTUATION.sub("", chunk.lower())
+        if not chunk:
+            continue
+
+        words = chunk.split()
+
+        # a chunk starting with a word continues the partial word of the previous chunk
+        if chunk[0].isspace():
+            if partial:
+                yield partial
+        else:
+            words[0] = partial + words[0]
+        partial = ""
+
+        if words and not chunk[-1].isspace():
+            partial = words.pop()
+
+        yield from words
+
+    if partial:
+        yield partial
+
+
+# yields the words of a sequence of text chunks that are valid and not in stop_words
+def tokenize(chunks, stop_words):
+    for word in split_words(chunks):
+        if word not in stop_words and VALID_WORD.match(word):
+            yield word
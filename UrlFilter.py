@@ -0,0 +1,232 @@
+import urllib.parse
+import urllib.error
+import re
+from Fetcher import fetch_url
+
+
+'''
+A url is valid if it has an http(s) or ftp(s) scheme, a domain name, localhost or an
+ip address, an optional port and a path without spaces
+source: https://stackoverflow.com/a/7160778/8853372
+'''
+VALID_URL = re.compile(
+    r'^(?:http|ftp)s?://'  # http:// or https://
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  # domain...
+    r'localhost|'  # localhost...
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
+    r'(?::\d+)?'  # optional port
+    r'(?:/?|[/?]\S+)$',
+    re.IGNORECASE)
+
+# the product token robots.txt groups are matched against, urllib sends "Python-urllib/<version>"
+ROBOTS_AGENT = "python-urllib"
+
+DEFAULT_PORTS = {"http": ":80", "https": ":443", "ftp": ":21"}
+
+RULE = None  # key of the rule ending at a node of a RobotsRules trie, the other keys are characters
+
+
+'''
+returns the canonical form of a valid url: lower case scheme and host, no default port,
+no fragment, "/" for an empty path and the dot segments of the path resolved
+two urls of the same page (page.html and page.html#top) get the same canonical url
+'''
+def canonicalize_url(url):
+    scheme, separator, rest = url.partition("://")
+    if not separator:
+        return url
+
+    rest = rest.split("#", 1)[0]
+    path_start = min((i for i in (rest.find("/"), rest.find("?")) if i >= 0), default=len(rest))
+    netloc, path = rest[:path_start], rest[path_start:]
+
+    scheme = scheme.lower()
+    if "@" not in netloc:
+        netloc = netloc.lower()
+    if netloc.endswith(DEFAULT_PORTS.get(scheme, "\0")):
+        netloc = netloc[:-len(DEFAULT_PORTS[scheme])]
+
+    if not path.startswith("/"):
+        path = "/" + path
+    elif "/." in path:
+        path, question, query = path.partition("?")
+        path = remove_dot_segments(path) + question + query
+
+    return scheme + "://" + netloc + path
+
+
+# returns an absolute path with its "." and ".." segments resolved, as in RFC 3986 section 5.2.4
+def remove_dot_segments(path):
+    segments = []
+    parts = path.split("/")[1:]
+
+    for i, segment in enumerate(parts):
+        last = i == len(parts) - 1
+        if segment == "..":
+            if segments:
+                segments.pop()
+            if last:
+                segments.append("")
+        elif segment == ".":
+            if last:
+                segments.append("")
+        else:
+            segments.append(segment)
+
+    return "/" + "/".join(segments)
+
+
+# returns a regex matching the paths an Allow or Disallow rule with * or $ applies to
+def compile_rule(path):
+    anchored = path.endswith("$")
+    if anchored:
+        path = path[:-1]
+
+    return re.compile(".*".join(re.escape(part) for part in path.split("*")) + ("$" if anchored else ""), re.DOTALL)
+
+
+class RobotsRules:
+    '''
+    The Allow and Disallow rules of a robots.txt group, matched against url paths
+
+    the longest rule matching a path decides, and Allow wins a tie, as in RFC 9309. Plain
+    rules are kept in a trie of their characters, so a path is matched by walking it once,
+    the few rules with * or $ wildcards are compiled into regexes and tried after the walk.
+    '''
+    def __init__(self, rules=(), crawl_delay=None):
+        self.rules = []  # (path, allowed) in the order they were added
+        self.trie = {}  # character : child node, RULE : whether the rule ending at the node allows
+        self.patterns = []  # (length, allowed, regex) of the rules with wildcards
+        self.crawl_delay = crawl_delay  # seconds between two requests asked for by Crawl-delay, or None
+
+        for path, allowed in rules:
+            self.add(path, allowed)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def add(self, path, allowed):
+        self.rules.append((path, allowed))
+
+        if "*" in path or path.endswith("$"):
+            self.patterns.append((len(path), allowed, compile_rule(path)))
+        else:
+            node = self.trie
+            for c in path:
+                node = node.setdefault(c, {})
+            node[RULE] = node.get(RULE, False) or allowed  # a path that's both allowed and disallowed is allowed
+
+    # returns whether the rules allow a path, the part of a url after the site the robots.txt belongs to
+    def allowed(self, path):
+        longest, allowed = 0, True
+
+        node = self.trie
+        for length, c in enumerate(path, 1):
+            node = node.get(c)
+            if node is None:
+                break
+            if RULE in node:
+                longest, allowed = length, node[RULE]
+
+        for length, rule_allowed, pattern in self.patterns:
+            if (length > longest or (length == longest and rule_allowed)) and pattern.match(path):
+                longest, allowed = length, rule_allowed
+
+        return allowed
+
+
+'''
+returns the RobotsRules of the robots.txt text for a user agent
+
+the groups naming the agent are merged, or the "*" groups when none does. Lines before
+the first User-agent line, comments and empty Disallow lines (which allow everything) are ignored
+'''
+def parse_robots_txt(text, agent=ROBOTS_AGENT):
+    groups = []  # ([user agents], [(path, allowed)], crawl delay)
+    in_rules = True  # whether the last line was a rule, so a User-agent line starts a new group
+
+    for line in text.splitlines():
+        field, separator, value = line.split("#", 1)[0].partition(":")
+        field, value = field.strip().lower(), value.strip()
+        if not separator:
+            continue
+
+        if field == "user-agent":
+            if in_rules:
+                groups.append(([], [], []))
+                in_rules = False
+            groups[-1][0].append(value.lower())
+
+        elif groups and field in ("allow", "disallow"):
+            in_rules = True
+            if value:
+                groups[-1][1].append((value if value.startswith(("/", "*")) else "/" + value, field == "allow"))
+
+        elif groups and field == "crawl-delay":
+            in_rules = True
+            try:
+                groups[-1][2].append(float(value))
+            except ValueError:
+                pass
+
+    matched = [group for group in groups if agent in group[0]] or [group for group in groups if "*" in group[0]]
+    delays = [delay for _, _, group_delays in matched for delay in group_delays]
+
+    return RobotsRules([rule for _, rules, _ in matched for rule in rules], max(delays) if delays else None)
+
+
+class RobotsTable:
+    '''
+    The robots.txt rules of the sites visited by a crawl, fetched once per site
+
+    a site is the base url its robots.txt is found under (base + "/robots.txt"), the
+    rules of a url are the rules of the longest site its path starts with. A robots.txt that
+    doesn't exist allows everything and one that can't be fetched disallows everything.
+    fetch_page(url) returns (content, validators, charset) like Fetcher.fetch_url
+    '''
+    def __init__(self, fetch_page=fetch_url, agent=ROBOTS_AGENT):
+        self.fetch_page = fetch_page
+        self.agent = agent
+        self.sites = {}  # base url : RobotsRules
+
+    def __contains__(self, base):
+        return base in self.sites
+
+    # sets the rules of a site
+    def add(self, base, rules):
+        self.sites[base.rstrip("/")] = rules
+
+    # returns the rules of a site, fetching its robots.txt unless they're cached or refresh is True
+    def fetch(self, base, refresh=False):
+        base = base.rstrip("/")
+        if base not in self.sites or refresh:
+            try:
+                text = self.fetch_page(base + "/robots.txt")[0].decode("utf-8", errors="replace")
+                self.sites[base] = parse_robots_txt(text, self.agent)
+            except urllib.error.HTTPError as e:
+                if e.code >= 500:
+                    print("Error fetching robots.txt of " + base + ": " + str(e) + ", nothing will be crawled.")
+                self.sites[base] = RobotsRules([] if e.code < 500 else [("/", False)])
+            except (urllib.error.URLError, OSError) as e:
+                print("Error fetching robots.txt of " + base + ": " + str(e) + ", nothing will be crawled.")
+                self.sites[base] = RobotsRules([("/", False)])
+
+        return self.sites[base]
+
+    # returns (base url, RobotsRules) of the site of a url, or (None, None) when its site isn't in the table
+    def site_of(self, url):
+        site = None
+        for base in self.sites:
+            if url.startswith(base) and url[len(base):len(base) + 1] in ("", "/", "?") \
+                    and (site is None or len(base) > len(site)):
+                site = base
+        return (site, self.sites[site]) if site is not None else (None, None)
+
+    # returns whether the robots.txt of the site of a url allows it, urls of unknown sites are allowed
+    def allowed(self, url):
+        base, rules = self.site_of(url)
+        return rules is None or rules.allowed(url[len(base):] or "/")
+
+    # returns the longest Crawl-delay of the sites in the table, 0 if none asks for one
+    def crawl_delay(self):
+        return max([rules.crawl_delay for rules in self.sites.values() if rules.crawl_delay] or [0])
@@ -1,13 +1,166 @@
-
 import urllib.request
 from bs4 import BeautifulSoup
 import sys
-import re
 import urllib.parse
 import hashlib
-import string
-import codecs
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from nltk.stem import PorterStemmer
+from Fetcher import ConcurrentFetcher, HttpClient
+from InvertedIndex import InvertedIndex
+from CompressedPostings import CompressedIndex
+from Checkpoint import CrawlCheckpoint
+from Tokenizer import VALID_WORD, decode_page, tokenize
+from Instrumentation import stats
+from NearDuplicates import SimHashIndex, simhash
+from Spimi import SpimiIndexer
+from UrlFilter import VALID_URL, RobotsTable, canonicalize_url
+
+# porter stemmer shared by all crawlers, results are memoized in WebCrawler.stem_cache
+stemmer = PorterStemmer()
+
+# documents with fewer words are only collapsed into another document when they're exact duplicates
+MIN_NEAR_DUPLICATE_WORDS = 20
+
+# word : stemmed word, memoizes the stems of count_terms in worker processes
+worker_stem_cache = {}
+
+
+# returns the Counter of the stemmed terms of a list of words
+def count_terms(words):
+    term_counts = Counter()
+
+    for word in words:
+        stem = worker_stem_cache.get(word)
+        if stem is None:
+            stem = worker_stem_cache[word] = stemmer.stem(word)
+        term_counts[stem] += 1
+
+    return term_counts
+
+
+'''
+parses a fetched page, this runs in a worker process when parsing in parallel
+returns (title, DocumentID, words, links, term counts)
+
+words is None for files whose words aren't stored (e.g. images) and term counts
+is None unless stem is set, in which case the words are also counted as stemmed terms
+'''
+def parse_page(current_page, pwd, content, charset, stop_words, stem=False):
+    # convert content to BeautifulSoup for easy html parsing, decoding the page only once
+    soup = BeautifulSoup(decode_page(content, charset), "lxml")
+
+    # grab the title of the page, store file name if title isn't available (e.g. PDF file)
+    current_title = str(soup.title.string) if soup.title is not None else current_page.replace(pwd, '')
+
+    # hash the content of the page to produce a unique DocumentID
+    current_doc_id = WebCrawler.get_doc_id(content)
+
+    words, links, term_counts = None, [], None
+
+    # if the page is an html document, we need to parse it for links
+    if WebCrawler.url_is_document(current_page):
+
+        # remove contents of title tag
+        [s.extract() for s in soup('title')]
+
+        # keep track of only those words that are valid and not in the stop word collection,
+        # tokenizing the text nodes one at a time instead of the whole text of the page
+        with stats.timer("tokenize"):
+            words = list(tokenize(soup.strings, stop_words))
+        stats.count("words_tokenized", len(words))
+
+        links = [link.get('href') for link in soup.find_all('a')]
+
+        if stem:
+            with stats.timer("stem"):
+                term_counts = count_terms(words)
+            stats.count("words_stemmed", len(words))
+
+    stats.count("pages_parsed")
+    return current_title, current_doc_id, words, links, term_counts
+
+
+'''
+parse_page in a worker process, returns (parse_page result, stats the worker recorded)
+the stats are only recorded when enabled, for Stats.merge in the main process
+'''
+def parse_page_in_worker(enabled, *args):
+    stats.enable(enabled)
+    with stats.timer("parse"):
+        parsed = parse_page(*args)
+    return parsed, stats.take()
+
+
+class UrlQueue:
+    '''
+    FIFO queue of urls with constant time membership checks
+
+    a url can only be in the queue once, like the list it replaces
+    '''
+    def __init__(self, urls=()):
+        self.queue = deque()
+        self.members = set()
+        for url in urls:
+            self.append(url)
+
+    def append(self, url):
+        if url not in self.members:
+            self.queue.append(url)
+            self.members.add(url)
+
+    def popleft(self):
+        url = self.queue.popleft()
+        self.members.discard(url)
+        return url
+
+    # returns the first n urls of the queue without removing them
+    def head(self, n):
+        return list(islice(self.queue, n))
+
+    def __contains__(self, url):
+        return url in self.members
+
+    def __iter__(self):
+        return iter(self.queue)
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+
+class UrlSet:
+    '''
+    Insertion ordered set of urls with constant time membership checks
+
+    supports the list methods the crawler used, so reports keep the discovery order
+    '''
+    def __init__(self, urls=()):
+        self.urls = dict.fromkeys(urls)
+
+    def append(self, url):
+        self.urls[url] = None
+
+    def remove(self, url):
+        del self.urls[url]
+
+    def __contains__(self, url):
+        return url in self.urls
+
+    def __iter__(self):
+        return iter(self.urls)
+
+    def __len__(self):
+        return len(self.urls)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return repr(list(self))
 
 
 class WebCrawler:
@@ -17,16 +170,30 @@ class WebCrawler:
         self.robots_txt = None
         self.stop_words_file = None
         self.page_limit = None
-        self.stop_words = []  # list of words to be ignored when processing documents
-        self.url_frontier = []  # list of urls not yet visited
+        self.stop_words = frozenset()  # set of words to be ignored when processing documents
+        self.url_frontier = UrlQueue()  # queue of urls not yet visited
         self.visited_urls = {}  # URL : (Title, DocumentID) (hash of content of a visited URL)
-        self.outgoing_urls = []
-        self.broken_urls = []
-        self.graphic_urls = []
+        self.outgoing_urls = UrlSet()
+        self.broken_urls = UrlSet()
+        self.graphic_urls = UrlSet()
+        self.http_client = HttpClient()  # pooled keep-alive connections the pages are fetched on
+        self.robots = RobotsTable(self.http_client.fetch)  # robots.txt rules of the seed site
         self.all_terms = []  # set of all stemmed terms in all documents
-        self.frequency_matrix = []  # Term doc frequency matrix (row=term, col=doc)
+        self.index = InvertedIndex()  # term : postings of (doc number, term frequency)
         self.num_pages_crawled = 0  # number of valid pages visited
         self.num_pages_indexed = 0  # number of pages whose words have been stored
+        self.num_workers = 1  # number of pages fetched concurrently (1 = serial crawl)
+        self.per_host_limit = None  # maximum concurrent requests to one host
+        self.politeness_delay = 0  # seconds between two requests to the same host
+        self.stem_cache = {}  # word : stemmed word
+        self.stem_at_crawl = False  # count stemmed terms while crawling instead of in build_frequency_matrix
+        self.num_processes = 1  # number of worker processes parsing pages and counting terms (1 = in process)
+        self.checkpoint = None  # CrawlCheckpoint the processed pages are logged to
+        self.resume = False  # continue the crawl logged in the checkpoint instead of starting over
+        self.near_duplicate_index = SimHashIndex(3)  # SimHash fingerprints of the stored documents (None = exact duplicates only)
+        self.near_duplicates = {}  # URL : DocumentID of its content, for pages recorded as a near-duplicate document
+        self.spimi = None  # SpimiIndexer of the documents when they're indexed out of core, without storing their words
+        self.compress_postings = False  # keep the postings of the index compressed (CompressedIndex)
 
         """
         note: the attributes below only contain information from those documents whose 
@@ -36,6 +203,9 @@ class WebCrawler:
         self.doc_urls = {}  # DocumentID: first URL that produces that ID
         self.doc_titles = {}  # DocumentID : title
         self.doc_words = {}  # DocumentID : [words]
+        self.doc_term_counts = {}  # DocumentID : Counter of stemmed terms (only when stemming at crawl time)
+        self.doc_snippets = {}  # DocumentID : first 20 words, for docs indexed without their words
+        self.url_validators = {}  # URL : {"ETag"/"Last-Modified": value} of its last response
 
     # print the report produced from crawling a site
     def __str__(self):
@@ -47,46 +217,105 @@ class WebCrawler:
                  + "\n\nGraphic URLs: " + "\n  +  " + "\n  +  ".join(self.graphic_urls) \
                  + "\n\nDuplicate URLs:\n"
 
-        # print duplicate urls
+        # print duplicate urls, marking the pages that only nearly duplicate the document
         for key in range(len(self.duplicate_urls.keys())):
             report += "\t +  Doc" + str(key + 1) + ":\n"
             for val in list(self.duplicate_urls.values())[key]:
-                report += "\t\t  +  " + val + "\n"
+                report += "\t\t  +  " + val + (" (near-duplicate)" if val in self.near_duplicates else "") + "\n"
 
         return report
 
     '''
     Returns a dictionary of allowed and disallowed urls
-    Adapted from https://stackoverflow.com/a/43086135/8853372
+    fetches the robots.txt of the seed url again into self.robots, which the crawl checks urls against
     '''
     def get_robots_txt(self):
-        # open seed url
-        result = urllib.request.urlopen(self.seed_url + "/robots.txt").read()
+        rules = self.robots.fetch(self.seed_url, refresh=True)
         result_data_set = {"Disallowed": [], "Allowed": []}
 
-        # for reach line in the file
-        for line in result.decode("utf-8").split('\n'):
-            if line.startswith("Allow"):
-                result_data_set["Allowed"].append(
-                    self.seed_url + line.split(": ")[1].split('\r')[0]
-                )  # to neglect the comments or other junk info
-            elif line.startswith("Disallow"):  # this is for disallowed url
-                result_data_set["Disallowed"].append(
-                    self.seed_url + line.split(": ")[1].split('\r')[0]
-                )  # to neglect the comments or other junk info
+        for path, allowed in rules.rules:
+            result_data_set["Allowed" if allowed else "Disallowed"].append(self.seed_url + path)
 
         return result_data_set
 
+    # returns whether or not robots.txt allows crawling a url
+    def url_is_allowed(self, url):
+        return self.robots.allowed(url)
+
+    # returns the seconds between two requests to the same host: the politeness delay or the Crawl-delay of robots.txt
+    def get_fetch_delay(self):
+        return max(self.politeness_delay, self.robots.crawl_delay())
+
     def set_page_limit(self, limit):
         self.page_limit = int(limit)
 
+    # sets the number of fetch workers, the per host request cap and the politeness delay
+    def set_concurrency(self, workers, per_host_limit=None, delay=0):
+        self.num_workers = max(1, int(workers))
+        self.per_host_limit = int(per_host_limit) if per_host_limit else None
+        self.politeness_delay = float(delay)
+
+    # sets the seconds a fetch waits for a host, the retries of a failed fetch and the megabytes of a page kept
+    def set_fetch_options(self, timeout=10, retries=2, max_body_megabytes=10):
+        max_body_bytes = int(float(max_body_megabytes) * 2 ** 20)
+        self.http_client = HttpClient(float(timeout), int(retries), max_body_bytes=max_body_bytes)
+        self.robots.fetch_page = self.http_client.fetch
+
+    '''
+    fetches a url with the http client, see HttpClient.fetch
+    graphics are only recorded, not parsed, so they're fetched with a HEAD request instead of being downloaded,
+    their DocumentID is the hash of the response headers that identify them (see Fetcher.head_content)
+    '''
+    def fetch_page(self, url, validators=None):
+        return self.http_client.fetch(url, validators, "HEAD" if self.url_is_graphic(url) else "GET")
+
+    # stems words as pages are crawled, so build_frequency_matrix only has to merge the counts
+    def set_stem_at_crawl(self, enabled=True):
+        self.stem_at_crawl = bool(enabled)
+
+    '''
+    parses pages and counts the terms of documents on a pool of worker processes
+    the results are still recorded in frontier order, so the crawl and index don't change
+    '''
+    def set_processes(self, processes):
+        self.num_processes = max(1, int(processes))
+
+    '''
+    pages whose SimHash fingerprints differ in at most max_distance bits from a stored document
+    are recorded as that document, None only collapses exact duplicates
+    '''
+    def set_near_duplicates(self, max_distance=3):
+        fingerprints = self.near_duplicate_index.fingerprints if self.near_duplicate_index is not None else {}
+        self.near_duplicate_index = SimHashIndex(max_distance) if max_distance is not None else None
+
+        if self.near_duplicate_index is not None:
+            for doc_id, fingerprint in fingerprints.items():
+                self.near_duplicate_index.add(doc_id, fingerprint)
+
+    '''
+    indexes documents out of core as they're crawled: their term counts go to a SpimiIndexer
+    writing postings runs to directory whenever memory_budget MB of them are in memory, and
+    only a snippet of their words is kept
+    '''
+    def set_spimi(self, directory=None, memory_budget=256):
+        self.spimi = SpimiIndexer(directory, float(memory_budget) * 2 ** 20)
+
+    # keeps the postings of the index delta and variable byte encoded, in memory and in saved index files
+    def set_compression(self, enabled=True):
+        self.compress_postings = bool(enabled)
+
+    # logs the crawl to a checkpoint file, with resume the crawl continues where the file ends
+    def set_checkpoint(self, filename, resume=False, interval=10):
+        self.checkpoint = CrawlCheckpoint(filename, interval)
+        self.resume = resume
+
     # sets the stop words list given a file with stop words separated by line
     def set_stop_words(self, filepath):
         try:
             with open(filepath, "r") as stop_words_file:
                 stop_words = stop_words_file.readlines()
 
-            self.stop_words = [x.strip() for x in stop_words]
+            self.stop_words = frozenset(x.strip() for x in stop_words)
             self.stop_words_file = filepath
 
         except IOError as e:
@@ -97,21 +326,9 @@ class WebCrawler:
             print("Error opening" + filepath + "Unexpected error:", sys.exc_info()[0])
             raise
 
-    '''
-    returns whether or not a url is valid
-    source: https://stackoverflow.com/a/7160778/8853372
-    '''
+    # returns whether or not a url is valid, see UrlFilter.VALID_URL
     def url_is_valid(self, url_string):
-        pattern = re.compile(
-            r'^(?:http|ftp)s?://'  # http:// or https://
-            r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  # domain...
-            r'localhost|'  # localhost...
-            r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
-            r'(?::\d+)?'  # optional port
-            r'(?:/?|[/?]\S+)$',
-            re.IGNORECASE)
-
-        return bool(pattern.match(url_string))
+        return bool(VALID_URL.match(url_string))
 
     '''
     returns whether or not a given word is valid
@@ -119,17 +336,25 @@ class WebCrawler:
     It may contain special characters, but the last character of a word is either alphabetic or numeric.
     '''
     def word_is_valid(self, word):
-        pattern = re.compile(r'^[a-zA-z](\S*)[a-zA-z0-9]$')
+        return bool(VALID_WORD.match(word))
+
+    # returns the porter stem of a word, stemming each distinct word only once
+    def stem(self, word):
+        stem = self.stem_cache.get(word)
+
+        if stem is None:
+            stem = self.stem_cache[word] = stemmer.stem(word)
 
-        return bool(pattern.match(word))
+        return stem
 
-    # returns whether or not the url is within the scope of the seed url
+    # returns whether or not the url is within the scope of the seed url: whether it starts with it
     def url_is_within_scope(self, url_string):
-        return self.seed_url in url_string
+        return url_string.startswith(self.seed_url)
 
     '''
     produces a list of duplicate documents
     populates self.duplicate_urls with DocumentID : [URLs that produce that ID]
+    near-duplicate pages are listed with the document they were recorded as
     '''
     def produce_duplicates(self):
         duplicates = {}
@@ -145,166 +370,524 @@ class WebCrawler:
     def crawl(self):
         # dictionary containing information about the site
         self.robots_txt = self.get_robots_txt()
+        delay = self.get_fetch_delay()
 
         print("robots.txt: " + " ".join("{}{}".format(key, [
             v.replace(self.domain_url, "") for v in val]) for key, val in self.robots_txt.items()) + "\n")
 
         self.url_frontier.append(self.seed_url + "/")
 
-        '''
-        pop from the URL frontier while the queue is not empty
-        links in queue are valid, full urls
-        '''
+        if self.checkpoint is not None:
+            if self.resume and self.checkpoint.get_seed_url() == self.seed_url:
+                self.replay_checkpoint()
+            else:
+                self.checkpoint.reset(self.seed_url)
+
+        try:
+            with stats.timer("crawl"):
+                if self.num_processes > 1:
+                    with ProcessPoolExecutor(self.num_processes) as parser_pool, \
+                            ConcurrentFetcher(self.num_workers, self.per_host_limit, delay,
+                                              self.make_fetch_and_parse(parser_pool)) as fetcher:
+                        self.crawl_frontier(fetcher)
+                elif self.num_workers > 1 or delay > 0:
+                    with ConcurrentFetcher(self.num_workers, self.per_host_limit, delay, self.fetch_page) as fetcher:
+                        self.crawl_frontier(fetcher)
+                else:
+                    self.crawl_frontier()
+        finally:
+            self.http_client.close()
+            self.close_checkpoint()
+
+    # commits and closes the checkpoint, the pages of later crawls aren't logged to it
+    def close_checkpoint(self):
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+            self.checkpoint = None
+
+    '''
+    rebuilds the crawl state from the pages logged in the checkpoint
+    the frontier is popped the way crawl_frontier popped it, so the crawl continues after the last logged page
+    '''
+    def replay_checkpoint(self):
+        replayed = 0
+
+        for url, broken, title, doc_id, words, links, validators in self.checkpoint.pages():
+            # urls disallowed by robots.txt were popped without being logged
+            while self.url_frontier and not self.url_is_allowed(self.url_frontier.head(1)[0]):
+                self.url_frontier.popleft()
+
+            if not self.url_frontier or self.url_frontier.head(1)[0] != url:
+                print("Checkpoint doesn't match the frontier at " + url + ", continuing from there.")
+                break
+
+            self.url_frontier.popleft()
+            replayed += 1
+
+            if broken:
+                if url not in self.broken_urls:
+                    self.broken_urls.append(url)
+            else:
+                self.url_validators[url] = validators
+                self.record_page(url, self.get_pwd(url), title, doc_id, words, links)
+
+        print("Resumed from checkpoint: " + str(replayed) + " pages, " + str(self.num_pages_indexed) + " indexed.\n")
+
+    '''
+    returns a fetch function for a ConcurrentFetcher that hands every fetched page to the parser pool
+    its results are fetch_page results followed by the future of the parse_page_in_worker result
+    '''
+    def make_fetch_and_parse(self, parser_pool):
+        def fetch_and_parse(url, validators=None):
+            content, validators, charset = self.fetch_page(url, validators)
+            parsed = parser_pool.submit(parse_page_in_worker, stats.enabled, url, self.get_pwd(url), content, charset,
+                                        self.stop_words, self.stem_at_crawl)
+            return content, validators, charset, parsed
+
+        return fetch_and_parse
+
+    # returns the parse_page result of a page parsed by a worker process, adding the stats the worker recorded
+    @staticmethod
+    def worker_parse_result(future):
+        parsed, worker_stats = future.result()
+        stats.merge(worker_stats)
+        return parsed
+
+    # returns the present working directory of a url
+    def get_pwd(self, url):
+        return "/".join(url.split("/")[:-1]) + "/"
+
+    '''
+    pop from the URL frontier while the queue is not empty
+    links in queue are valid, full urls
+
+    with a fetcher, the pages at the head of the frontier are fetched ahead of time
+    but still processed one at a time in frontier order, so the crawl is the same
+    breadth first traversal as the serial one
+    '''
+    def crawl_frontier(self, fetcher=None):
+        in_flight = {}  # URL : future of a fetch that has been started ahead of time
+
         while self.url_frontier and (self.page_limit is None or self.num_pages_indexed < self.page_limit):
+            if fetcher is not None:
+                self.prefetch(fetcher, in_flight)
+
             # current_page refers to the url of the current page being processed
-            current_page = self.url_frontier.pop(0)  # select the next url
+            current_page = self.url_frontier.popleft()  # select the next url
 
             # calculate present working directory
-            pwd = "/".join(current_page.split("/")[:-1]) + "/"
+            pwd = self.get_pwd(current_page)
+
+            if self.url_is_allowed(current_page):
+                parsed = None  # future of the page parsed by a worker process
 
-            if pwd not in self.robots_txt["Disallowed"]:
                 try:
                     # hit the current page
-                    handle = urllib.request.urlopen(current_page)
+                    if current_page in in_flight:
+                        content, validators, charset, *parsed = in_flight.pop(current_page).result()
+                    else:
+                        content, validators, charset = self.fetch_page(current_page)
 
-                # basic HTTP error e.g. 404, 501, etc
-                except urllib.error.HTTPError as e:
+                # basic HTTP error e.g. 404, 501, etc, or a page that couldn't be fetched (timeout, refused connection)
+                except urllib.error.URLError as e:
                     if current_page not in self.broken_urls and current_page is not None:
                             self.broken_urls.append(current_page)
-                else:
-                    current_content = str(handle.read())
-
-                    # convert content to BeautifulSoup for easy html parsing
-                    soup = BeautifulSoup(current_content, "lxml")
 
-                    # grab the title of the page, store file name if title isn't available (e.g. PDF file)
-                    current_title = str(soup.title.string) if soup.title is not None else current_page.replace(pwd, '')
-
-                    # hash the content of the page to produce a unique DocumentID
-                    current_doc_id = hashlib.sha256(current_content.encode("utf-8")).hexdigest()
+                    if self.checkpoint is not None:
+                        self.checkpoint.log_broken(current_page)
+                else:
+                    self.url_validators[current_page] = validators
+                    self.process_page(current_page, pwd, content, charset, self.worker_parse_result(parsed[0]) if parsed else None)
 
-                    # mark that the page has been visited by adding to visited_url
-                    self.visited_urls[current_page] = (current_title, current_doc_id)
-                    self.num_pages_crawled += 1
+            else:
+                print("Not allowed: " + current_page.replace(self.domain_url, ""))
 
-                    print(str(self.num_pages_crawled) + ". " + "Visiting: " +
-                          current_page.replace(self.domain_url, "") + " (" + current_title + ")")
+    # starts fetching the allowed urls at the head of the frontier
+    def prefetch(self, fetcher, in_flight):
+        for url in self.url_frontier.head(fetcher.workers * 2):
+            if url not in in_flight and self.url_is_allowed(url):
+                in_flight[url] = fetcher.submit(url)
 
-                    # if the page is an html document, we need to parse it for links
-                    if any((current_page.lower().endswith(ext) for ext in ["/", ".html", ".htm", ".php", ".txt"])):
+    # returns the DocumentID of a page: the hash of its content
+    @staticmethod
+    def get_doc_id(content):
+        return hashlib.sha256(str(content).encode("utf-8")).hexdigest()
 
-                        # remove contents of title tag
-                        [s.extract() for s in soup('title')]
+    # returns whether or not a url is a graphic file
+    @staticmethod
+    def url_is_graphic(url):
+        return any(url.lower().endswith(ext) for ext in [".gif", ".png", ".jpeg", ".jpg"])
 
-                        # format the content of the page
-                        formatted_content = codecs.escape_decode(bytes(soup.get_text().lower(), "utf-8"))[0].decode("utf-8", errors='replace')
+    # returns whether or not a url is a document whose words are stored
+    @staticmethod
+    def url_is_document(url):
+        return any((url.lower().endswith(ext) for ext in ["/", ".html", ".htm", ".php", ".txt"]))
 
-                        # store only the words of the file
-                        content_words = list(re.sub('[' + string.punctuation + ']', '', formatted_content).split())
+    '''
+    stores a fetched page and adds its links to the frontier
+    parsed is the parse_page result of the page when it has already been parsed by a worker process
+    '''
+    def process_page(self, current_page, pwd, content, charset=None, parsed=None):
+        if parsed is None:
+            with stats.timer("parse"):
+                parsed = parse_page(current_page, pwd, content, charset, self.stop_words)
 
-                        # remove the 'b' character that's prepended when converting
-                        content_words[0] = content_words[0][1:]
+        current_title, current_doc_id, words, links, term_counts = parsed
 
-                        # keep track of only those words that are valid and not in the stop word collection
-                        self.doc_words[current_doc_id] = [w for w in content_words
-                                                      if w not in self.stop_words and self.word_is_valid(w)]
+        self.record_page(current_page, pwd, current_title, current_doc_id, words, links, term_counts)
 
-                        # store the title
-                        self.doc_titles[current_doc_id] = current_title
+        if self.checkpoint is not None:
+            self.checkpoint.log_page(current_page, current_title, current_doc_id, words, links,
+                                     self.url_validators.get(current_page, {}))
 
-                        # store the url if it hasn't been stored already (to avoid duplicates)
-                        if current_doc_id not in self.doc_urls:
-                            self.doc_urls[current_doc_id] = current_page
+        print(str(self.num_pages_crawled) + ". " + "Visiting: " +
+              current_page.replace(self.domain_url, "") + " (" + current_title + ")")
 
-                        self.num_pages_indexed += 1
+    '''
+    stores a processed page: words is the list of words of a document or None for other files
+    links are the hrefs of the page and term_counts the stemmed terms counted by a worker process, if any
+    '''
+    def record_page(self, current_page, pwd, current_title, current_doc_id, words, links, term_counts=None):
+        # a document nearly duplicating a stored one is recorded as that document instead of being indexed
+        original = self.find_near_duplicate(current_doc_id, words) if words is not None else None
+        if original is not None:
+            self.near_duplicates[current_page] = current_doc_id
+
+        # mark that the page has been visited by adding to visited_url
+        self.visited_urls[current_page] = (current_title, original or current_doc_id)
+        self.num_pages_crawled += 1
+
+        if words is not None and original is not None:
+            self.num_pages_indexed += 1
+            self.add_links(pwd, links)
+
+        elif words is not None and self.spimi is not None:
+            # the words of a document indexed out of core are counted now and only its snippet is kept
+            if current_doc_id not in self.doc_titles:
+                if term_counts is None:
+                    with stats.timer("stem"):
+                        term_counts = Counter(map(self.stem, words))
+                    stats.count("words_stemmed", len(words))
+                self.spimi.add(current_doc_id, term_counts)
+                self.doc_snippets[current_doc_id] = " ".join(words[:20])
+
+            self.doc_titles[current_doc_id] = current_title
+            if current_doc_id not in self.doc_urls:
+                self.doc_urls[current_doc_id] = current_page
+
+            self.num_pages_indexed += 1
+            self.add_links(pwd, links)
+
+        elif words is not None:
+            self.doc_words[current_doc_id] = words
+
+            if self.stem_at_crawl and term_counts is not None:
+                self.doc_term_counts[current_doc_id] = term_counts
+            elif self.stem_at_crawl:
+                with stats.timer("stem"):
+                    self.doc_term_counts[current_doc_id] = Counter(map(self.stem, words))
+                stats.count("words_stemmed", len(words))
+
+            # store the title
+            self.doc_titles[current_doc_id] = current_title
+
+            # store the url if it hasn't been stored already (to avoid duplicates)
+            if current_doc_id not in self.doc_urls:
+                self.doc_urls[current_doc_id] = current_page
+
+            self.num_pages_indexed += 1
+
+            # go through each link in the page
+            self.add_links(pwd, links)
+
+        # file is a graphic, mark it as such
+        elif self.url_is_graphic(current_page) and current_page not in self.graphic_urls:
+            self.graphic_urls.append(current_page)
 
-                        # go through each link in the page
-                        for link in soup.find_all('a'):
-                            # current_url refers to the current link within the current page being processed
-                            current_url = link.get('href')
+    '''
+    returns the DocumentID of the stored document a new document nearly duplicates, or None
+    the fingerprint of a new document that isn't a near-duplicate is added to near_duplicate_index
+    '''
+    def find_near_duplicate(self, doc_id, words):
+        if self.near_duplicate_index is None or doc_id in self.doc_titles or len(words) < MIN_NEAR_DUPLICATE_WORDS:
+            return None
+
+        with stats.timer("near_duplicates"):
+            fingerprint = simhash(words)
+            original = self.near_duplicate_index.find(fingerprint)
+            if original is None:
+                self.near_duplicate_index.add(doc_id, fingerprint)
+
+        if original is not None:
+            stats.count("near_duplicates")
+        return original
+
+    # sorts the links of a page into the frontier, outgoing and broken urls
+    def add_links(self, pwd, links):
+        for current_url in links:
+            # expand the url to include the domain
+            if current_url is not None and pwd not in current_url:
+                # only works if the resulting link is valid
+                current_url = urllib.parse.urljoin(pwd, current_url)
+
+            # the link should be visited
+            if current_url is not None and self.url_is_valid(current_url):
+                # links to the same page (with a fragment, an upper case host, ...) become the same url
+                current_url = canonicalize_url(current_url)
+
+                # the link is within scope and hasn't been added to the queue
+                if self.url_is_within_scope(current_url):
+
+                    # ensure the hasn't been visited before adding it to the queue
+                    if current_url not in self.url_frontier and current_url not in self.visited_urls:
+                        self.url_frontier.append(current_url)
+
+                elif current_url not in self.outgoing_urls:
+                    self.outgoing_urls.append(current_url)
+
+            # the link is broken
+            elif current_url not in self.broken_urls and current_url is not None:
+                self.broken_urls.append(current_url)
 
-                            # expand the url to include the domain
-                            if current_url is not None and pwd not in current_url:
-                                # only works if the resulting link is valid
-                                current_url = urllib.parse.urljoin(pwd, current_url)
+    '''
+    revisits every visited url with a conditional request, then crawls the frontier
 
-                            # the link should be visited
-                            if current_url is not None and self.url_is_valid(current_url):
+    pages answering 304 Not Modified or producing the same DocumentID are skipped, changed
+    pages are processed again (adding their new links to the frontier) and pages that
+    can't be fetched anymore are dropped. Call update_frequency_matrix afterwards.
+    '''
+    def recrawl(self):
+        # the checkpoint logs a crawl from the seed url, a refresh can't be replayed from it, so it's emptied and left off
+        if self.checkpoint is not None:
+            self.checkpoint.reset(self.seed_url)
+            self.close_checkpoint()
 
-                                # the link is within scope and hasn't been added to the queue
-                                if self.url_is_within_scope(current_url) and current_url not in self.url_frontier:
+        self.robots_txt = self.get_robots_txt()
+        delay = self.get_fetch_delay()
+        known_urls = list(self.visited_urls.items())
+
+        if self.num_processes > 1:
+            with ProcessPoolExecutor(self.num_processes) as parser_pool, \
+                    ConcurrentFetcher(self.num_workers, self.per_host_limit, delay,
+                                      self.make_fetch_and_parse(parser_pool)) as fetcher:
+                futures = [fetcher.submit(url, self.url_validators.get(url)) for url, _ in known_urls]
+                self.revisit(known_urls, [f.result for f in futures])
+                self.crawl_known_frontier(fetcher)
+        elif self.num_workers > 1 or delay > 0:
+            with ConcurrentFetcher(self.num_workers, self.per_host_limit, delay, self.fetch_page) as fetcher:
+                futures = [fetcher.submit(url, self.url_validators.get(url)) for url, _ in known_urls]
+                self.revisit(known_urls, [f.result for f in futures])
+                self.crawl_known_frontier(fetcher)
+        else:
+            self.revisit(known_urls, [lambda url=url: self.fetch_page(url, self.url_validators.get(url))
+                                      for url, _ in known_urls])
+            self.crawl_known_frontier()
+
+        self.http_client.close()
 
-                                    # ensure the hasn't been visited before adding it to the queue
-                                    if current_url not in self.visited_urls.keys():
-                                        self.url_frontier.append(current_url)
+    '''
+    processes the responses of known urls, fetches are callables returning fetch_page results,
+    followed by the future of the parsed page when pages are parsed by worker processes
+    '''
+    def revisit(self, known_urls, fetches):
+        produced = Counter(doc_id for _, (_, doc_id) in known_urls)  # DocumentID : known urls still producing it
+
+        for (url, (_, doc_id)), fetch in zip(known_urls, fetches):
+            try:
+                content, validators, charset, *parsed = fetch()
+            except urllib.error.HTTPError as e:
+                # the page hasn't changed since it was visited
+                if e.code == 304:
+                    continue
+
+                # the page is gone
+                del self.visited_urls[url]
+                self.url_validators.pop(url, None)
+                self.near_duplicates.pop(url, None)
+                self.release_doc(produced, doc_id)
+                if url not in self.broken_urls:
+                    self.broken_urls.append(url)
+                continue
+
+            # the page couldn't be fetched this time (timeouts, refused connections), it's kept as it was
+            except urllib.error.URLError:
+                continue
+
+            self.url_validators[url] = validators
+
+            # near-duplicate pages are compared with their own content, not the document they were recorded as
+            if self.get_doc_id(content) != self.near_duplicates.get(url, doc_id):
+                del self.visited_urls[url]
+                self.near_duplicates.pop(url, None)
+                self.release_doc(produced, doc_id)
+                self.process_page(url, self.get_pwd(url), content, charset, self.worker_parse_result(parsed[0]) if parsed else None)
+
+        self.remove_unvisited_docs()
 
-                                elif not self.url_is_within_scope(current_url) and current_url not in self.outgoing_urls:
-                                    self.outgoing_urls.append(current_url)
+    '''
+    counts a url out of the known urls producing a document, a document no known url produces
+    anymore stops being a near-duplicate candidate, so an edited page isn't recorded as its old version
+    '''
+    def release_doc(self, produced, doc_id):
+        produced[doc_id] -= 1
+        if produced[doc_id] == 0 and self.near_duplicate_index is not None:
+            self.near_duplicate_index.remove(doc_id)
+
+    # continues crawling the frontier with the page counts of the pages that are still visited
+    def crawl_known_frontier(self, fetcher=None):
+        self.num_pages_crawled = len(self.visited_urls)
+        self.num_pages_indexed = sum(1 for url in self.visited_urls if self.url_is_document(url))
+        self.crawl_frontier(fetcher)
+
+    # forgets the documents that no visited url produces anymore
+    def remove_unvisited_docs(self):
+        urls = {}  # DocumentID : [URLs that produce that ID]
+        for url, (_, doc_id) in self.visited_urls.items():
+            urls.setdefault(doc_id, []).append(url)
+
+        for doc_id in list(self.doc_titles):
+            if doc_id not in urls:
+                for attribute in (self.doc_titles, self.doc_urls, self.doc_words, self.doc_term_counts, self.doc_snippets):
+                    attribute.pop(doc_id, None)
+                if self.near_duplicate_index is not None:
+                    self.near_duplicate_index.remove(doc_id)
+
+            # the stored url changed content, another url still produces the document
+            elif self.doc_urls[doc_id] not in urls[doc_id]:
+                self.doc_urls[doc_id] = urls[doc_id][0]
 
-                            # the link is broken
-                            elif current_url not in self.broken_urls and current_url is not None:
-                                self.broken_urls.append(current_url)
+    '''
+    applies the documents added and removed since the index was built to the index
+    only the added documents are counted, but the postings are merged into a new index of every
+    document, so this is not proportional to the changes. Returns (number of docs removed, number of docs added)
+    '''
+    def update_frequency_matrix(self):
+        indexed = set(self.index.docs)
+        removed = indexed - set(self.doc_titles)
+        added = [doc_id for doc_id in self.doc_titles if doc_id not in indexed]
 
-                    # file is a graphic, mark it as such
-                    elif any(current_page.lower().endswith(ext) for ext in [".gif", ".png", ".jpeg", ".jpg"]):
-                        self.graphic_urls.append(current_page)
+        with stats.timer("update_index"):
+            term_counts = self.get_spimi_term_counts(added) if self.spimi is not None else self.get_term_counts(added)
+            self.index = self.index.update(removed, list(zip(added, term_counts)))
+            self.compress_index()
+        self.all_terms = self.index.terms
+        self.record_index_size()
 
-            else:
-                print("Not allowed: " + current_page.replace(self.domain_url, ""))
+        return len(removed), len(added)
 
     '''
-    convert word listings into term-document frequency matrix
-    populates frequency_matrix and all_terms
+    returns the Counters of stemmed terms of documents, in the order of doc_ids
+    the counts stored at crawl time are reused, the others are counted on a pool of
+    worker processes when there are several processes
     '''
-    def build_frequency_matrix(self):
-        if self.doc_words is not None:
-            # use porter stemmer for comparing words
-            stemmer = PorterStemmer()
+    def get_term_counts(self, doc_ids):
+        doc_ids = list(doc_ids)
+        uncounted = [doc_id for doc_id in doc_ids if doc_id not in self.doc_term_counts]
+        counted = {}
+
+        with stats.timer("stem"):
+            if self.num_processes > 1 and len(uncounted) > 1:
+                chunk_size = max(1, len(uncounted) // (self.num_processes * 4))
+                with ProcessPoolExecutor(self.num_processes) as pool:
+                    word_lists = [self.doc_words[doc_id] for doc_id in uncounted]
+                    counted = dict(zip(uncounted, pool.map(count_terms, word_lists, chunksize=chunk_size)))
+            else:
+                for doc_id in uncounted:
+                    counted[doc_id] = Counter(map(self.stem, self.doc_words[doc_id]))
+        if stats.enabled:
+            stats.count("words_stemmed", sum(len(self.doc_words[doc_id]) for doc_id in uncounted))
 
-            # grab the unique, stemmed terms from all the documents
-            self.all_terms = list(set([stemmer.stem(word) for word_list in self.doc_words.values() for word in word_list]))
-            self.all_terms.sort()
+        return [counted[doc_id] if doc_id in counted else self.doc_term_counts[doc_id] for doc_id in doc_ids]
 
-            # initialize frequency matrix for one row per term
-            self.frequency_matrix = [[] for i in self.all_terms]
+    '''
+    returns the Counters of stemmed terms of documents indexed out of core since the last build,
+    in the order of doc_ids, read back from the postings of the SpimiIndexer
+    '''
+    def get_spimi_term_counts(self, doc_ids):
+        recorded = self.spimi.finish()
+        counted = {doc_id: Counter() for doc_id in recorded.docs}
 
-            # add term frequencies to the matrix
-            for term in range(len(self.all_terms)):
-                # append the number of times the stemmed words match
-                frequency_count = []
+        for t, term in enumerate(recorded.terms):
+            start, end = recorded.offsets[t], recorded.offsets[t + 1]
+            for d, f in zip(recorded.doc_ids[start:end].tolist(), recorded.tfs[start:end].tolist()):
+                counted[recorded.docs[d]][term] = f
 
-                for word_list in self.doc_words.values():
-                    stemmed_word_list = [stemmer.stem(word) for word in word_list]
-                    frequency_count.append(stemmed_word_list.count(self.all_terms[term]))
+        return [counted[doc_id] for doc_id in doc_ids]
 
-                self.frequency_matrix[term] = frequency_count
+    '''
+    convert word listings into an inverted index of term frequencies
+    populates index and all_terms
 
-    # returns the contents of self.frequency_matrix
+    every document is counted in a single pass over its words, using the term
+    counts stored at crawl time when there are any. Documents indexed out of core
+    are merged from the runs of the SpimiIndexer instead, the SpimiIndexer only has
+    the documents added since its last index, so building again updates that index
+    '''
+    def build_frequency_matrix(self):
+        if self.spimi is not None and self.spimi.generation > 0:
+            self.update_frequency_matrix()
+
+        elif self.spimi is not None:
+            with stats.timer("build_index"):
+                self.index = self.spimi.finish()
+                self.compress_index()
+            self.all_terms = self.index.terms
+            self.record_index_size()
+
+        elif self.doc_words is not None:
+            # term : ([doc numbers], [term frequencies]), only docs that contain the term are stored
+            postings = {}
+
+            with stats.timer("build_index"):
+                for doc, term_counts in enumerate(self.get_term_counts(self.doc_words)):
+                    for term, count in term_counts.items():
+                        if term not in postings:
+                            postings[term] = ([], [])
+                        postings[term][0].append(doc)
+                        postings[term][1].append(count)
+
+                self.index = InvertedIndex.from_postings(self.doc_words.keys(), postings)
+                self.compress_index()
+
+            # the unique, stemmed terms from all the documents (sorted)
+            self.all_terms = self.index.terms
+            self.record_index_size()
+
+    # compresses the postings of the index when compression is enabled
+    def compress_index(self):
+        if self.compress_postings and not isinstance(self.index, CompressedIndex):
+            self.index = CompressedIndex.from_index(self.index)
+
+    # records the number of docs, terms and postings of the index and the bytes of its postings
+    def record_index_size(self):
+        stats.gauge("docs", self.index.num_docs)
+        stats.gauge("terms", len(self.index))
+        stats.gauge("postings", self.index.num_postings)
+        stats.gauge("postings_bytes", self.index.postings_nbytes())
+
+    # returns the contents of the term-document frequency matrix
     def print_frequency_matrix(self):
         output_string = ","
 
         if self.doc_words is not None:
             # create file heading
-            for i in range(len(self.doc_words.keys())):
+            for i in range(self.index.num_docs):
                 output_string += "Doc" + str(i) + ","
             output_string += "\n"
 
-            # add matrix row to output string
-            for i in range(len(self.frequency_matrix)):
-                output_string += self.all_terms[i] + "," + ",".join([str(i) for i in self.frequency_matrix[i]]) + "\n"
+            # add matrix row to output string, rows are expanded from the postings one at a time
+            for i in range(len(self.index)):
+                output_string += self.index.terms[i] + "," + ",".join([str(i) for i in self.index.dense_row(i)]) + "\n"
 
         return output_string
 
     # returns a zip object containing n elements: (term, total term frequency, doc frequency)
     def n_most_common(self, n):
-        term_totals = []
-        sorted_terms = self.all_terms
-        doc_freqs = []
+        sorted_terms = self.index.terms
 
         # calculate the total frequencies and doc frequencies of each term
-        for row in self.frequency_matrix:
-            term_totals.append(sum(row))
-            doc_freqs.append(sum([1 for x in row if x > 0]))
+        term_totals = self.index.term_totals().tolist()
+        doc_freqs = self.index.doc_freqs().tolist()
 
         # sort terms and doc frequencies based off total frequencies
         sorted_terms = [x for _, x in sorted(zip(term_totals, sorted_terms))]
@@ -312,4 +895,4 @@ class WebCrawler:
         term_totals.sort()
 
         # return n most common
-        return zip(reversed(sorted_terms[-n:]), reversed(term_totals[-n:]), reversed(doc_freqs[-n:]))
\ No newline at end of file
+        return zip(reversed(sorted_terms[-n:]), reversed(term_totals[-n:]), reversed(doc_freqs[-n:]))
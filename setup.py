@@ -9,5 +9,5 @@ setup(
     author='anand',
     author_email = 'anand20280@iiitd.ac.in',
     description = '',
-    install_requires = ['bs4', 'nltk', 'scikit-learn', 'numpy']
+    install_requires = ['bs4', 'nltk', 'numpy', 'scipy']
 )